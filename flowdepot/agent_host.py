@@ -0,0 +1,321 @@
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import glob
+from pathlib import Path
+import threading
+import time
+
+from agentflow.broker import BrokerType
+from agentflow.broker.broker_maker import BrokerMaker
+from agentflow.broker.message_broker import MessageBroker
+from agentflow.broker.notifier import BrokerNotifier
+from agentflow.core.agent import Agent
+from agentflow.core.agent_worker import Worker
+from agentflow.core.parcel import Parcel
+
+from flowdepot.agent_loader import load_agent
+
+import logging
+from flowdepot.app_logger import init_logging
+logger:logging.Logger = init_logging()
+
+
+
+def discover_agents(pattern: str) -> list[str]:
+    """Return the agent directories whose manifest.yaml matches the glob pattern."""
+    manifests = sorted(glob.glob(pattern))
+    return [str(Path(m).parent) for m in manifests]
+
+
+def topic_matches(subscription: str, topic: str) -> bool:
+    """MQTT style topic matching with '+' and '#' wildcards."""
+    sub_levels = subscription.split('/')
+    topic_levels = topic.split('/')
+    for i, level in enumerate(sub_levels):
+        if level == '#':
+            return True
+        if i >= len(topic_levels):
+            return False
+        if level != '+' and level != topic_levels[i]:
+            return False
+    return len(sub_levels) == len(topic_levels)
+
+
+
+class _HostedBroker(MessageBroker):
+    """The broker seen by a hosted agent; all traffic goes through the host's connection."""
+    def __init__(self, host: 'AgentHost', agent: Agent):
+        super().__init__(notifier=agent)
+        self._host = host
+        self._agent = agent
+
+
+    def start(self, options:dict):
+        # The host is connected already; it is the agent's turn, as after a broker's connection.
+        self._agent._on_connect()
+
+
+    def stop(self):
+        pass
+
+
+    def publish(self, topic:str, payload):
+        return self._host.publish(topic, payload)
+
+
+    def subscribe(self, topic:str, data_type):
+        return self._host.subscribe(self._agent, topic, data_type)
+
+
+
+class _HostedWorker(Worker):
+    """
+    The worker of a hosted agent, in place of the thread or process agentflow runs an
+    agent in: is_active() holds until the agent's terminate event is set, by the host
+    or by Agent._terminate(), and terminate() deactivates the agent in the host.
+    """
+    def __init__(self, host: 'AgentHost', agent: Agent, terminate_event: threading.Event):
+        super().__init__(agent)
+        self._host = host
+        self._terminate_event = terminate_event
+
+
+    def create_event(self):
+        return threading.Event()
+
+
+    def is_working(self):
+        return not self._terminate_event.is_set()
+
+
+    def stop(self):
+        self._host.deactivate_agent(self.initiator_agent)
+
+
+
+class AgentHost(BrokerNotifier):
+    """
+    Run several agents in one process over one broker connection and one thread pool.
+
+    Each hosted agent keeps its own handlers, but subscriptions and publications are
+    multiplexed over the host's broker, and the handlers run on a shared
+    ThreadPoolExecutor of max_workers threads instead of a new thread per message.
+    A handler blocked in publish_sync() holds one of them until the response, which
+    needs another, comes; keep max_workers above the number of such calls at a time.
+    """
+    def __init__(self, system_config: dict, max_workers: int = 16):
+        super().__init__()
+        self.system_config = system_config
+        self.max_workers = max_workers
+        self.agents: list[Agent] = []
+        self.standalones: list = []     # Loaded objects that manage their own connection.
+        self.startup_report: list[dict] = []
+        self._reports: dict[int, dict] = {}
+
+        self._broker: MessageBroker = None
+        self._executor: ThreadPoolExecutor = None
+        self._subscriptions: list[tuple[str, Agent]] = []
+        self._subscriptions_lock = threading.Lock()
+        self._handlers: dict[tuple[str, str], callable] = {}    # (agent_id, topic) -> topic_handler
+        self._terminate_events: dict[str, threading.Event] = {}
+        self._deactivated: set[str] = set()
+        self._connected_event = threading.Event()
+        self._terminate_event = threading.Event()
+
+
+    def load(self, agent_dirs: list[str]):
+        """Load the agents; an agent that fails to load is reported and skipped."""
+        for agent_dir in agent_dirs:
+            started = time.perf_counter()
+            try:
+                agent = load_agent(agent_dir)
+            except Exception as ex:
+                logger.exception(ex)
+                agent = None
+            load_seconds = time.perf_counter() - started
+
+            if not agent:
+                logger.error(f"[AgentHost] Failed to load agent: {agent_dir}")
+                self.startup_report.append({'agent_dir': agent_dir, 'name': None, 'load': load_seconds, 'activate': None})
+                continue
+
+            if isinstance(agent, Agent):
+                self.agents.append(agent)
+            else:
+                self.standalones.append(agent)
+            report = {'agent_dir': agent_dir, 'name': agent.__class__.__name__, 'load': load_seconds, 'activate': None}
+            self.startup_report.append(report)
+            self._reports[id(agent)] = report
+            logger.info(f"[AgentHost] Loaded agent: {agent.__class__.__name__} ({load_seconds * 1000:.1f} ms)")
+
+
+    def start(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='agent-host')
+
+        broker_config_all = self.system_config['broker']
+        broker_config = broker_config_all[broker_config_all['broker_name']]
+        self._broker = BrokerMaker().create_broker(BrokerType(broker_config['broker_type'].lower()), self)
+        self._broker.start(options=broker_config)
+        if not self._connected_event.wait(30):
+            raise TimeoutError("The shared broker connection is not established within 30 seconds.")
+
+        for agent in self.agents:
+            self._activate_agent(agent)
+
+        for standalone in self.standalones:
+            started = time.perf_counter()
+            standalone.start_thread()
+            self._reports[id(standalone)]['activate'] = time.perf_counter() - started
+
+        logger.info(f"[AgentHost] Startup time report:\n{self.format_startup_report()}")
+
+
+    def _activate_agent(self, agent: Agent):
+        """Activate the agent as Agent._activate does, but over the host's connection."""
+        started = time.perf_counter()
+        self._attach(agent)
+        try:
+            agent.on_begining()
+            agent._broker = _HostedBroker(self, agent)
+            # Subscribe the to_parent/to_child topics, then call on_connected() on a thread of its own.
+            agent._broker.start(options={})
+            agent.on_activate()
+        except Exception as ex:
+            logger.exception(ex)
+        self._reports[id(agent)]['activate'] = time.perf_counter() - started
+
+
+    def _attach(self, agent: Agent):
+        """
+        Give the agent the state Agent._activate and Agent.__activating create, which
+        agentflow keeps private, and have the host record its topic handlers.
+        put_data()/pop_data() use the data, is_active(), start_interval_loop() and
+        _terminate() the worker and the terminate event.
+        """
+        terminate_event = threading.Event()
+        self._terminate_events[agent.agent_id] = terminate_event
+        agent._Agent__data = {}
+        agent._Agent__data_lock = threading.Lock()
+        agent._Agent__connected_event = threading.Event()
+        agent._Agent__terminate_event = terminate_event
+        agent._Agent__agent_worker = _HostedWorker(self, agent, terminate_event)
+        agent.subscribe = functools.partial(self._subscribe_handler, agent)
+
+
+    def _subscribe_handler(self, agent: Agent, topic, data_type:str="str", topic_handler=None):
+        if topic_handler:
+            self._handlers[(agent.agent_id, topic)] = topic_handler
+        return Agent.subscribe(agent, topic, data_type, topic_handler)
+
+
+    def deactivate_agent(self, agent: Agent):
+        """Terminate one hosted agent; the host and the other agents keep running."""
+        if agent.agent_id in self._deactivated:
+            return
+        self._deactivated.add(agent.agent_id)
+        try:
+            agent.on_terminating()
+        except Exception as ex:
+            logger.exception(ex)
+        self._terminate_events[agent.agent_id].set()
+        with self._subscriptions_lock:
+            self._subscriptions = [(topic, subscriber) for topic, subscriber in self._subscriptions if subscriber is not agent]
+        try:
+            agent.on_terminated()
+        except Exception as ex:
+            logger.exception(ex)
+
+
+    def format_startup_report(self) -> str:
+        lines = [f"{'agent':<20} {'load(ms)':>10} {'activate(ms)':>13}  directory"]
+        for report in self.startup_report:
+            load_ms = f"{report['load'] * 1000:.1f}"
+            activate_ms = f"{report['activate'] * 1000:.1f}" if report['activate'] is not None else '-'
+            lines.append(f"{report['name'] or '(failed)':<20} {load_ms:>10} {activate_ms:>13}  {report['agent_dir']}")
+        return '\n'.join(lines)
+
+
+    def publish(self, topic:str, payload):
+        return self._broker.publish(topic, payload)
+
+
+    def subscribe(self, agent: Agent, topic:str, data_type):
+        with self._subscriptions_lock:
+            is_new_topic = all(sub != topic for sub, _ in self._subscriptions)
+            self._subscriptions.append((topic, agent))
+        if is_new_topic:
+            return self._broker.subscribe(topic, data_type)
+
+
+    def is_active(self):
+        return not self._terminate_event.is_set()
+
+
+    def terminate(self):
+        logger.warning("[AgentHost] Terminating..")
+        agents = [agent for agent in self.agents if agent.agent_id not in self._deactivated]
+        self._deactivated.update(agent.agent_id for agent in agents)
+        for agent in agents:
+            try:
+                agent.on_terminating()
+            except Exception as ex:
+                logger.exception(ex)
+            self._terminate_events[agent.agent_id].set()
+        for standalone in self.standalones:
+            standalone.terminate()
+
+        if self._broker:
+            self._broker.stop()
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+        for agent in agents:
+            try:
+                agent.on_terminated()
+            except Exception as ex:
+                logger.exception(ex)
+        self._terminate_event.set()
+
+
+
+    ####################################
+    # Implementation of BrokerNotifier #
+    ####################################
+
+
+    def _on_connect(self):
+        # Re-subscribe after a reconnection.
+        with self._subscriptions_lock:
+            topics = {topic for topic, _ in self._subscriptions}
+        for topic in topics:
+            self._broker.subscribe(topic, "str")
+        self._connected_event.set()
+
+
+    def _on_message(self, topic:str, payload):
+        with self._subscriptions_lock:
+            agents = [agent for sub, agent in self._subscriptions if topic_matches(sub, topic)]
+        for agent in dict.fromkeys(agents):
+            self._executor.submit(self._dispatch, agent, topic, payload)
+
+
+    def _dispatch(self, agent: Agent, topic:str, payload):
+        # As Agent._on_message does, but on the shared pool.
+        pcl = Parcel.from_payload(payload)
+        topic_handler = self._handlers.get((agent.agent_id, topic), agent.on_message)
+
+        if pcl.topic_return:
+            try:
+                data_resp = topic_handler(topic, pcl)
+            except Exception as ex:
+                logger.exception(ex)
+                pcl.error = str(ex)
+                pcl.content = None
+                data_resp = pcl
+            agent.publish(pcl.topic_return, data_resp)
+        else:
+            try:
+                topic_handler(topic, pcl)
+            except Exception as ex:
+                logger.exception(ex)
+
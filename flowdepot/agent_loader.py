@@ -1,32 +1,60 @@
-import yaml
 import importlib.util
 from pathlib import Path
-from copy import deepcopy
+import time
+
+from flowdepot import startup_profile
+from flowdepot.config_registry import deep_merge, registry, thaw  # deep_merge is kept importable from here.
 
 import logging
 from flowdepot.app_logger import init_logging
 logger:logging.Logger = init_logging()
 
 
-def deep_merge(dict1, dict2):
-    """Recursively merge dict2 into dict1."""
-    result = deepcopy(dict1)
-    for key, value in dict2.items():
-        if (
-            key in result
-            and isinstance(result[key], dict)
-            and isinstance(value, dict)
-        ):
-            result[key] = deep_merge(result[key], value)
-        else:
-            result[key] = deepcopy(value)
-    return result
+def read_manifest(agent_dir: str) -> dict:
+    return registry.load(Path(agent_dir) / "manifest.yaml")
+
+
+def agent_config_paths(agent_dir: str, manifest: dict, agent_config_path: str = '', system_config_path: str = "config/system.yaml") -> list:
+    """The config files of the agent: system.yaml, then agent.yaml."""
+    if not agent_config_path:
+        agent_config_path = manifest.get("config_file")
+    paths = [Path(system_config_path)]
+    if agent_config_path:
+        paths.append(Path(agent_dir) / agent_config_path)
+    return paths
+
+
+def merge_agent_config(agent_dir: str, manifest: dict, agent_config_path: str = '', system_config_path: str = "config/system.yaml") -> dict:
+    """
+    Merge system.yaml + agent.yaml. The merge is memoized by the config registry;
+    the agent gets a mutable copy of it, with dicts and lists as in the YAML.
+    """
+    paths = agent_config_paths(agent_dir, manifest, agent_config_path, system_config_path)
+    agent_config = thaw(registry.merged(*paths))
+    logger.debug(f"Final merged agent_config: {agent_config}")
+
+    return agent_config
+
+
+def load_agent_class(agent_dir: str, manifest: dict):
+    """Execute the entry module of the agent and return its agent class."""
+    entry_file = Path(agent_dir) / manifest["entry_point"]
+    spec = importlib.util.spec_from_file_location("agent_module", entry_file)
+    if spec:
+        module = importlib.util.module_from_spec(spec)
+        if module and spec.loader is not None:
+            spec.loader.exec_module(module)
+            return getattr(module, manifest["class_name"])
+    return None
 
 
 def load_agent(agent_dir: str, agent_config_path: str = '', system_config_path: str = "config/system.yaml"):
     """
     Load an agent using its manifest.yaml and agent.yaml.
     
+    If `replicas` (N > 1) is set in agent.yaml or manifest.yaml, a ReplicaSupervisor
+    running N worker processes of the agent is returned instead.
+
     Parameters:
         agent_path (str): Path to the agent directory.
         config_path (str): Optional path to a shared default config.
@@ -34,46 +62,54 @@ def load_agent(agent_dir: str, agent_config_path: str = '', system_config_path:
     Returns:
         An instance of the agent class.
     """
-    _agent_dir = Path(agent_dir)
-    
-    manifest_file = _agent_dir / "manifest.yaml"
-    # 讀取 manifest.yaml
-    with open(manifest_file, 'r', encoding='utf-8') as f:
-        manifest = yaml.safe_load(f)
+    started = time.perf_counter()
+    manifest = read_manifest(agent_dir)
+    manifest_seconds = time.perf_counter() - started
+    agent_config = merge_agent_config(agent_dir, manifest, agent_config_path, system_config_path)
+    merge_seconds = time.perf_counter() - started - manifest_seconds
 
-    # Merge system.yaml + agent.yaml
-    agent_config = {}
-    
-    # Read system.yaml
-    if Path(system_config_path).exists():
-        with open(system_config_path, 'r', encoding='utf-8') as f:
-            agent_config = yaml.safe_load(f) or {}
-            
-    # Read agent.yaml
-    if not agent_config_path:
-        agent_config_path = manifest.get("config_file")
-    if agent_config_path:
-        _path = _agent_dir / agent_config_path
-        if _path.exists():
-            with open(_path, 'r', encoding='utf-8') as f:
-                agent_cfg = yaml.safe_load(f) or {}
-            # agent_config['agent'] = agent_cfg
-            agent_config = deep_merge(agent_config, agent_cfg)
-    logger.debug(f"Final merged agent_config: {agent_config}")
+    replicas = int(agent_config.get('replicas', manifest.get('replicas', 1)))
+    if replicas > 1:
+        from flowdepot.agent_replicas import ReplicaSupervisor
+        return ReplicaSupervisor(agent_dir, replicas, agent_config, agent_config_path, system_config_path)
+
+    name = agent_config['name']
+    startup_profile.record(name, 'manifest parse', manifest_seconds)
+    startup_profile.record(name, 'config merge', merge_seconds)
 
     # Load agent instance dynamically.
     agent_instance = None
-    entry_point = manifest["entry_point"]
-    class_name = manifest["class_name"]
-
-    entry_file = _agent_dir / entry_point
-    spec = importlib.util.spec_from_file_location("agent_module", entry_file)
-    if spec:
-        module = importlib.util.module_from_spec(spec)
-        if module and spec.loader is not None:
-            spec.loader.exec_module(module)
-            agent_class = getattr(module, class_name)
-            agent_instance = agent_class(agent_config['name'], agent_config)
+    with startup_profile.phase(name, 'module exec'):
+        agent_class = load_agent_class(agent_dir, manifest)
+    if agent_class:
+        agent_instance = agent_class(name, agent_config)
+        if startup_profile.is_enabled():
+            _profile_activation(agent_instance)
+        if hasattr(agent_instance, 'on_config_changed'):
+            _watch_agent_config(agent_instance, agent_dir, manifest, agent_config_path, system_config_path)
     
     return agent_instance
-        
+
+
+def _watch_agent_config(agent, agent_dir, manifest, agent_config_path, system_config_path):
+    """Apply the changes of system.yaml / agent.yaml to the running agent via agent.on_config_changed(config)."""
+    def config_changed():
+        agent.on_config_changed(merge_agent_config(agent_dir, manifest, agent_config_path, system_config_path))
+
+    registry.add_listener(agent_config_paths(agent_dir, manifest, agent_config_path, system_config_path), config_changed)
+
+
+def _profile_activation(agent):
+    """Time on_activate and the subscriptions of the agent."""
+    subscribe, on_activate = agent.subscribe, agent.on_activate
+
+    def timed_subscribe(*args, **kwargs):
+        with startup_profile.phase(agent.name, 'subscribe'):
+            return subscribe(*args, **kwargs)
+
+    def timed_on_activate():
+        with startup_profile.phase(agent.name, 'activate'):
+            on_activate()
+
+    agent.subscribe = timed_subscribe
+    agent.on_activate = timed_on_activate
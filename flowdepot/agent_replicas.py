@@ -0,0 +1,203 @@
+import multiprocessing
+import threading
+import time
+
+from agentflow.broker.message_broker import MessageBroker
+
+import logging
+from flowdepot.app_logger import init_logging
+logger:logging.Logger = init_logging()
+
+
+
+class SharedSubscriptionBroker(MessageBroker):
+    """
+    Wrap the broker of a replica so that its service topics are subscribed as
+    MQTT shared subscriptions ($share/<group>/<topic>). The broker then delivers
+    each message to only one replica of the group.
+    The service topics are recorded in work_topics, also when share is False
+    (a broker without shared subscriptions), so that the replica can tell its
+    work apart from the to_parent/to_child control traffic.
+    """
+    def __init__(self, broker: MessageBroker, agent, group: str, shared_topics: list[str] = None, share: bool = True):
+        super().__init__(notifier=agent)
+        self._broker = broker
+        self._agent = agent
+        self.group = group
+        self.share = share
+        self.shared_topics = set(shared_topics or [])
+        self.work_topics: set[str] = set()
+
+
+    def is_shared(self, topic: str) -> bool:
+        if self.shared_topics:
+            return topic in self.shared_topics
+        # By default, the topics subscribed in on_activate are the service topics.
+        return getattr(self._agent, '_subscribing_service_topics', False)
+
+
+    def start(self, options:dict):
+        return self._broker.start(options)
+
+
+    def stop(self):
+        return self._broker.stop()
+
+
+    def publish(self, topic:str, payload):
+        return self._broker.publish(topic, payload)
+
+
+    def subscribe(self, topic:str, data_type):
+        if self.is_shared(topic):
+            topic = getattr(topic, 'value', topic)     # The value of an AgentTopics member.
+            self.work_topics.add(topic)
+            if self.share:
+                topic = f"$share/{self.group}/{topic}"
+                logger.debug(f"Shared subscription: {topic}")
+        return self._broker.subscribe(topic, data_type)
+
+
+
+def create_replica_class(agent_class, group: str, shared_topics: list[str], counter):
+    """Derive a replica class of agent_class which subscribes with shared subscriptions and counts the work messages it handles."""
+
+    class Replica(agent_class):
+        def _on_connect(self):
+            broker_config_all = self.get_config('broker', {})
+            broker_type = broker_config_all.get(broker_config_all.get('broker_name'), {}).get('broker_type', '')
+            if not isinstance(self._broker, SharedSubscriptionBroker):
+                share = broker_type.lower() == 'mqtt'
+                if not share:
+                    logger.warning(self.M(f"Shared subscriptions are not supported by broker type '{broker_type}', every replica receives all the messages."))
+                self._broker = SharedSubscriptionBroker(self._broker, self, group, shared_topics, share)
+            super()._on_connect()
+
+
+        def on_activate(self):
+            self._subscribing_service_topics = True
+            try:
+                super().on_activate()
+            finally:
+                self._subscribing_service_topics = False
+
+
+        def _on_message(self, topic:str, data):
+            # Count only the work topics, not the to_parent/to_child control traffic.
+            if topic in getattr(self._broker, 'work_topics', ()):
+                with counter.get_lock():
+                    counter.value += 1
+            super()._on_message(topic, data)
+
+    Replica.__name__ = Replica.__qualname__ = agent_class.__name__
+    return Replica
+
+
+def _run_replica(agent_dir: str, agent_config_path: str, system_config_path: str, index: int, group: str, counter, stop_event):
+    from flowdepot.agent_loader import load_agent_class, merge_agent_config, read_manifest
+
+    manifest = read_manifest(agent_dir)
+    agent_config = merge_agent_config(agent_dir, manifest, agent_config_path, system_config_path)
+    agent_class = create_replica_class(load_agent_class(agent_dir, manifest), group, agent_config.get('shared_topics'), counter)
+    agent = agent_class(agent_config['name'], agent_config)
+    logger.info(f"[Replica {index}] Starting {agent_class.__name__}, group: {group}")
+    agent.start_thread()
+
+    while agent.is_active() and not stop_event.is_set():
+        stop_event.wait(1)
+    if agent.is_active():
+        agent.terminate()
+
+
+
+class ReplicaSupervisor:
+    """
+    Run N replicas of an agent in worker processes which share the load of the
+    service topics, restart crashed replicas, and report per-replica throughput.
+    """
+    def __init__(self, agent_dir: str, replicas: int, agent_config: dict, agent_config_path: str = '', system_config_path: str = "config/system.yaml"):
+        self.agent_dir = agent_dir
+        self.replicas = replicas
+        self.agent_config_path = agent_config_path
+        self.system_config_path = system_config_path
+        self.name = agent_config['name']
+        self.group = agent_config.get('replica_group', self.name)
+        self.report_seconds = agent_config.get('replica_report_seconds', 60)
+        self.restart_delay = agent_config.get('replica_restart_delay', 1)
+
+        self._context = multiprocessing.get_context('spawn')
+        self._stop_event = self._context.Event()
+        self._counters = [self._context.Value('Q', 0) for _ in range(replicas)]
+        self._processes: list = [None] * replicas
+        self._restarts = [0] * replicas
+        self._monitor_thread: threading.Thread = None
+
+
+    def _start_replica(self, index: int):
+        process = self._context.Process(
+            target=_run_replica,
+            args=(self.agent_dir, self.agent_config_path, self.system_config_path, index, self.group, self._counters[index], self._stop_event),
+            name=f"{self.name}-replica-{index}",
+            daemon=True)
+        process.start()
+        self._processes[index] = process
+
+
+    def start(self):
+        logger.info(f"[ReplicaSupervisor] Starting {self.replicas} replicas of {self.name}, group: {self.group}")
+        for index in range(self.replicas):
+            self._start_replica(index)
+        self._monitor_thread = threading.Thread(target=self._monitor, name=f"{self.name}-supervisor", daemon=True)
+        self._monitor_thread.start()
+
+
+    def start_thread(self):
+        self.start()
+
+
+    def start_process(self):
+        self.start()
+
+
+    def is_active(self):
+        return not self._stop_event.is_set()
+
+
+    def terminate(self):
+        logger.warning(f"[ReplicaSupervisor] Terminating {self.name}..")
+        self._stop_event.set()
+        for process in self._processes:
+            if process:
+                process.join(10)
+                if process.is_alive():
+                    process.terminate()
+
+
+    def stats(self) -> list[dict]:
+        return [{
+            'replica': index,
+            'pid': process.pid if process else None,
+            'alive': bool(process and process.is_alive()),
+            'restarts': self._restarts[index],
+            'messages': self._counters[index].value,
+        } for index, process in enumerate(self._processes)]
+
+
+    def _monitor(self):
+        last_report = time.monotonic()
+        last_counts = [0] * self.replicas
+
+        while not self._stop_event.wait(1):
+            for index, process in enumerate(self._processes):
+                if process and not process.is_alive():
+                    logger.error(f"[ReplicaSupervisor] Replica {index} of {self.name} exited (code: {process.exitcode}), restarting..")
+                    self._restarts[index] += 1
+                    time.sleep(self.restart_delay)
+                    if not self._stop_event.is_set():
+                        self._start_replica(index)
+
+            if (elapsed := time.monotonic() - last_report) >= self.report_seconds:
+                counts = [counter.value for counter in self._counters]
+                report = ', '.join(f"#{i}: {(counts[i] - last_counts[i]) / elapsed:.2f} msg/s (restarts: {self._restarts[i]})" for i in range(self.replicas))
+                logger.info(f"[ReplicaSupervisor] {self.name} throughput: {report}")
+                last_report, last_counts = time.monotonic(), counts
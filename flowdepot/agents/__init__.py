@@ -6,29 +6,29 @@ import logging
 import os
 import signal
 import time
-import yaml
+
+from flowdepot.config_registry import registry, thaw
 
 
 LOGGER_NAME = os.environ.get('LOGGER_NAME', 'flowdepot')
 
 
 def load_config_from_yaml(file_path):
-    with open(file_path, 'r', encoding='utf-8') as f:
-        return yaml.safe_load(f)
+    return registry.load(file_path)
 
 config_path = os.path.join(os.getcwd(), 'config', 'system.yaml')
 config = load_config_from_yaml(config_path)
 
 
 def get_agent_config():
-    global config
+    config = load_config_from_yaml(config_path)     # The current one if system.yaml has changed.
 
     broker_name = config['broker']['broker_name']
 
     agent_config = {
         'version': config['system']['version'],
         'broker': {
-            **config['broker'].get(broker_name, {})
+            **thaw(config['broker'].get(broker_name, {}))
         }
     }
 
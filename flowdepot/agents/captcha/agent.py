@@ -1,17 +1,19 @@
 # flowdepot\agents\captcha\agent.py
 # pip install --upgrade openai>=1.40.0
  
-import base64
+from concurrent.futures import ThreadPoolExecutor
 import magic
 import mimetypes
-from openai import OpenAI
 import os
 from pathlib import Path
-import tempfile
+import threading
 import yaml
 
 from agentflow.core.agent import Agent
 from agentflow.core.parcel import BinaryParcel
+from flowdepot.agents.captcha.phash_cache import PerceptualHashCache
+from flowdepot.agents.captcha.preprocess import ImagePreprocessor
+from flowdepot.agents.captcha.recognizers import OpenAIRecognizer, create_recognizer
 from flowdepot.agents.topics import AgentTopics
 
 import logging
@@ -20,35 +22,104 @@ logger:logging.Logger = init_logging()
 
 
 
+
 class CaptchaService(Agent):
     def __init__(self, name, agent_config):
         logger.info(f"name: {name}, agent_config: {agent_config}")
         super().__init__(name, agent_config)
-        self.openai_client = OpenAI(api_key=agent_config.get("openai_api_key", ""))
-        logger.info(f"OpenAI API Key: {self.openai_client.api_key}")
-        
-        # Create "temp" folder in current execution path if it doesn't exist for audio files.
-        self.temp_root = Path.cwd() / "temp"
-        self.temp_root.mkdir(exist_ok=True)
+        # One libmagic handle, python-magic serializes the calls on it.
+        self.mime = magic.Magic(mime=True)
+
+        # Grayscale, crop, downscale and re-encode before sending, to cut the payload and image tokens.
+        self.preprocessor = ImagePreprocessor(
+            max_dimension=agent_config.get("preprocess_max_dimension", 256),
+            grayscale=agent_config.get("preprocess_grayscale", True),
+            crop=agent_config.get("preprocess_crop", True),
+            image_format=agent_config.get("preprocess_format", "png"),
+            colors=agent_config.get("preprocess_colors", 8),
+        ) if agent_config.get("preprocess", False) else None
+        self.remote_recognizer = OpenAIRecognizer(
+            api_key=agent_config.get("openai_api_key", ""),
+            image_detail=agent_config.get("image_detail", "auto"),     # low: a fixed, small number of image tokens.
+            preprocessor=self.preprocessor,
+        )
+
+        # Recognized on the CPU first, sent to the remote model below min_confidence; off by default.
+        self.local_recognizer = None
+        if local_name := agent_config.get("local_recognizer", ""):
+            try:
+                self.local_recognizer = create_recognizer(local_name, agent_config.get("local_recognizer_params"))
+            except ImportError as ex:
+                logger.warning(f"The local captcha recognizer is disabled, {ex}")
+        self.min_confidence = agent_config.get("min_confidence", 0.9)
+        self._counts_lock = threading.Lock()
+        self.counts = {'local': 0, 'remote': 0, 'confirmations': 0, 'disagreements': 0}
+
+        # Results of images seen before, or of copies re-encoded or rescaled, by a perceptual hash.
+        self.result_cache = PerceptualHashCache(
+            max_distance=agent_config.get("cache_max_distance", 0),
+            ttl=agent_config.get("cache_ttl_seconds", 3600),
+            max_entries=agent_config.get("cache_max_entries", 10000),
+            path=agent_config.get("cache_path"),
+        ) if agent_config.get("cache", False) else None
+
+        # A batch of images is packed into as few requests as these limits allow, sent concurrently.
+        self.batch_max_images = agent_config.get("batch_max_images", 10)
+        self.batch_max_bytes = agent_config.get("batch_max_bytes", 8 * 1024 * 1024)
+        self.batch_executor = ThreadPoolExecutor(
+            max_workers=agent_config.get("batch_max_concurrency", 4), thread_name_prefix='captcha-batch')
 
 
     def on_activate(self):
         self.subscribe(AgentTopics.CAPTCHA_RECOGNIZE, "str", self.recognize_captcha)
+        self.subscribe(AgentTopics.CAPTCHA_STATS, "str", self.handle_stats)
+
+
+    def on_terminated(self):
+        self.batch_executor.shutdown(wait=False, cancel_futures=True)
+        if self.result_cache and self.result_cache.path:
+            self.result_cache.save()
+
+
+    def handle_stats(self, topic:str, pcl:BinaryParcel):
+        """Return the hit rate of the result cache, and the images recognized by each backend."""
+        with self._counts_lock:
+            counts = dict(self.counts)
+        return {
+            'cache': self.result_cache.stats() if self.result_cache else None,
+            'recognizers': {
+                **counts,
+                'local_stats': self.local_recognizer.stats() if self.local_recognizer else None,
+            },
+        }
+
+
+    def _count(self, backend, images=1):
+        with self._counts_lock:
+            self.counts[backend] += images
 
 
     def recognize_captcha(self, topic:str, pcl:BinaryParcel):
         captcha_info: dict = pcl.content or {}
+        if 'images' in captcha_info:
+            return self._recognize_batch(topic, captcha_info['images'])
+
         img_content = captcha_info.get('content')
         file_mime_type = captcha_info.get('mime_type')
 
-        mime = magic.Magic(mime=True)
         response = {}
         try:
             if not file_mime_type:
-                file_mime_type = mime.from_buffer(img_content)
+                file_mime_type = self.mime.from_buffer(img_content)
             logger.info(f'file_mime_type: {file_mime_type}')
             if file_mime_type.startswith('image/'):
-                response['text'] = self._recognize_captcha(topic, img_content, file_mime_type.split('/')[-1])
+                if self.result_cache and (text := self.result_cache.get(img_content)) is not None:
+                    response['cached'] = True
+                else:
+                    text, response['recognizer'] = self._recognize(img_content, file_mime_type)
+                    if self.result_cache and text:
+                        self.result_cache.put(img_content, text)
+                response['text'] = text
                 response['mime_type'] = file_mime_type
                 response['topic'] = topic
             else:
@@ -60,44 +131,116 @@ class CaptchaService(Agent):
         return response
 
 
-    def _recognize_captcha(self, _, content, file_type):
-        
-        def to_data_url(path: str) -> str:
-            with open(path, "rb") as f:
-                b64 = base64.b64encode(f.read()).decode("utf-8")
-            return f"data:image/{file_type};base64,{b64}"
-    
+    def _recognize_locally(self, content, mime_type):
+        """The text if the local recognizer is confident enough, else None."""
+        if not self.local_recognizer:
+            return None
+        try:
+            text, confidence = self.local_recognizer.recognize(content, mime_type)
+        except Exception as ex:
+            logger.warning(f"The local recognizer failed: {ex}")
+            return None
+        logger.debug(f"Local recognition: {text}, confidence: {confidence:.3f}")
+        if confidence < self.min_confidence:
+            return None
+        self._count('local')
+        return text
+
+
+    def _learn(self, content, data_url, text):
+        """
+        Let the local recognizer learn the answer of the remote model, in the background,
+        once a second remote answer agrees: a wrong answer learned would be served locally for good.
+        """
+        if self.local_recognizer and self.local_recognizer.learn_enabled and text:
+            self.batch_executor.submit(self._confirm_and_learn, content, data_url, text)
 
-        def ocr_id(image_path: str) -> str:
-            """用 gpt-4o-mini 進行 OCR，回傳純文字"""
-            data_url = to_data_url(image_path)
-            resp = self.openai_client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": "請輸出圖片中的純文字，不要任何解釋或符號。"},
-                        {"type": "image_url", "image_url": {"url": data_url}},
-                    ],
-                }],
-                temperature=0,
-            )
-            content = resp.choices[0].message.content
-            
-            return content.strip() if content else ""
-       
-        with tempfile.NamedTemporaryFile(mode="wb", suffix=f".{file_type}", delete=False) as tmp:
-            tmp.write(content)
-            tmp.flush()
-            file_path = Path(tmp.name)
 
+    def _confirm_and_learn(self, content, data_url, text):
         try:
-            recognized_text = ocr_id(str(file_path))
-        finally:
-            if file_path.exists():
-                os.remove(file_path)
+            confirmed = self.remote_recognizer.recognize_urls({0: data_url}).get(0)
+            self._count('confirmations')
+            if confirmed != text:
+                self._count('disagreements')
+                logger.info(f"The remote answers disagree, {text} and {confirmed}, not learned.")
+                return
+            self.local_recognizer.learn(content, text)
+        except Exception as ex:
+            logger.warning(f"The local recognizer failed to learn: {ex}")
+
+
+    def _recognize(self, content, mime_type) -> tuple[str, str]:
+        """Returns the text and the name of the recognizer."""
+        if (text := self._recognize_locally(content, mime_type)) is not None:
+            return text, self.local_recognizer.name
+
+        data_url = self.remote_recognizer.data_url(content, mime_type)
+        text, _ = self.remote_recognizer.recognize_url(data_url)
+        self._count('remote')
+        self._learn(content, data_url, text)
+        return text, self.remote_recognizer.name
+
+
+    def _recognize_batch(self, topic:str, images:list[dict]):
+        """
+        Recognize a list of images, each {'content', 'mime_type' (optional)}.
+        Returns {'results': [{'index', 'text', 'cached', 'recognizer'} or {'index', 'error'}], 'topic'}, in the order of images.
+        """
+        results = [{'index': index} for index in range(len(images))]
+        pending = []        # (index, content, image url)
+        for index, image in enumerate(images):
+            try:
+                content = image.get('content')
+                file_mime_type = image.get('mime_type') or self.mime.from_buffer(content)
+                if not file_mime_type.startswith('image/'):
+                    results[index]['error'] = 'Content is not image.'
+                elif self.result_cache and (text := self.result_cache.get(content)) is not None:
+                    results[index].update(text=text, cached=True)
+                elif (text := self._recognize_locally(content, file_mime_type)) is not None:
+                    results[index].update(text=text, cached=False, recognizer=self.local_recognizer.name)
+                    if self.result_cache and text:
+                        self.result_cache.put(content, text)
+                else:
+                    pending.append((index, content, self.remote_recognizer.data_url(content, file_mime_type)))
+            except Exception as ex:
+                logger.exception(ex)
+                results[index]['error'] = str(ex)
+
+        packs = self._pack(pending)
+        logger.info(f"{len(images)} images, {len(pending)} to recognize remotely in {len(packs)} requests.")
+        futures = [self.batch_executor.submit(self.remote_recognizer.recognize_urls, {index: data_url for index, _, data_url in pack})
+                   for pack in packs]
+        for pack, future in zip(packs, futures):
+            try:
+                texts = future.result()
+            except Exception as ex:
+                logger.exception(ex)
+                texts, error = {}, str(ex)
+            else:
+                error = 'No result for the image.'
+            self._count('remote', len(texts))
+            for index, content, data_url in pack:
+                if (text := texts.get(index)) is None:
+                    results[index]['error'] = error
+                    continue
+                results[index].update(text=text, cached=False, recognizer=self.remote_recognizer.name)
+                self._learn(content, data_url, text)
+                if self.result_cache and text:
+                    self.result_cache.put(content, text)
+
+        return {'results': results, 'topic': topic}
+
 
-        return recognized_text
+    def _pack(self, pending:list) -> list[list]:
+        """Split the images into requests of at most batch_max_images images and batch_max_bytes of image urls."""
+        packs, size = [], 0
+        for item in pending:
+            if not packs or len(packs[-1]) >= self.batch_max_images or size + len(item[2]) > self.batch_max_bytes:
+                packs.append([])
+                size = 0
+            packs[-1].append(item)
+            size += len(item[2])
+        return packs
     
     
 def main():
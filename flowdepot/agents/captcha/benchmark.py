@@ -0,0 +1,94 @@
+"""
+Benchmark the captcha image path, without a broker.
+
+    python -m flowdepot.agents.captcha.benchmark --requests 200
+    python -m flowdepot.agents.captcha.benchmark --remote --requests 5
+
+Compares preparing the request as before (a new magic.Magic, a temporary file
+written and read back, then base64) against the in-memory path, with and
+without preprocessing, by latency and payload size, and the local template
+recognizer. --remote also sends the requests to the vision model, with the key
+in agents/captcha/agent.yaml.
+"""
+import argparse
+import base64
+import os
+from pathlib import Path
+import statistics
+import tempfile
+import time
+
+import magic
+
+from flowdepot.agents.captcha.agent import CaptchaService
+from flowdepot.config_registry import registry, thaw
+
+
+SAMPLE_IMAGE = Path(__file__).parents[2] / "unit_test" / "data" / "captcha-56839.png"
+
+
+
+def prepare_with_temp_file(content) -> str:
+    """The image path before it was kept in memory."""
+    file_type = magic.Magic(mime=True).from_buffer(content).split('/')[-1]
+    with tempfile.NamedTemporaryFile(mode="wb", suffix=f".{file_type}", delete=False) as tmp:
+        tmp.write(content)
+        file_path = tmp.name
+    try:
+        with open(file_path, "rb") as f:
+            b64 = base64.b64encode(f.read()).decode("utf-8")
+    finally:
+        os.remove(file_path)
+    return f"data:image/{file_type};base64,{b64}"
+
+
+def prepare_in_memory(service: CaptchaService, content) -> str:
+    mime_type = service.mime.from_buffer(content)
+    if service.preprocessor:
+        content, mime_type = service.preprocessor.process(content)
+    return f"data:{mime_type};base64,{base64.b64encode(content).decode('utf-8')}"
+
+
+def measure(label, func, requests):
+    func()      # Warm up.
+    latencies = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        result = func()
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    size = f", payload {len(result):6d} B" if isinstance(result, str) else ""
+    print(f"{label:>24}: mean {statistics.mean(latencies) * 1000:8.2f} ms, "
+          f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:8.2f} ms{size}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Captcha image path benchmark.")
+    parser.add_argument("--image", type=Path, default=SAMPLE_IMAGE)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--remote", action="store_true", help="Include the vision model call.")
+    args = parser.parse_args()
+
+    content = args.image.read_bytes()
+    agent_config = thaw(registry.load(Path(__file__).parent / "agent.yaml", missing_ok=True))
+    # The local recognizer times a match against the templates of the image itself.
+    plain = CaptchaService("captcha-benchmark", {**agent_config, "preprocess": False, "local_recognizer": "templates",
+                                                 "local_recognizer_params": {"samples": [str(args.image)]}})
+    preprocessed = CaptchaService("captcha-benchmark", {**agent_config, "preprocess": True})
+
+    measure("temp file", lambda: prepare_with_temp_file(content), args.requests)
+    measure("in memory", lambda: prepare_in_memory(plain, content), args.requests)
+    measure("in memory, preprocessed", lambda: prepare_in_memory(preprocessed, content), args.requests)
+
+    mime_type = plain.mime.from_buffer(content)
+    if plain.local_recognizer:
+        text, confidence = plain.local_recognizer.recognize(content, mime_type)
+        print(f"{'local':>24}: {text}, confidence {confidence:.3f}")
+        measure("local", lambda: plain.local_recognizer.recognize(content, mime_type), args.requests)
+    if args.remote:
+        measure("remote", lambda: plain.remote_recognizer.recognize(content, mime_type), args.requests)
+        measure("remote, preprocessed", lambda: preprocessed.remote_recognizer.recognize(content, mime_type), args.requests)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+from collections import OrderedDict
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+
+import logging
+from flowdepot.app_logger import init_logging
+logger:logging.Logger = init_logging()
+
+
+
+def dhash(content: bytes, hash_size: int = 16) -> int:
+    """
+    The difference hash of an image: the signs of the horizontal gradients of the
+    grayscale image shrunk to (hash_size + 1) x hash_size, as a hash_size² bit int.
+    Re-encoded, rescaled or slightly recolored copies get the same or a close hash.
+    """
+    from PIL import Image       # Deferred, and optional.
+
+    image = Image.open(io.BytesIO(content)).convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = image.tobytes()       # One byte per pixel, row by row.
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+
+class PerceptualHashCache:
+    """
+    Results by image, matched by the dHash of the image: the same hash (an exact hit),
+    or a hash within max_distance bits (Hamming distance) of a cached one (a perceptual hit).
+    The captchas of one generator are near-duplicates by design, so a max_distance
+    above 0 may answer a captcha with the text of another one; 0 by default.
+
+    The hashes are split into max_distance + 1 bands and indexed by band: two hashes
+    within max_distance differ in at most max_distance bands, so they share at least
+    one band value, and only the hashes sharing a band are compared.
+
+    Entries expire after ttl seconds, the least recently used are evicted beyond
+    max_entries, and with path the entries are saved to and loaded from a JSON file.
+    Without Pillow, or for an image it can't decode, an entry is keyed by the SHA-256
+    of the content, a str kept out of the band index, and matches the same bytes only.
+    """
+    def __init__(self, max_distance: int = 0, hash_size: int = 16, ttl: float = 3600,
+                 max_entries: int = 10000, path: str = None, save_seconds: float = 60):
+        self.max_distance = max_distance
+        self.hash_size = hash_size
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path = path
+        self.save_seconds = save_seconds
+
+        bits = hash_size * hash_size
+        bands = max_distance + 1
+        self._bands = [(bits * i // bands, bits * (i + 1) // bands) for i in range(bands)]
+        self._entries: OrderedDict = OrderedDict()     # phash or sha256: (value, expire_at), expire_at in epoch seconds.
+        self._index: list[dict] = [{} for _ in self._bands]
+        self._hashes: dict = {}     # sha256: phash, saves decoding an image seen before.
+        self._lock = threading.Lock()
+        self._saved_at = time.time()
+        self.exact_hits = 0
+        self.perceptual_hits = 0
+        self.misses = 0
+
+        try:
+            import PIL      # noqa: F401
+            self._perceptual = True
+        except ImportError:
+            self._perceptual = False
+            logger.warning("Pillow is not installed, captcha results are cached by exact content only.")
+        if path:
+            self.load()
+
+
+    def _band_keys(self, phash: int):
+        for i, (start, end) in enumerate(self._bands):
+            yield i, (phash >> start) & ((1 << (end - start)) - 1)
+
+
+    def _hash(self, content: bytes) -> int | str:
+        """The dHash of the image, or the SHA-256 of the content, which matches the same bytes only."""
+        digest = hashlib.sha256(content).hexdigest()
+        if (phash := self._hashes.get(digest)) is not None:
+            return phash
+        if not self._perceptual:
+            return digest
+        try:
+            phash = dhash(content, self.hash_size)
+        except Exception as ex:
+            logger.warning(f"Failed to hash the image: {ex}")
+            return digest
+
+        with self._lock:
+            if len(self._hashes) >= 2 * self.max_entries:
+                self._hashes.clear()
+            self._hashes[digest] = phash
+        return phash
+
+
+    def _add(self, phash, value, expire_at):
+        self._entries[phash] = (value, expire_at)
+        if isinstance(phash, int):
+            for i, key in self._band_keys(phash):
+                self._index[i].setdefault(key, set()).add(phash)
+
+
+    def _remove(self, phash):
+        if self._entries.pop(phash, None) is None or not isinstance(phash, int):
+            return
+        for i, key in self._band_keys(phash):
+            if (hashes := self._index[i].get(key)) is not None:
+                hashes.discard(phash)
+                if not hashes:
+                    del self._index[i][key]
+
+
+    def _find(self, phash, now) -> int | None:
+        """The nearest unexpired hash within max_distance; the expired ones met are removed."""
+        if not isinstance(phash, int):
+            if phash in self._entries and self._entries[phash][1] < now:
+                self._remove(phash)
+            return phash if phash in self._entries else None
+
+        candidates = {phash} if phash in self._entries else set()
+        for i, key in self._band_keys(phash):
+            candidates |= self._index[i].get(key, set())
+        best, best_distance = None, self.max_distance + 1
+        for candidate in candidates:
+            if (distance := (candidate ^ phash).bit_count()) >= best_distance:
+                continue
+            if self._entries[candidate][1] < now:
+                self._remove(candidate)
+            else:
+                best, best_distance = candidate, distance
+        return best
+
+
+    def get(self, content: bytes, default=None):
+        phash = self._hash(content)
+        now = time.time()
+        with self._lock:
+            if (found := self._find(phash, now)) is not None:
+                self._entries.move_to_end(found)
+                if found == phash:
+                    self.exact_hits += 1
+                else:
+                    self.perceptual_hits += 1
+                return self._entries[found][0]
+            self.misses += 1
+            return default
+
+
+    def put(self, content: bytes, value):
+        phash = self._hash(content)
+        with self._lock:
+            self._remove(phash)
+            self._add(phash, value, time.time() + self.ttl)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+            save = self.path and time.time() - self._saved_at > self.save_seconds
+        if save:
+            self.save()
+
+
+    @staticmethod
+    def _saved_key(phash) -> dict:
+        return {'hash': format(phash, 'x')} if isinstance(phash, int) else {'sha256': phash}
+
+
+    def save(self):
+        with self._lock:
+            now = time.time()
+            entries = [{**PerceptualHashCache._saved_key(phash), 'value': value, 'expire_at': expire_at}
+                       for phash, (value, expire_at) in self._entries.items() if expire_at > now]
+            self._saved_at = now
+        tmp_path = f"{self.path}.tmp"
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as fp:
+            json.dump({'hash_size': self.hash_size, 'entries': entries}, fp)
+        os.replace(tmp_path, self.path)
+        logger.debug(f"{len(entries)} captcha results are saved to {self.path}")
+
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as fp:
+            data = json.load(fp)
+        if data.get('hash_size') != self.hash_size:
+            logger.warning(f"The hash size of {self.path} is different, the saved results are ignored.")
+            return
+        now = time.time()
+        with self._lock:
+            for entry in data['entries']:
+                if entry['expire_at'] > now:
+                    key = int(entry['hash'], 16) if 'hash' in entry else entry['sha256']
+                    self._add(key, entry['value'], entry['expire_at'])
+        logger.info(f"{len(self._entries)} captcha results are loaded from {self.path}")
+
+
+    def stats(self) -> dict:
+        hits = self.exact_hits + self.perceptual_hits
+        requests = hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'exact_hits': self.exact_hits,
+            'perceptual_hits': self.perceptual_hits,
+            'misses': self.misses,
+            'hit_rate': hits / requests if requests else 0.0,
+        }
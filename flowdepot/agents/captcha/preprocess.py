@@ -0,0 +1,67 @@
+import io
+
+import logging
+from flowdepot.app_logger import init_logging
+logger:logging.Logger = init_logging()
+
+
+
+class ImagePreprocessor:
+    """
+    Shrink a captcha image before it is sent to a vision model: grayscale, crop to
+    the text, downscale to max_dimension and re-encode, all in memory.
+    Pillow is optional (pip install pillow); without it, the images are sent as they are.
+
+    Parameters:
+        max_dimension (int): The longer side is downscaled to this, 0 to keep the size.
+        grayscale (bool): Drop the colors.
+        crop (bool): Crop to the bounding box of the pixels darker than the background.
+        image_format (str): png (lossless, best for text), jpeg or webp.
+        colors (int): For png, the palette size, 0 to keep all the colors; captcha text stays legible with a few.
+        quality (int): For jpeg and webp.
+    """
+    def __init__(self, max_dimension: int = 256, grayscale: bool = True, crop: bool = True,
+                 image_format: str = 'png', colors: int = 8, quality: int = 85):
+        self.max_dimension = max_dimension
+        self.grayscale = grayscale
+        self.crop = crop
+        self.image_format = image_format.lower()
+        self.colors = colors
+        self.quality = quality
+
+        try:
+            from PIL import Image       # Deferred, and optional.
+            self._image = Image
+        except ImportError:
+            self._image = None
+            logger.warning("Pillow is not installed, captcha images are not preprocessed.")
+
+
+    def process(self, content: bytes) -> tuple[bytes, str]:
+        """Returns the processed image and its mime type, or the content and None if Pillow is missing."""
+        if not self._image:
+            return content, None
+
+        image = self._image.open(io.BytesIO(content))
+        image = image.convert('L' if self.grayscale else 'RGB')
+
+        if self.crop:
+            # The text is darker than the background; getbbox() finds the non-zero pixels.
+            gray = image if image.mode == 'L' else image.convert('L')
+            mask = gray.point(lambda value: 255 if value < 160 else 0)
+            if bbox := mask.getbbox():
+                margin = 2
+                image = image.crop((max(0, bbox[0] - margin), max(0, bbox[1] - margin),
+                                    min(image.width, bbox[2] + margin), min(image.height, bbox[3] + margin)))
+
+        if self.max_dimension and max(image.size) > self.max_dimension:
+            image.thumbnail((self.max_dimension, self.max_dimension), self._image.LANCZOS)
+
+        buffer = io.BytesIO()
+        if self.image_format == 'png':
+            if self.colors:
+                image = image.quantize(colors=self.colors)
+            image.save(buffer, format='PNG')
+        else:
+            image.save(buffer, format=self.image_format.upper(), quality=self.quality)
+        return buffer.getvalue(), f"image/{self.image_format}"
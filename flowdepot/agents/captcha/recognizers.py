@@ -0,0 +1,286 @@
+from abc import ABC, abstractmethod
+import base64
+import io
+import json
+import os
+from pathlib import Path
+import re
+import threading
+
+import logging
+from flowdepot.app_logger import init_logging
+logger:logging.Logger = init_logging()
+
+
+PROMPT = "請輸出圖片中的純文字，不要任何解釋或符號。"
+BATCH_PROMPT = "以下每張圖片前標有其編號。請逐張輸出圖片中的純文字，不要任何解釋或符號，並以 JSON 回覆。"
+# Structured output, one result per image, matched back by index.
+BATCH_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "captcha_results",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "results": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "index": {"type": "integer"},
+                            "text": {"type": "string"},
+                        },
+                        "required": ["index", "text"],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["results"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+SAMPLE_PATTERN = re.compile(r"captcha-(\w+)\.\w+$")     # A labelled sample, e.g. captcha-56839.png.
+
+
+
+class CaptchaRecognizer(ABC):
+    """
+    A captcha recognition backend. recognize() returns the text and a confidence
+    from 0 to 1; the service sends the images below its min_confidence to the
+    next backend, and lets the backends learn() from the answers of the others,
+    if learn_enabled.
+    """
+    name = None
+    learn_enabled = False
+
+
+    @abstractmethod
+    def recognize(self, content: bytes, mime_type: str) -> tuple[str, float]:
+        pass
+
+
+    def learn(self, content: bytes, text: str):
+        pass
+
+
+    def stats(self) -> dict:
+        return {}
+
+
+
+class OpenAIRecognizer(CaptchaRecognizer):
+    """A vision model of OpenAI, remote, trusted with a confidence of 1."""
+    name = "openai"
+
+
+    def __init__(self, api_key: str, model: str = "gpt-4o-mini", image_detail: str = "auto", preprocessor=None):
+        self.api_key = api_key
+        self.model = model
+        self.image_detail = image_detail
+        self.preprocessor = preprocessor
+        self._client = None
+
+
+    @property
+    def client(self):
+        # openai is imported on first use to keep the agent startup fast.
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI(api_key=self.api_key)
+            logger.info(f"OpenAI API Key: {self._client.api_key}")
+        return self._client
+
+
+    def data_url(self, content: bytes, mime_type: str) -> str:
+        if self.preprocessor:
+            content, processed_type = self.preprocessor.process(content)
+            mime_type = processed_type or mime_type
+        return f"data:{mime_type};base64,{base64.b64encode(content).decode('utf-8')}"
+
+
+    def recognize(self, content: bytes, mime_type: str) -> tuple[str, float]:
+        return self.recognize_url(self.data_url(content, mime_type))
+
+
+    def recognize_url(self, data_url: str) -> tuple[str, float]:
+        resp = self.client.chat.completions.create(
+            model=self.model,
+            messages=[{
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": PROMPT},
+                    {"type": "image_url", "image_url": {"url": data_url, "detail": self.image_detail}},
+                ],
+            }],
+            temperature=0,
+        )
+        content = resp.choices[0].message.content
+
+        return (content.strip() if content else ""), 1.0
+
+
+    def recognize_urls(self, data_urls: dict) -> dict:
+        """Recognize the images of data_urls {index: data url} in one request, returns the texts by index."""
+        content = [{"type": "text", "text": BATCH_PROMPT}]
+        for index, data_url in data_urls.items():
+            content += [
+                {"type": "text", "text": f"#{index}"},
+                {"type": "image_url", "image_url": {"url": data_url, "detail": self.image_detail}},
+            ]
+        resp = self.client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": "user", "content": content}],
+            response_format=BATCH_RESPONSE_FORMAT,
+            temperature=0,
+        )
+
+        texts = {}
+        for result in json.loads(resp.choices[0].message.content or '{}').get('results', []):
+            if result.get('index') in data_urls:
+                texts[result['index']] = (result.get('text') or '').strip()
+        return texts
+
+
+
+class TemplateRecognizer(CaptchaRecognizer):
+    """
+    Offline, on the CPU: segment the characters by the columns with ink, and match
+    each to the nearest of the character templates cut from labelled samples
+    (captcha-<text>.png), by the cosine similarity of their blurred, resized masks.
+    The confidence is the lowest similarity of the characters: a generator that
+    renders a character the same way every time matches its templates nearly exactly.
+    Requires Pillow and NumPy.
+
+    Parameters:
+        samples (list): Directories of labelled samples, or sample files; none by default.
+        learn (bool): Add the characters of the images recognized by the other backends as templates.
+            A wrong answer learned is matched nearly exactly from then on, so the service
+            only passes on the answers it has corroborated. Off by default.
+        learn_dir (str): Save those images there as labelled samples, to be loaded at the next start.
+        ink_threshold (int): Gray levels under it are ink.
+        min_width (int): Narrower column runs are noise.
+        max_templates (int): Stop learning beyond it.
+    """
+    name = "templates"
+    size = (16, 24)
+
+
+    def __init__(self, params: dict = None):
+        params = params or {}
+        import numpy as np
+        from PIL import Image, ImageFilter      # Deferred, and optional.
+        self._np, self._image, self._filter = np, Image, ImageFilter
+
+        self.learn_enabled = params.get('learn', False)
+        self.learn_dir = params.get('learn_dir')
+        self.ink_threshold = params.get('ink_threshold', 140)
+        self.min_width = params.get('min_width', 3)
+        self.max_templates = params.get('max_templates', 5000)
+
+        self._lock = threading.Lock()
+        self._templates = np.zeros((0, self.size[0] * self.size[1]), dtype=np.float32)
+        self._labels: list[str] = []
+        self.learned = 0
+
+        samples = list(params.get('samples') or [])
+        if self.learn_dir:
+            samples.append(self.learn_dir)
+        for path in self._sample_files(samples):
+            with open(path, 'rb') as fp:
+                if not self._add(fp.read(), SAMPLE_PATTERN.search(path.name).group(1)):
+                    logger.warning(f"The characters of {path} can't be segmented, the sample is skipped.")
+        logger.info(f"{len(self._labels)} captcha templates of '{''.join(sorted(set(self._labels)))}' are loaded.")
+
+
+    @staticmethod
+    def _sample_files(samples):
+        for sample in samples:
+            path = Path(sample)
+            if path.is_dir():
+                yield from sorted(p for p in path.iterdir() if SAMPLE_PATTERN.match(p.name))
+            elif path.is_file() and SAMPLE_PATTERN.match(path.name):
+                yield path
+
+
+    def _features(self, content: bytes):
+        """The normalized features of the segmented characters, one row each."""
+        np = self._np
+        gray = np.asarray(self._image.open(io.BytesIO(content)).convert('L'))
+        ink = gray < self.ink_threshold
+        columns = ink.any(axis=0)
+        runs = np.flatnonzero(np.diff(np.concatenate(([0], columns.astype(np.int8), [0])))).reshape(-1, 2)
+
+        features = []
+        for start, end in runs:
+            if end - start < self.min_width:
+                continue
+            rows = np.flatnonzero(ink[:, start:end].any(axis=1))
+            mask = ink[rows[0]:rows[-1] + 1, start:end].astype(np.uint8) * 255
+            image = self._image.fromarray(mask).resize(self.size, self._image.BILINEAR)
+            vector = np.asarray(image.filter(self._filter.GaussianBlur(1)), dtype=np.float32).ravel()
+            vector -= vector.mean()
+            features.append(vector / (np.linalg.norm(vector) + 1e-6))
+        return np.array(features, dtype=np.float32).reshape(-1, self._templates.shape[1])
+
+
+    def _add(self, content: bytes, text: str) -> bool:
+        features = self._features(content)
+        if len(features) != len(text):
+            return False
+        with self._lock:
+            self._templates = self._np.concatenate((self._templates, features))
+            self._labels += list(text)
+        return True
+
+
+    def recognize(self, content: bytes, mime_type: str) -> tuple[str, float]:
+        features = self._features(content)
+        with self._lock:
+            templates, labels = self._templates, self._labels
+        if not len(features) or not labels:
+            return "", 0.0
+
+        similarities = features @ templates.T
+        best = similarities.argmax(axis=1)
+        text = ''.join(labels[i] for i in best)
+        confidence = float(similarities[self._np.arange(len(best)), best].min())
+        return text, max(0.0, confidence)
+
+
+    def learn(self, content: bytes, text: str):
+        if not self.learn_enabled or len(self._labels) >= self.max_templates:
+            return
+        # Only a known character rendered another way adds a template.
+        known, confidence = self.recognize(content, None)
+        if known == text and confidence > 0.99:
+            return
+        if not self._add(content, text):
+            return
+        self.learned += 1
+        if self.learn_dir and re.fullmatch(r"\w+", text):
+            os.makedirs(self.learn_dir, exist_ok=True)
+            path = os.path.join(self.learn_dir, f"captcha-{text}.png")
+            if not os.path.exists(path):
+                with open(path, 'wb') as fp:
+                    fp.write(content)
+
+
+    def stats(self) -> dict:
+        return {
+            'templates': len(self._labels),
+            'characters': ''.join(sorted(set(self._labels))),
+            'learned': self.learned,
+        }
+
+
+
+RECOGNIZERS = {recognizer.name: recognizer for recognizer in (TemplateRecognizer,)}
+
+
+def create_recognizer(name, params=None) -> CaptchaRecognizer:
+    if name not in RECOGNIZERS:
+        raise ValueError(f"Unknown captcha recognizer: {name}, available: {', '.join(RECOGNIZERS)}")
+    return RECOGNIZERS[name](params)
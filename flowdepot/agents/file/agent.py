@@ -1,13 +1,19 @@
 import hashlib
 import mimetypes
+import mmap
 import os
 import random
+import threading
 import time
 import uuid
 
 from agentflow.core.agent import Agent
 from agentflow.core.parcel import BinaryParcel
+from agents.file.chunked_upload import ChunkedUploads
+from agents.file.file_index import FileIndex
+from agents.file.io_pool import IoWorkerPool
 from agents.topics import AgentTopics
+from flowdepot.cache import LruCache
 
 import logging
 from flowdepot.app_logger import init_logging
@@ -23,6 +29,27 @@ class FileService(Agent):
         logger.info(f"name: {name}, agent_config: {agent_config}")
         super().__init__(name, agent_config)
         self.home_directory = agent_config['home_directory']
+        self.upload_expire_hours = agent_config.get('upload_expire_hours', 24)
+        # The file id is the SHA-256 of the content, and the same content is stored once.
+        self.content_addressed = agent_config.get('content_addressed', False)
+
+        # Hot files up to cache_max_file_bytes are kept in memory, larger reads are served via mmap.
+        self.cache_max_file_bytes = agent_config.get('cache_max_file_bytes', 4 * 1024 * 1024)
+        self.file_cache = LruCache(max_bytes=agent_config.get('cache_max_bytes', 256 * 1024 * 1024))
+
+        self.index_path = agent_config.get('index_path', os.path.join(self.home_directory, '_index.sqlite3'))
+        self.index_batch_size = agent_config.get('index_batch_size', 500)
+        self.index_flush_ms = agent_config.get('index_flush_ms', 200)
+        self.file_index: FileIndex = None
+
+        # Disk writes run on a bounded pool of I/O workers; a reply is sent when the data is durable.
+        self.io_workers = agent_config.get('io_workers', 4)
+        self.io_max_queue = agent_config.get('io_max_queue', 64)
+        self.io_queue_timeout = agent_config.get('io_queue_timeout', 5)
+        self.io_fsync = agent_config.get('io_fsync', 'none')
+        self.io_group_commit_ms = agent_config.get('io_group_commit_ms', 10)
+        self.io_pool: IoWorkerPool = None
+        self.chunked_uploads = ChunkedUploads(os.path.join(self.home_directory, '_partial'))
 
 
     def _generate_file_id(self, filename):        
@@ -43,22 +70,83 @@ class FileService(Agent):
         filename = file_info.get('filename')
         if not isinstance(filename, str) or not filename:
             raise ValueError("filename is required and must be a non-empty string")
+
+        content = file_info.get('content')
+        if self.content_addressed:
+            data = content.encode('utf-8') if isinstance(content, str) else content
+            file_id = hashlib.sha256(data).hexdigest()
+            file_path, deduplicated = self.io_pool.run(self._store_blob, file_id, filename, content=data,
+                                                       paths=lambda r: [self._blob_path(file_id), r[0]])
+            return self._make_result(file_info, file_id, filename, file_path,
+                                     size=len(data), sha256=file_id, deduplicated=deduplicated)
+
         file_id = self._generate_file_id(filename)
-        mime_type, encoding = mimetypes.guess_type(url=filename)
-        logger.debug(f"file_id: {file_id}, filename: {filename}, mime_type: {mime_type}, encoding: {encoding}")
-        
-        
+        file_path = self._make_file_path(file_id, filename)
+        data = content.encode('utf-8') if isinstance(content, str) else content
+        self.io_pool.run(self._write_file, file_path, data, paths=[file_path])
+        logger.info(f"filename: {filename} is saved.")
+
+        return self._make_result(file_info, file_id, filename, file_path,
+                                 size=len(data), sha256=hashlib.sha256(data).hexdigest())
+
+
+    def _write_file(self, file_path, data):
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as fp:
+            fp.write(data)
+
+
+    def _blob_path(self, digest):
+        return os.path.join(self.home_directory, '_blobs', digest[:2], digest[2:4], digest)
+
+
+    def _store_blob(self, digest, filename, content=None, source_path=None):
+        """
+        Store the content under its hash once, from bytes or by moving source_path,
+        and hard link it as <digest>-<filename>; the link count is the reference count.
+        If the blob is present, the write is skipped. Returns (file_path, deduplicated).
+        """
+        blob_path = self._blob_path(digest)
+        deduplicated = os.path.exists(blob_path)
+        if deduplicated:
+            if source_path:
+                os.remove(source_path)
+            logger.info(f"filename: {filename} is deduplicated, sha256: {digest}")
+        else:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            if source_path:
+                os.replace(source_path, blob_path)
+            else:
+                tmp_path = f"{blob_path}.{uuid.uuid4().hex}.tmp"
+                with open(tmp_path, "wb") as fp:
+                    fp.write(content)
+                os.replace(tmp_path, blob_path)
+            logger.info(f"filename: {filename} is saved, sha256: {digest}")
+
+        file_path = self._make_file_path(digest, filename)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        try:
+            os.link(blob_path, file_path)
+        except FileExistsError:
+            pass
+        except OSError as ex:
+            # No hard links on this file system, refer to the blob directly.
+            logger.warning(f"Failed to link {file_path}: {ex}")
+            file_path = blob_path
+
+        return file_path, deduplicated
+
+
+    def _make_file_path(self, file_id, filename):
         file_dir = os.path.join(self.home_directory, file_id[:2], file_id[2:4])
         # file_dir = os.path.join(self.home_directory, file_id[:2])
-        if not os.path.exists(file_dir):
-            os.makedirs(file_dir)
+        # The directory is created by the I/O worker which writes the file.
+        return os.path.join(file_dir, f"{file_id}-{filename}")
 
-        file_path = os.path.join(file_dir, f"{file_id}-{filename}")
-        content = file_info.get('content')
-        open_mode = "w" if isinstance(content, str) else "wb"
-        with open(file_path, open_mode) as fp:
-            fp.write(content)
-        logger.info(f"filename: {filename} is saved.")
+
+    def _make_result(self, file_info: dict, file_id, filename, file_path, **extra):
+        mime_type, encoding = mimetypes.guess_type(url=filename)
+        logger.debug(f"file_id: {file_id}, filename: {filename}, mime_type: {mime_type}, encoding: {encoding}")
 
         result = {k: v for k, v in file_info.items() if k != 'content'}
         result.update({
@@ -67,11 +155,203 @@ class FileService(Agent):
             'mime_type': mime_type,
             'encoding': encoding,
             'file_path': file_path,
+            **extra,
         })
         logger.info(f"result: {result}")
+
+        if self.file_index:
+            self.file_index.add(file_id, filename, result.get('size'), result.get('sha256'), mime_type, file_path)
         return result
 
 
+    def handle_upload_begin(self, topic:str, pcl:BinaryParcel):
+        """
+        Begin a chunked upload: {'filename', 'upload_id' (optional, to resume)}.
+        Returns {'upload_id', 'filename', 'next_index', 'received_bytes'}.
+        """
+        file_info: dict = pcl.content or {}
+        filename = file_info.get('filename')
+        if not isinstance(filename, str) or not filename:
+            raise ValueError("filename is required and must be a non-empty string")
+        info = {k: v for k, v in file_info.items() if k not in ('filename', 'upload_id')}
+
+        progress = self.io_pool.run(self.chunked_uploads.begin, filename, file_info.get('upload_id'), info)
+        logger.info(f"topic: {topic}, progress: {progress}")
+        return progress
+
+
+    def handle_upload_chunk(self, topic:str, pcl:BinaryParcel):
+        """Append a chunk: {'upload_id', 'index', 'content'}. Returns the progress as begin does."""
+        chunk: dict = pcl.content or {}
+        content = chunk.get('content')
+        if content is None:
+            raise ValueError("content is required")
+        if chunk.get('index') is None:
+            raise ValueError("index is required")
+        upload_id = chunk.get('upload_id')
+        progress = self.io_pool.run(self.chunked_uploads.append, upload_id, int(chunk['index']), content,
+                                    paths=[self.chunked_uploads.part_path(upload_id)])
+        logger.debug(f"topic: {topic}, progress: {progress}")
+        return progress
+
+
+    def handle_upload_commit(self, topic:str, pcl:BinaryParcel):
+        """
+        Commit a chunked upload: {'upload_id', 'sha256' (optional, verified if given)}.
+        Returns the same result as File/Upload, plus 'size' and 'sha256'.
+        """
+        commit_info: dict = pcl.content or {}
+        return self.chunked_uploads.commit(commit_info.get('upload_id'), self._store_upload, commit_info.get('sha256'))
+
+
+    def _store_upload(self, state, digest):
+        """Move the part file of a verified upload into place; the upload is kept if this raises."""
+        upload_id = state.upload_id
+        part_path = self.chunked_uploads.part_path(upload_id)
+        if self.content_addressed:
+            file_path, deduplicated = self.io_pool.run(self._store_blob, digest, state.filename, source_path=part_path,
+                                                       paths=lambda r: [self._blob_path(digest), r[0]])
+            return self._make_result(state.info, digest, state.filename, file_path,
+                                     upload_id=upload_id, size=state.size, sha256=digest, deduplicated=deduplicated)
+
+        file_id = self._generate_file_id(state.filename)
+        file_path = self._make_file_path(file_id, state.filename)
+        self.io_pool.run(self._move_file, part_path, file_path, paths=[file_path])
+        logger.info(f"filename: {state.filename} is saved, size: {state.size}")
+
+        return self._make_result(state.info, file_id, state.filename, file_path,
+                                 upload_id=upload_id, size=state.size, sha256=digest)
+
+
+    def _move_file(self, source_path, file_path):
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        os.replace(source_path, file_path)
+
+
+    def _find_file(self, file_id, filename=None):
+        """Return the path of the stored file, or None."""
+        if not isinstance(file_id, str) or not file_id.isalnum() or len(file_id) < 4:
+            raise ValueError(f"Invalid file_id: {file_id}")
+        if self.file_index and (file_path := self.file_index.find_path(file_id, filename)) and os.path.exists(file_path):
+            return file_path
+
+        # Not indexed, look into the directory.
+        file_dir = os.path.join(self.home_directory, file_id[:2], file_id[2:4])
+        if filename:
+            file_path = os.path.join(file_dir, f"{file_id}-{os.path.basename(filename)}")
+            return file_path if os.path.exists(file_path) else None
+        if os.path.isdir(file_dir):
+            prefix = f"{file_id}-"
+            for name in os.listdir(file_dir):
+                if name.startswith(prefix):
+                    return os.path.join(file_dir, name)
+        if self.content_addressed and os.path.exists(blob_path := self._blob_path(file_id)):
+            return blob_path
+        return None
+
+
+    def _read_file(self, file_path, offset=0, length=None) -> bytes:
+        """Read a byte range from the LRU cache for small files, or from a memory-mapped view."""
+        size = os.path.getsize(file_path)
+        offset = max(0, min(offset, size))
+        end = size if length is None or length < 0 else min(size, offset + length)
+
+        if size <= self.cache_max_file_bytes:
+            data = self.file_cache.get(file_path)
+            if data is None:
+                with open(file_path, 'rb') as fp:
+                    data = fp.read()
+                self.file_cache.put(file_path, data)
+            return data if offset == 0 and end == size else data[offset:end]
+
+        with open(file_path, 'rb') as fp:
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return mm[offset:end]
+
+
+    def _download_result(self, file_id, file_path, content, **extra):
+        filename = os.path.basename(file_path)[len(file_id) + 1:] or None
+        mime_type, encoding = mimetypes.guess_type(url=filename) if filename else (None, None)
+        # A BinaryParcel, a dict with bytes would be returned as a TextParcel (JSON).
+        return BinaryParcel({
+            'file_id': file_id,
+            'filename': filename,
+            'mime_type': mime_type,
+            'encoding': encoding,
+            'size': os.path.getsize(file_path),
+            'content': content,
+            **extra,
+        })
+
+
+    def handle_file_download(self, topic:str, pcl:BinaryParcel):
+        """Return the whole file: {'file_id', 'filename' (optional)}."""
+        request: dict = pcl.content or {}
+        file_id = request.get('file_id')
+        if not (file_path := self._find_file(file_id, request.get('filename'))):
+            raise FileNotFoundError(f"File not found: {file_id}")
+
+        content = self._read_file(file_path)
+        logger.info(f"topic: {topic}, file_id: {file_id}, size: {len(content)}")
+        return self._download_result(file_id, file_path, content)
+
+
+    def handle_file_read_range(self, topic:str, pcl:BinaryParcel):
+        """Return a slice of the file: {'file_id', 'offset', 'length', 'filename' (optional)}."""
+        request: dict = pcl.content or {}
+        file_id = request.get('file_id')
+        if not (file_path := self._find_file(file_id, request.get('filename'))):
+            raise FileNotFoundError(f"File not found: {file_id}")
+
+        offset = int(request.get('offset', 0))
+        length = request.get('length')
+        content = self._read_file(file_path, offset, int(length) if length is not None else None)
+        logger.debug(f"topic: {topic}, file_id: {file_id}, offset: {offset}, length: {len(content)}")
+        return self._download_result(file_id, file_path, content, offset=offset, length=len(content))
+
+
+    def handle_file_query(self, topic:str, pcl:BinaryParcel):
+        """
+        Query the file index: {'file_id', 'sha256', 'filename_prefix', 'created_from', 'created_to', 'limit'},
+        all optional and combined with AND; the times are epoch seconds. Returns {'files': [...]}, newest first.
+        """
+        criteria: dict = pcl.content or {}
+        keys = ('file_id', 'sha256', 'filename_prefix', 'created_from', 'created_to', 'limit')
+        files = self.file_index.query(**{k: v for k, v in criteria.items() if k in keys})
+        logger.debug(f"topic: {topic}, criteria: {criteria}, found: {len(files)}")
+        return {'files': files}
+
+
+    def handle_file_stats(self, topic:str, pcl:BinaryParcel):
+        """Return the statistics for capacity planning: the I/O queue depth and write latency, and the file cache."""
+        return {
+            'io': self.io_pool.stats(),
+            'cache': self.file_cache.stats(),
+        }
+
+
     def on_activate(self):
+        self.chunked_uploads.remove_expired(self.upload_expire_hours * 3600)
+        self.io_pool = IoWorkerPool(self.io_workers, self.io_max_queue, self.io_queue_timeout,
+                                    self.io_fsync, self.io_group_commit_ms)
+
+        self.file_index = FileIndex(self.index_path, self.index_batch_size, self.index_flush_ms)
+        if self.file_index.is_new:
+            threading.Thread(target=self.file_index.rebuild, args=(self.home_directory,), daemon=True).start()
+
         logger.info(f"subscribe: {AgentTopics.FILE_UPLOAD}")
         self.subscribe(AgentTopics.FILE_UPLOAD, "str", self.handle_file_upload)
+        self.subscribe(AgentTopics.FILE_UPLOAD_BEGIN, "str", self.handle_upload_begin)
+        self.subscribe(AgentTopics.FILE_UPLOAD_CHUNK, "str", self.handle_upload_chunk)
+        self.subscribe(AgentTopics.FILE_UPLOAD_COMMIT, "str", self.handle_upload_commit)
+        self.subscribe(AgentTopics.FILE_DOWNLOAD, "str", self.handle_file_download)
+        self.subscribe(AgentTopics.FILE_READ_RANGE, "str", self.handle_file_read_range)
+        self.subscribe(AgentTopics.FILE_QUERY, "str", self.handle_file_query)
+        self.subscribe(AgentTopics.FILE_STATS, "str", self.handle_file_stats)
+
+
+    def on_terminated(self):
+        if self.io_pool:
+            self.io_pool.shutdown()
+        if self.file_index:
+            self.file_index.close()
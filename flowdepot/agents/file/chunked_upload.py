@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+import logging
+from flowdepot.app_logger import init_logging
+logger:logging.Logger = init_logging()
+
+
+
+class UploadState:
+    def __init__(self, upload_id: str, filename: str, info: dict = None):
+        self.upload_id = upload_id
+        self.filename = filename
+        self.info = info or {}      # The other keys sent with begin, returned with the result.
+        self.next_index = 0
+        self.size = 0
+        self.hasher = hashlib.sha256()
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+
+    def to_meta(self) -> dict:
+        return {
+            'upload_id': self.upload_id,
+            'filename': self.filename,
+            'info': self.info,
+            'next_index': self.next_index,
+            'size': self.size,
+        }
+
+
+    def progress(self) -> dict:
+        return {
+            'upload_id': self.upload_id,
+            'filename': self.filename,
+            'next_index': self.next_index,
+            'received_bytes': self.size,
+        }
+
+
+
+class ChunkedUploads:
+    """
+    Chunked and resumable uploads.
+
+    A chunk is appended to <partial_directory>/<upload_id>.part as it arrives, and a
+    running SHA-256 is updated, so memory stays flat regardless of the file size.
+    The progress is kept in <upload_id>.json, so an interrupted upload, even across
+    a restart of the service, is resumed by sending begin with the same upload_id.
+    """
+    HASH_BLOCK_SIZE = 1024 * 1024
+
+
+    def __init__(self, partial_directory: str):
+        self.partial_directory = partial_directory
+        os.makedirs(partial_directory, exist_ok=True)
+        self._uploads: dict[str, UploadState] = {}
+        self._lock = threading.Lock()
+
+
+    def part_path(self, upload_id: str) -> str:
+        return os.path.join(self.partial_directory, f"{upload_id}.part")
+
+
+    def _meta_path(self, upload_id: str) -> str:
+        return os.path.join(self.partial_directory, f"{upload_id}.json")
+
+
+    def _save_meta(self, state: UploadState):
+        meta_path = self._meta_path(state.upload_id)
+        with open(meta_path + '.tmp', 'w', encoding='utf-8') as fp:
+            json.dump(state.to_meta(), fp)
+        os.replace(meta_path + '.tmp', meta_path)
+
+
+    def _restore(self, upload_id: str) -> UploadState | None:
+        meta_path = self._meta_path(upload_id)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as fp:
+            meta = json.load(fp)
+
+        state = UploadState(upload_id, meta['filename'], meta.get('info'))
+        state.next_index = meta['next_index']
+        state.size = meta['size']
+
+        # The part file may have an unrecorded tail if the service stopped while appending.
+        part_path = self.part_path(upload_id)
+        with open(part_path, 'a+b') as fp:
+            fp.truncate(state.size)
+            fp.seek(0)
+            while block := fp.read(ChunkedUploads.HASH_BLOCK_SIZE):
+                state.hasher.update(block)
+        logger.info(f"Upload restored: {upload_id}, next_index: {state.next_index}, size: {state.size}")
+        return state
+
+
+    def _get(self, upload_id: str) -> UploadState:
+        if not isinstance(upload_id, str) or not upload_id.isalnum():
+            raise ValueError(f"Invalid upload_id: {upload_id}")
+        with self._lock:
+            if not (state := self._uploads.get(upload_id)):
+                if not (state := self._restore(upload_id)):
+                    raise KeyError(f"Upload not found: {upload_id}")
+                self._uploads[upload_id] = state
+            return state
+
+
+    def begin(self, filename: str, upload_id: str = None, info: dict = None) -> dict:
+        """Start an upload, or resume it if upload_id is given and known."""
+        if upload_id:
+            try:
+                state = self._get(upload_id)
+                logger.info(f"Upload resumed: {upload_id}, next_index: {state.next_index}")
+                return state.progress()
+            except KeyError:
+                pass
+        else:
+            upload_id = uuid.uuid4().hex
+
+        state = UploadState(upload_id, filename, info)
+        with self._lock:
+            self._uploads[upload_id] = state
+        open(self.part_path(upload_id), 'wb').close()
+        self._save_meta(state)
+        return state.progress()
+
+
+    def append(self, upload_id: str, index: int, content) -> dict:
+        """
+        Append the chunk with the index. A chunk which has been received is ignored,
+        so a chunk can be resent safely; a chunk beyond the next index is rejected.
+        """
+        state = self._get(upload_id)
+        with state.lock:
+            if index < state.next_index:
+                logger.debug(f"Duplicate chunk ignored: {upload_id}, index: {index}")
+                return state.progress()
+            if index > state.next_index:
+                raise ValueError(f"Chunk {index} is out of order, expected chunk {state.next_index}.")
+
+            data = content.encode('utf-8') if isinstance(content, str) else content
+            with open(self.part_path(upload_id), 'ab') as fp:
+                fp.write(data)
+            state.hasher.update(data)
+            state.size += len(data)
+            state.next_index += 1
+            state.updated = time.time()
+            self._save_meta(state)
+            return state.progress()
+
+
+    def commit(self, upload_id: str, store, sha256: str = None):
+        """
+        Verify the hash and finish the upload: store(state, digest) moves the part file
+        into place, and its result is returned. The upload is forgotten only after store
+        returns, so a commit which fails in store, e.g. on a full disk, can be retried.
+        """
+        state = self._get(upload_id)
+        with state.lock:
+            digest = state.hasher.hexdigest()
+            if sha256 and sha256.lower() != digest:
+                raise ValueError(f"SHA-256 mismatch, expected: {sha256}, received: {digest}")
+            result = store(state, digest)
+            with self._lock:
+                self._uploads.pop(upload_id, None)
+            os.remove(self._meta_path(upload_id))
+            return result
+
+
+    def remove_expired(self, expire_seconds: float):
+        """Remove the partial uploads which have not been updated for expire_seconds."""
+        deadline = time.time() - expire_seconds
+        for name in os.listdir(self.partial_directory):
+            path = os.path.join(self.partial_directory, name)
+            upload_id = name.split('.')[0]
+            if upload_id not in self._uploads and os.path.getmtime(path) < deadline:
+                logger.info(f"Remove the expired partial upload: {name}")
+                os.remove(path)
@@ -0,0 +1,167 @@
+import mimetypes
+import os
+import sqlite3
+import threading
+import time
+
+import logging
+from flowdepot.app_logger import init_logging
+logger:logging.Logger = init_logging()
+
+
+
+class FileIndex:
+    """
+    An embedded SQLite index of the stored files.
+
+    Records are buffered by add() and written by a background thread in one
+    transaction per batch (every flush_ms, or when batch_size records are pending).
+    A query flushes the pending records first, so it always sees the latest uploads.
+    Lookups by file_id, sha256, filename prefix and created_at are served by B-tree
+    indexes, which keeps them in milliseconds with millions of files.
+    """
+    COLUMNS = ['file_id', 'filename', 'size', 'sha256', 'mime_type', 'file_path', 'created_at', 'updated_at']
+
+
+    def __init__(self, db_path: str, batch_size: int = 500, flush_ms: int = 200):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_ms = flush_ms
+
+        self.is_new = not os.path.exists(db_path)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db_lock = threading.Lock()
+        self._create_schema()
+
+        self._pending: list[tuple] = []
+        self._pending_lock = threading.Condition()
+        self._closed = False
+        self._writer = threading.Thread(target=self._write_loop, name='file-index-writer', daemon=True)
+        self._writer.start()
+
+
+    def _create_schema(self):
+        with self._db_lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    file_id TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    size INTEGER,
+                    sha256 TEXT,
+                    mime_type TEXT,
+                    file_path TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (file_id, filename)
+                )""")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_files_sha256 ON files(sha256)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_files_filename ON files(filename)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_files_created_at ON files(created_at)")
+
+
+    def add(self, file_id, filename, size, sha256, mime_type, file_path, created_at=None):
+        now = time.time()
+        record = (file_id, filename, size, sha256, mime_type, file_path, created_at or now, now)
+        with self._pending_lock:
+            self._pending.append(record)
+            if len(self._pending) >= self.batch_size:
+                self._pending_lock.notify()
+
+
+    def flush(self):
+        with self._pending_lock:
+            records, self._pending = self._pending, []
+        if not records:
+            return
+
+        with self._db_lock, self._db:
+            self._db.executemany("""
+                INSERT INTO files (file_id, filename, size, sha256, mime_type, file_path, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (file_id, filename) DO UPDATE SET
+                    size = excluded.size, sha256 = excluded.sha256, mime_type = excluded.mime_type,
+                    file_path = excluded.file_path, updated_at = excluded.updated_at""", records)
+        logger.debug(f"{len(records)} records are indexed.")
+
+
+    def _write_loop(self):
+        while not self._closed:
+            with self._pending_lock:
+                if len(self._pending) < self.batch_size:
+                    self._pending_lock.wait(self.flush_ms / 1000)
+            if self._closed:
+                break
+            try:
+                self.flush()
+            except Exception as ex:
+                logger.exception(ex)
+
+
+    def query(self, file_id=None, sha256=None, filename_prefix=None, created_from=None, created_to=None, limit=100) -> list[dict]:
+        """Find the files matching all the given conditions, newest first. Times are epoch seconds."""
+        self.flush()
+
+        conditions, params = [], []
+        if file_id:
+            conditions.append("file_id = ?")
+            params.append(file_id)
+        if sha256:
+            conditions.append("sha256 = ?")
+            params.append(sha256.lower())
+        if filename_prefix:
+            # A range instead of LIKE, so the filename index is used.
+            conditions.append("filename >= ? AND filename < ?")
+            params += [filename_prefix, filename_prefix[:-1] + chr(ord(filename_prefix[-1]) + 1)]
+        if created_from is not None:
+            conditions.append("created_at >= ?")
+            params.append(float(created_from))
+        if created_to is not None:
+            conditions.append("created_at < ?")
+            params.append(float(created_to))
+
+        sql = f"SELECT {', '.join(FileIndex.COLUMNS)} FROM files"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY created_at DESC LIMIT ?"
+        params.append(int(limit))
+
+        with self._db_lock:
+            rows = self._db.execute(sql, params).fetchall()
+        return [dict(zip(FileIndex.COLUMNS, row)) for row in rows]
+
+
+    def find_path(self, file_id, filename=None) -> str | None:
+        if filename:
+            self.flush()
+            with self._db_lock:
+                row = self._db.execute("SELECT file_path FROM files WHERE file_id = ? AND filename = ?", (file_id, filename)).fetchone()
+        else:
+            rows = self.query(file_id=file_id, limit=1)
+            row = (rows[0]['file_path'],) if rows else None
+        return row[0] if row else None
+
+
+    def rebuild(self, home_directory: str):
+        """Index the files stored before the index existed, from the <file_id>-<filename> layout."""
+        count = 0
+        for dir_path, dir_names, file_names in os.walk(home_directory):
+            dir_names[:] = [d for d in dir_names if not d.startswith('_')]     # _partial, _blobs
+            for name in file_names:
+                file_id, sep, filename = name.partition('-')
+                if not sep or not file_id.isalnum():
+                    continue
+                file_path = os.path.join(dir_path, name)
+                stat = os.stat(file_path)
+                self.add(file_id, filename, stat.st_size, None, mimetypes.guess_type(url=filename)[0], file_path, stat.st_mtime)
+                count += 1
+        self.flush()
+        logger.info(f"{count} existing files are indexed.")
+
+
+    def close(self):
+        self._closed = True
+        self.flush()
+        with self._db_lock:
+            self._db.close()
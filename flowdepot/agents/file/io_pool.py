@@ -0,0 +1,223 @@
+from collections import deque
+from concurrent.futures import Future
+import os
+import queue
+import threading
+import time
+
+import logging
+from flowdepot.app_logger import init_logging
+logger:logging.Logger = init_logging()
+
+
+
+class IoBusyError(RuntimeError):
+    """The I/O queue stays full, the request is rejected."""
+
+
+
+class IoWorkerPool:
+    """
+    A bounded pool of I/O worker threads.
+
+    A job is a function doing the file operations plus the paths it writes, or a
+    function of the job's result returning them, for paths known after the job. The
+    future of the job is resolved when the data is durable as configured by fsync:
+        'none'   - when the function returns (the OS flushes the data later),
+        'always' - after each path is fsynced by the worker,
+        'batch'  - after a group commit, which fsyncs the paths of all the jobs
+                   finished within group_commit_ms, and their directories once.
+
+    Parameters:
+        workers (int): The number of worker threads.
+        max_queue (int): The maximum number of queued jobs; submit() blocks up to
+            queue_timeout seconds when the queue is full, then raises IoBusyError.
+    """
+    def __init__(self, workers: int = 4, max_queue: int = 64, queue_timeout: float = 5,
+                 fsync: str = 'none', group_commit_ms: int = 10):
+        if fsync not in ('none', 'always', 'batch'):
+            raise ValueError(f"Invalid fsync mode: {fsync}")
+        self.workers = workers
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.fsync = fsync
+        self.group_commit_ms = group_commit_ms
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._commit_queue = queue.Queue()
+        self._latencies = deque(maxlen=1024)
+        self._stats_lock = threading.Lock()
+        self._counts = {'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0, 'group_commits': 0}
+        self._closed = False
+        self._putting = 0       # submit() calls between the closed check and the put.
+        self._closed_condition = threading.Condition()
+
+        self._threads = [threading.Thread(target=self._work, name=f'file-io-{i}', daemon=True) for i in range(workers)]
+        if fsync == 'batch':
+            self._threads.append(threading.Thread(target=self._group_commit, name='file-io-commit', daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+
+    def submit(self, func, *args, paths=(), **kwargs) -> Future:
+        with self._closed_condition:
+            if self._closed:
+                raise RuntimeError("The I/O pool is shut down.")
+            self._putting += 1
+
+        future = Future()
+        job = (future, func, args, kwargs, paths, time.perf_counter())
+        try:
+            self._queue.put(job, timeout=self.queue_timeout)
+        except queue.Full:
+            self._count('rejected')
+            raise IoBusyError(f"The I/O queue is full ({self.max_queue} jobs).")
+        finally:
+            with self._closed_condition:
+                self._putting -= 1
+                self._closed_condition.notify_all()
+        self._count('submitted')
+        return future
+
+
+    def run(self, func, *args, paths=(), **kwargs):
+        """Submit the job and wait until it is durable."""
+        return self.submit(func, *args, paths=paths, **kwargs).result()
+
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._counts[name] += 1
+
+
+    def _complete(self, future: Future, started: float, result=None, error=None):
+        with self._stats_lock:
+            self._latencies.append(time.perf_counter() - started)
+            self._counts['failed' if error else 'completed'] += 1
+        if error:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            future, func, args, kwargs, paths, started = job
+            try:
+                result = func(*args, **kwargs)
+                if callable(paths):
+                    paths = paths(result)
+                if self.fsync == 'always':
+                    _fsync_paths(paths)
+                elif self.fsync == 'batch':
+                    self._commit_queue.put((future, started, result, paths))
+                    continue
+                self._complete(future, started, result)
+            except Exception as ex:
+                self._complete(future, started, error=ex)
+
+
+    def _group_commit(self):
+        stopped = False
+        while not stopped:
+            job = self._commit_queue.get()
+            if job is None:
+                break
+            time.sleep(self.group_commit_ms / 1000)
+            jobs = [job]
+            while True:
+                try:
+                    job = self._commit_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    stopped = True      # Commit the jobs before the sentinel, then stop.
+                    break
+                jobs.append(job)
+
+            try:
+                _fsync_paths([path for _, _, _, paths in jobs for path in paths])
+                error = None
+            except Exception as ex:
+                logger.exception(ex)
+                error = ex
+            self._count('group_commits')
+            for future, started, result, _ in jobs:
+                self._complete(future, started, result, error)
+        self._fail_pending(self._commit_queue)
+
+
+    def _fail_pending(self, jobs: queue.Queue):
+        """Fail the futures of the jobs left in the queue after shutdown."""
+        while True:
+            try:
+                job = jobs.get_nowait()
+            except queue.Empty:
+                return
+            if job is not None and not job[0].done():
+                self._count('failed')
+                job[0].set_exception(RuntimeError("The I/O pool is shut down."))
+
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            latencies = sorted(self._latencies)
+            counts = dict(self._counts)
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else None
+
+        return {
+            'workers': self.workers,
+            'fsync': self.fsync,
+            'queue_depth': self._queue.qsize(),
+            'max_queue': self.max_queue,
+            'commit_queue_depth': self._commit_queue.qsize(),
+            **counts,
+            'latency_ms': {
+                'p50': percentile(0.5),
+                'p95': percentile(0.95),
+                'p99': percentile(0.99),
+                'max': latencies[-1] * 1000 if latencies else None,
+            },
+        }
+
+
+    def shutdown(self):
+        """Finish the queued jobs, then stop; submit() raises RuntimeError after it."""
+        with self._closed_condition:
+            self._closed = True
+            # A job being put is queued before the workers' sentinels, so it is run.
+            self._closed_condition.wait_for(lambda: not self._putting)
+        for _ in range(self.workers):
+            self._queue.put(None)
+        for thread in self._threads[:self.workers]:
+            thread.join(self.queue_timeout)
+        self._commit_queue.put(None)     # After the workers' last jobs.
+        for thread in self._threads[self.workers:]:
+            thread.join(self.queue_timeout)
+        self._fail_pending(self._queue)
+
+
+
+def _fsync_paths(paths):
+    """fsync the files, then their directories (for new entries) once each."""
+    directories = set()
+    for path in dict.fromkeys(paths):
+        fd = os.open(path, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        directories.add(os.path.dirname(os.path.abspath(path)))
+
+    if os.name != 'nt':     # Directories can't be opened on Windows.
+        for directory in directories:
+            fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
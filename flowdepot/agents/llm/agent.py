@@ -1,8 +1,18 @@
+import asyncio
+from contextlib import contextmanager
+import threading
+import time
+
 from agentflow.core.agent import Agent
 from agentflow.core.parcel import TextParcel
+from agents.llm.async_runner import AsyncRunner
 from agents.llm.llms import create_instance as create_llm
 from agents.llm.llms.base_llm import LlmInstance
+from agents.llm.llms.cached_llm import CachedLlm, canonical_key
+from agents.llm.llms.router import LlmRouter
+from agents.llm.single_flight import SingleFlight
 from agents.topics import AgentTopics
+from flowdepot.cache import DiskCache, LruCache, TieredCache
 
 import logging
 from flowdepot.app_logger import init_logging
@@ -15,19 +25,195 @@ class LlmService(Agent):
         logger.info(f"name: {name}, agent_config: {agent_config}")
         super().__init__(name, agent_config)
         self.llm_params = agent_config
+        # Streamed deltas are gathered for this long before they're published.
+        self.stream_coalesce_seconds = agent_config.get('stream_coalesce_ms', 20) / 1000
+
+        # The responses of the deterministic (temperature 0) prompts, in memory and optionally on disk.
+        cache_max_entries = agent_config.get('cache_max_entries', 1024)
+        cache_directory = agent_config.get('cache_directory')
+        self.response_cache = TieredCache(
+            LruCache(max_entries=cache_max_entries) if cache_max_entries else None,
+            DiskCache(cache_directory, agent_config.get('cache_max_bytes', 256 * 1024 * 1024)) if cache_directory else None,
+        ) if agent_config.get('cache', True) else None
+
+
+    def _create_llm(self) -> LlmInstance:
+        llm = create_llm(self.llm_params['llm'], self.llm_params)
+        if self.response_cache:
+            llm = CachedLlm(llm, self.response_cache, ttl=self.llm_params.get('cache_ttl_seconds', 86400))
+        return llm
 
 
     def on_activate(self):
-        self.llm:LlmInstance = create_llm(self.llm_params['llm'], self.llm_params)
+        self.llm:LlmInstance = self._create_llm()
+        # The requests in flight by LLM; one replaced by a config change is closed when its last is done.
+        self._llm_lock = threading.Lock()
+        self._llm_in_flight: dict[LlmInstance, int] = {}
+        # Many prompts in flight over one pooled async client, or one blocking call per handler thread.
+        self.runner = AsyncRunner(
+            max_in_flight=self.llm_params.get('max_in_flight', 16),
+            timeout=self.llm_params.get('request_timeout', 60),
+        ) if self.llm_params.get('async', True) else None
+        self.single_flight = SingleFlight() if self.llm_params.get('coalesce', True) else None
         self.subscribe(AgentTopics.LLM_PROMPT, "str", self.handle_prompt)
+        self.subscribe(AgentTopics.LLM_STATS, "str", self.handle_stats)
+
+
+    def on_terminated(self):
+        if getattr(self, 'runner', None):
+            self.runner.close(self.llm.aclose())
+
+
+    def on_config_changed(self, agent_config):
+        # Called by the agent loader when system.yaml or agent.yaml has changed.
+        if agent_config == self.llm_params:
+            return
+        logger.info(self.M(f"Apply the new config, llm: {agent_config.get('llm')}, model: {agent_config.get('model')}"))
+        self.llm_params = agent_config
+        self.stream_coalesce_seconds = agent_config.get('stream_coalesce_ms', 20) / 1000
+        if hasattr(self, 'llm'):    # Activated
+            new_llm = self._create_llm()
+            with self._llm_lock:
+                old_llm, self.llm = self.llm, new_llm
+                idle = old_llm not in self._llm_in_flight
+            if idle and self.runner:
+                self.runner.submit_coroutine(old_llm.aclose())
+
+
+    @contextmanager
+    def _using_llm(self):
+        """The current LLM, counted in flight until the block exits."""
+        with self._llm_lock:
+            llm = self.llm
+            self._llm_in_flight[llm] = self._llm_in_flight.get(llm, 0) + 1
+        try:
+            yield llm
+        finally:
+            with self._llm_lock:
+                self._llm_in_flight[llm] -= 1
+                if idle := not self._llm_in_flight[llm]:
+                    del self._llm_in_flight[llm]
+                retired = llm is not self.llm
+            if idle and retired and self.runner:
+                self.runner.submit_coroutine(llm.aclose())
+
+
+    def handle_stats(self, topic:str, pcl:TextParcel):
+        llm = self.llm.llm if isinstance(self.llm, CachedLlm) else self.llm
+        return {
+            'router': llm.stats() if isinstance(llm, LlmRouter) else None,
+            'runner': self.runner.stats() if self.runner else None,
+            'cache': self.llm.stats() if isinstance(self.llm, CachedLlm) else None,
+            'coalesce': self.single_flight.stats() if self.single_flight else None,
+        }
 
 
     def handle_prompt(self, topic:str, pcl:TextParcel):
         params = pcl.content
+        streaming = params.get('streaming', self.llm_params.get('streaming', False)) if isinstance(params, dict) \
+            else self.llm_params.get('streaming', False)
+        stream_topic = f"{pcl.topic_return}/stream" if streaming and pcl.topic_return else None
 
-        response = self.llm.generate_response(params)
+        if stream_topic:
+            with self._using_llm() as llm:
+                if self.runner:
+                    response = self.runner.run(lambda: self._astream(llm, params, stream_topic), LlmService._timeout(params))
+                else:
+                    response = self._stream(llm, params, stream_topic)
+        elif self.single_flight and (key := self._flight_key(params)):
+            # An identical prompt in flight answers this one too.
+            response = self.single_flight.run(key, lambda: self._generate(params))
+        else:
+            response = self._generate(params)
         logger.debug(self.M(response))
 
         return {
             'response': response,
         }
+
+
+    @staticmethod
+    def _timeout(params):
+        return params.get('timeout') if isinstance(params, dict) else None
+
+
+    def _flight_key(self, params):
+        # A follower waits as long as its leader, so only the prompts with the same timeout are shared.
+        if (request := self.llm.request_key(params)) is None:
+            return None
+        return canonical_key({**request, 'cache': params.get('cache') if isinstance(params, dict) else None,
+                              'timeout': LlmService._timeout(params)})
+
+
+    def _generate(self, params):
+        with self._using_llm() as llm:
+            if self.runner:
+                return self.runner.run(lambda: llm.agenerate_response(params), LlmService._timeout(params))
+            return llm.generate_response(params)
+
+
+    async def _astream(self, llm:LlmInstance, params, stream_topic):
+        """
+        Publish the deltas to stream_topic as {'seq', 'delta'} as they arrive: the first at
+        once, the next gathered for stream_coalesce_ms, then {'seq', 'end_of_stream': True},
+        with 'error' too if the request failed or timed out. Returns the whole response.
+        """
+        parts, pending, seq = [], [], 0
+        end_of_stream = {'end_of_stream': True}
+
+        def flush():
+            nonlocal seq
+            if pending:
+                self.publish(stream_topic, {'seq': seq, 'delta': ''.join(pending)})
+                pending.clear()
+                seq += 1
+
+        async def flush_periodically():
+            while True:
+                await asyncio.sleep(self.stream_coalesce_seconds)
+                flush()
+
+        flusher = asyncio.create_task(flush_periodically())
+        try:
+            async for delta in llm.astream_response(params):
+                parts.append(delta)
+                pending.append(delta)
+                if seq == 0:
+                    flush()     # The first token, without waiting.
+        except asyncio.CancelledError:
+            end_of_stream['error'] = "The request was cancelled or timed out."     # By the timeout of the runner.
+            raise
+        except Exception as ex:
+            end_of_stream['error'] = str(ex)
+            raise
+        finally:
+            # The subscribers wait for the end of the stream, whether the request succeeded or not.
+            flusher.cancel()
+            flush()
+            self.publish(stream_topic, {'seq': seq, **end_of_stream})
+        return ''.join(parts)
+
+
+    def _stream(self, llm:LlmInstance, params, stream_topic):
+        """_astream() with the blocking client; the deltas are flushed as the next ones arrive."""
+        parts, pending, seq = [], [], 0
+        end_of_stream = {'end_of_stream': True}
+        flushed_at = 0
+        try:
+            for delta in llm.stream_response(params):
+                parts.append(delta)
+                pending.append(delta)
+                if time.monotonic() - flushed_at >= self.stream_coalesce_seconds:
+                    self.publish(stream_topic, {'seq': seq, 'delta': ''.join(pending)})
+                    pending.clear()
+                    seq += 1
+                    flushed_at = time.monotonic()
+        except Exception as ex:
+            end_of_stream['error'] = str(ex)
+            raise
+        finally:
+            if pending:
+                self.publish(stream_topic, {'seq': seq, 'delta': ''.join(pending)})
+                seq += 1
+            self.publish(stream_topic, {'seq': seq, **end_of_stream})
+        return ''.join(parts)
@@ -0,0 +1,120 @@
+import asyncio
+import threading
+import time
+
+import logging
+from flowdepot.app_logger import init_logging
+logger:logging.Logger = init_logging()
+
+
+
+class AsyncRunner:
+    """
+    Run coroutines on one event loop in a daemon thread, at most max_in_flight at
+    a time, each within timeout seconds. The callers, e.g. the message handler
+    threads, block in run() until their result, while the loop keeps all the
+    requests in flight over one pooled client.
+    """
+    def __init__(self, max_in_flight: int = 16, timeout: float = 60, name: str = 'llm-loop'):
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name=name, daemon=True)
+        self._thread.start()
+        self._semaphore = self.submit_coroutine(self._create_semaphore()).result()
+
+        # Changed on the loop thread only.
+        self.waiting = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.total_seconds = 0.0
+
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+
+    async def _create_semaphore(self):
+        return asyncio.Semaphore(self.max_in_flight)
+
+
+    def submit_coroutine(self, coroutine):
+        """Run coroutine on the loop as it is, returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+
+    async def _run(self, coroutine_factory, timeout):
+        # The timeout covers the wait for a slot too, the caller doesn't wait longer in all.
+        deadline = self.loop.time() + timeout
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise TimeoutError(f"The request waited over {timeout} seconds for one of {self.max_in_flight} in flight.")
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(coroutine_factory(), deadline - self.loop.time())
+            self.completed += 1
+            return result
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise TimeoutError(f"The request timed out after {timeout} seconds.")
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self._semaphore.release()
+            self.in_flight -= 1
+            self.total_seconds += time.perf_counter() - started
+
+
+    def submit(self, coroutine_factory, timeout: float = None):
+        """
+        Run coroutine_factory() on the loop, within the in-flight limit and the timeout.
+        The factory is called on the loop thread, so the coroutine is created there.
+        """
+        return self.submit_coroutine(self._run(coroutine_factory, timeout or self.timeout))
+
+
+    def run(self, coroutine_factory, timeout: float = None):
+        return self.submit(coroutine_factory, timeout).result()
+
+
+    def stats(self) -> dict:
+        finished = self.completed + self.errors + self.timeouts
+        return {
+            'max_in_flight': self.max_in_flight,
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'completed': self.completed,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'mean_seconds': self.total_seconds / finished if finished else 0.0,
+        }
+
+
+    async def _cancel_tasks(self):
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+    def close(self, coroutine=None):
+        """Cancel the pending coroutines and stop the loop, after running coroutine, e.g. closing the clients, if given."""
+        if coroutine is not None:
+            try:
+                self.submit_coroutine(coroutine).result(5)
+            except Exception as ex:
+                logger.warning(f"Failed to close: {ex}")
+        self.submit_coroutine(self._cancel_tasks()).result(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(5)
@@ -0,0 +1,170 @@
+"""
+Benchmark the LLM request execution against a local fake OpenAI-compatible
+server, without a broker or an API key.
+
+    python -m flowdepot.agents.llm.benchmark concurrency --requests 200 --latency-ms 200 --max-in-flight 1 16 64
+    python -m flowdepot.agents.llm.benchmark streaming --tokens 500 --token-interval-ms 10
+    python -m flowdepot.agents.llm.benchmark router --requests 300 --slow-fraction 0.03
+
+concurrency: sync, sequential: the blocking client, one request at a time. sync, threads:
+the blocking client, a thread per request, as the agent handles each message in
+a thread. async: the requests run on the event loop of LlmService, up to
+max_in_flight at a time, called from a thread per request.
+
+streaming: The time to the first token and to the whole response, the
+parcels published and the time to join the deltas, streamed and not.
+
+router: The latency percentiles of one degraded upstream, where --slow-fraction
+of the requests take --slow-latency-ms, alone and behind the router with a
+healthy second upstream, hedged and not.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import os
+import statistics
+import sys
+import time
+import types
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from agents.llm.agent import LlmService
+from agents.llm.fake_openai import FakeOpenAIServer
+from agents.topics import AgentTopics
+
+
+
+def create_service(base_url, **config) -> LlmService:
+    service = LlmService("llm-benchmark", {
+        'llm': 'ChatGPT', 'openai_api_key': 'fake', 'base_url': base_url, **config})
+    service.subscribe = lambda *args, **kwargs: None     # No broker.
+    service.on_activate()
+    return service
+
+
+def run(label, func, requests, concurrency):
+    latencies = []
+
+    def timed(i):
+        started = time.perf_counter()
+        func(f"prompt {i}")
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(timed, range(requests)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    print(f"{label:>24}: {elapsed:7.2f}s, {requests / elapsed:7.1f} requests/s, "
+          f"latency p50 {statistics.median(latencies) * 1000:7.0f} ms, p95 {latencies[int(len(latencies) * 0.95)] * 1000:7.0f} ms")
+
+
+def benchmark_concurrency(args):
+    server = FakeOpenAIServer(latency=args.latency_ms / 1000).start()
+    try:
+        sync = create_service(server.base_url, **{'async': False})
+        run("sync, sequential", sync.llm.generate_response, min(args.requests, 20), 1)
+        run("sync, threads", sync.llm.generate_response, args.requests, args.requests)
+
+        for max_in_flight in args.max_in_flight:
+            service = create_service(server.base_url, max_in_flight=max_in_flight)
+            run(f"async, {max_in_flight} in flight",
+                lambda prompt: service.runner.run(lambda: service.llm.agenerate_response(prompt)), args.requests, args.requests)
+            service.on_terminated()
+    finally:
+        server.stop()
+
+
+def benchmark_streaming(args):
+    reply = ' '.join(f"token{i}" for i in range(args.tokens))
+    server = FakeOpenAIServer(latency=args.latency_ms / 1000, reply=reply, token_interval=args.token_interval_ms / 1000).start()
+    try:
+        for streaming in (False, True):
+            service = create_service(server.base_url, streaming=streaming)
+            published = []
+            started = time.perf_counter()
+            service.publish = lambda topic, data: published.append(time.perf_counter() - started)
+            prompt = types.SimpleNamespace(content="prompt", topic_return="benchmark")
+            response = service.handle_prompt(AgentTopics.LLM_PROMPT, prompt)['response']
+            elapsed = time.perf_counter() - started
+            first = published[0] if published else elapsed
+            print(f"{'streamed' if streaming else 'whole':>10}: first token {first * 1000:7.0f} ms, "
+                  f"response {elapsed * 1000:7.0f} ms, {len(published)} parcels, {len(response)} characters")
+            service.on_terminated()
+
+        deltas = [f"token{i} " for i in range(args.tokens * 20)]
+        for label, join in (("+=", join_by_concatenation), ("''.join", ''.join)):
+            started = time.perf_counter()
+            join(deltas)
+            print(f"{label:>10}: {len(deltas)} deltas joined in {(time.perf_counter() - started) * 1000:7.2f} ms")
+    finally:
+        server.stop()
+
+
+def benchmark_router(args):
+    degraded = FakeOpenAIServer(latency=args.latency_ms / 1000, token_interval=0,
+                                slow_fraction=args.slow_fraction, slow_latency=args.slow_latency_ms / 1000).start()
+    healthy = FakeOpenAIServer(latency=args.latency_ms * 1.5 / 1000, token_interval=0).start()
+    backends = [{'name': 'degraded', 'base_url': degraded.base_url}, {'name': 'healthy', 'base_url': healthy.base_url}]
+    try:
+        for label, base_url, config in (
+                ("degraded alone", degraded.base_url, {}),
+                ("router, no hedging", None, {'llm': 'Router', 'backends': backends, 'hedge': False}),
+                ("router, hedging", None, {'llm': 'Router', 'backends': backends})):
+            service = create_service(base_url, **config, cache=False, coalesce=False)
+            latencies = []
+            for i in range(args.requests):
+                started = time.perf_counter()
+                service.runner.run(lambda: service.llm.agenerate_response(f"prompt {i}"))
+                latencies.append(time.perf_counter() - started)
+            latencies.sort()
+            print(f"{label:>20}: " + ", ".join(
+                f"p{percent} {latencies[min(len(latencies) - 1, len(latencies) * percent // 100)] * 1000:6.0f} ms"
+                for percent in (50, 95, 99)))
+            if router := service.handle_stats(None, None)['router']:
+                print(f"{'':>20}  hedges {router['hedges']}, won {router['hedge_wins']}, "
+                      f"requests {[backend['requests'] for backend in router['backends']]}")
+            service.on_terminated()
+    finally:
+        degraded.stop()
+        healthy.stop()
+
+
+def join_by_concatenation(deltas):
+    """As the streamed responses were joined before."""
+    result = ""
+    for delta in deltas:
+        result += delta
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM request execution benchmarks.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    concurrency = subparsers.add_parser("concurrency", help="Throughput of the sync and async execution.")
+    concurrency.add_argument("--requests", type=int, default=200, help="Concurrent requests.")
+    concurrency.add_argument("--max-in-flight", type=int, nargs="+", default=[1, 16, 64])
+    concurrency.set_defaults(func=benchmark_concurrency)
+
+    streaming = subparsers.add_parser("streaming", help="Time to the first token, streamed and not.")
+    streaming.add_argument("--tokens", type=int, default=500)
+    streaming.add_argument("--token-interval-ms", type=float, default=10)
+    streaming.set_defaults(func=benchmark_streaming)
+
+    router = subparsers.add_parser("router", help="Tail latency behind the router, with a degraded upstream.")
+    router.add_argument("--requests", type=int, default=300, help="Sequential requests.")
+    router.add_argument("--slow-fraction", type=float, default=0.03)
+    router.add_argument("--slow-latency-ms", type=float, default=1000)
+    router.set_defaults(func=benchmark_router)
+
+    for subparser in subparsers.choices.values():
+        subparser.add_argument("--latency-ms", type=float, default=100 if subparser is router else 200,
+                               help="The latency of the fake server.")
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
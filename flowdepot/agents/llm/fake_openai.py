@@ -0,0 +1,138 @@
+"""
+A local OpenAI-compatible chat completions server, for the benchmarks and the tests.
+It answers POST /v1/chat/completions after latency seconds, with reply, or
+'echo: ' and the last message, generated word by word, token_interval seconds
+apart; streamed as server-sent events with stream: true. With status, e.g.
+429 or 500, it answers with that error instead. A slow_fraction of the requests
+take slow_latency instead of latency, a degraded upstream.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import re
+import threading
+import time
+
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"     # Keep-alive, so the clients can pool their connections.
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        if status == 429:
+            self.send_header('Retry-After', '1')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass        # The client has given up, e.g. timed out.
+
+
+    def _send_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+
+    def _stream(self, model, text, token_interval):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for i, token in enumerate(re.findall(r"\S+\s*|\s+", text) + [None]):
+                if i:
+                    time.sleep(token_interval)
+                chunk = {
+                    'id': 'chatcmpl-fake',
+                    'object': 'chat.completion.chunk',
+                    'created': int(time.time()),
+                    'model': model,
+                    'choices': [{
+                        'index': 0,
+                        'delta': {'content': token} if token is not None else {},
+                        'finish_reason': None if token is not None else 'stop',
+                    }],
+                }
+                self._send_chunk(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self._send_chunk(b"data: [DONE]\n\n")
+            self._send_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+    def do_POST(self):
+        server: FakeOpenAIServer = self.server.fake
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if not self.path.endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': f"Unknown path: {self.path}"}})
+            return
+
+        server.count_request()
+        time.sleep(server.slow_latency if random.random() < server.slow_fraction else server.latency)
+        if server.status != 200:
+            self._send_json(server.status, {'error': {'message': f"Fake error {server.status}", 'type': 'fake', 'code': None}})
+            return
+        text = server.reply if server.reply is not None else f"echo: {request['messages'][-1]['content']}"
+        if request.get('stream'):
+            self._stream(request.get('model', 'fake'), text, server.token_interval)
+            return
+        time.sleep(server.token_interval * len(re.findall(r"\S+\s*|\s+", text)))     # Generated as long as streamed.
+        self._send_json(200, {
+            'id': 'chatcmpl-fake',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'fake'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': text},
+                'finish_reason': 'stop',
+            }],
+            'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2},
+        })
+
+
+
+class FakeOpenAIServer:
+    """Serve on 127.0.0.1 in a daemon thread, on port, or a free port if 0; base_url is for the clients."""
+    def __init__(self, latency: float = 0.1, reply: str = None, token_interval: float = 0.01, status: int = 200,
+                 slow_fraction: float = 0, slow_latency: float = 0, port: int = 0):
+        self.latency = latency
+        self.status = status
+        self.slow_fraction = slow_fraction
+        self.slow_latency = slow_latency
+        self.reply = reply
+        self.token_interval = token_interval
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name='fake-openai', daemon=True).start()
+        return self
+
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
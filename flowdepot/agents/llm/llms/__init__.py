@@ -1,10 +1,11 @@
 from agents.llm.llms.chatgpt import ChatGPT
+from agents.llm.llms.router import LlmRouter
+
+
+LLMS = {llm.name: llm for llm in (ChatGPT, LlmRouter)}
 
 
 def create_instance(name, params):
-    if name == ChatGPT.name:
-        llm = ChatGPT(params)
-    else:
-        llm = ChatGPT(params)
-        
-    return llm
+    if name not in LLMS:
+        raise ValueError(f"Unknown LLM: {name}, available: {', '.join(LLMS)}")
+    return LLMS[name](params)
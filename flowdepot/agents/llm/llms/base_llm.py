@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+import asyncio
 
 
 
@@ -10,3 +11,27 @@ class LlmInstance(ABC):
     @abstractmethod
     def generate_response(self, params):
         pass
+
+
+    def request_key(self, params) -> dict:
+        """What decides the response to params, e.g. the model, messages and temperature; None if unknown."""
+        return None
+
+
+    async def agenerate_response(self, params):
+        """The async version of generate_response(); by default, it runs in a thread."""
+        return await asyncio.to_thread(self.generate_response, params)
+
+
+    def stream_response(self, params):
+        """Yield the response text in deltas as it's generated; by default, all at once."""
+        yield self.generate_response(params)
+
+
+    async def astream_response(self, params):
+        """The async version of stream_response()."""
+        yield await self.agenerate_response(params)
+
+
+    async def aclose(self):
+        pass
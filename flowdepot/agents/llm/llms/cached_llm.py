@@ -0,0 +1,150 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+
+import logging
+from flowdepot.app_logger import init_logging
+logger:logging.Logger = init_logging()
+
+from agents.llm.llms.base_llm import LlmInstance
+from flowdepot.cache import DiskCache
+
+
+
+def canonical_key(request: dict) -> str:
+    """The sha256 of the request as canonical JSON: sorted keys, no spaces."""
+    text = json.dumps(request, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+
+class CachedLlm(LlmInstance):
+    """
+    A response cache in front of llm, keyed by the canonical hash of llm.request_key():
+    the model, messages, temperature and response format. Only the requests decoded
+    deterministically (temperature 0) are cached.
+
+    cache is an LruCache, DiskCache or TieredCache of them; the entries expire after
+    ttl seconds in every tier. A request with 'cache': False in its parameters skips
+    the lookup, and its response replaces the cached one.
+
+    With a DiskCache tier, the async paths look up and store in a thread, off the
+    event loop which keeps the other requests in flight.
+    """
+    def __init__(self, llm: LlmInstance, cache, ttl: float = None):
+        super().__init__(name=llm.name)
+        self.llm = llm
+        self.cache = cache
+        self.ttl = ttl
+        self._blocking = any(isinstance(tier, DiskCache) for tier in getattr(cache, 'tiers', [cache]))
+        self._lock = threading.Lock()
+        self.bypassed = 0
+        self.uncacheable = 0
+        self.expired = 0      # Found in the cache, but too old; counted as hits by the tiers.
+
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+
+    def request_key(self, params) -> dict:
+        return self.llm.request_key(params)
+
+
+    def _cache_key(self, params) -> str:
+        """The key if the response can be cached, else None."""
+        request = self.llm.request_key(params)
+        if request is None or request.get('temperature') != 0:
+            self._count('uncacheable')
+            return None
+        return canonical_key(request)
+
+
+    def _lookup(self, params):
+        """The cache key (None if not cached) and the cached response (None on a miss)."""
+        if (key := self._cache_key(params)) is None:
+            return None, None
+        if isinstance(params, dict) and params.get('cache') is False:
+            self._count('bypassed')
+            return key, None
+        if (entry := self.cache.get(key)) is not None:
+            expire_at, response = entry
+            if expire_at is None or expire_at > time.time():
+                return key, response
+            self._count('expired')
+            self.cache.pop(key)
+        return key, None
+
+
+    def _store(self, key, response):
+        if key is not None and response:
+            self.cache.put(key, (time.time() + self.ttl if self.ttl else None, response))
+
+
+    async def _alookup(self, params):
+        if self._blocking:
+            return await asyncio.to_thread(self._lookup, params)
+        return self._lookup(params)
+
+
+    async def _astore(self, key, response):
+        if self._blocking and key is not None:
+            await asyncio.to_thread(self._store, key, response)
+        else:
+            self._store(key, response)
+
+
+    def generate_response(self, params):
+        key, response = self._lookup(params)
+        if response is None:
+            response = self.llm.generate_response(params)
+            self._store(key, response)
+        return response
+
+
+    async def agenerate_response(self, params):
+        key, response = await self._alookup(params)
+        if response is None:
+            response = await self.llm.agenerate_response(params)
+            await self._astore(key, response)
+        return response
+
+
+    def stream_response(self, params):
+        key, response = self._lookup(params)
+        if response is not None:
+            yield response      # All at once.
+            return
+        parts = []
+        for delta in self.llm.stream_response(params):
+            parts.append(delta)
+            yield delta
+        self._store(key, ''.join(parts))
+
+
+    async def astream_response(self, params):
+        key, response = await self._alookup(params)
+        if response is not None:
+            yield response
+            return
+        parts = []
+        async for delta in self.llm.astream_response(params):
+            parts.append(delta)
+            yield delta
+        await self._astore(key, ''.join(parts))
+
+
+    async def aclose(self):
+        await self.llm.aclose()
+
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = {'bypassed': self.bypassed, 'uncacheable': self.uncacheable, 'expired': self.expired}
+        return {
+            **self.cache.stats(),
+            **counts,
+        }
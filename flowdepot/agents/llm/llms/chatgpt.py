@@ -1,4 +1,3 @@
-from openai import OpenAI
 import json
 import yaml
 
@@ -17,6 +16,10 @@ class ChatGPT(LlmInstance):
         'temperature': 0,
         'streaming': False,
         'openai_api_key': "",
+        'base_url': None,           # An OpenAI-compatible server, None for OpenAI.
+        'max_retries': 2,
+        'request_timeout': 60,
+        'max_in_flight': 16,        # The connection pool size of the async client.
     }
 
 
@@ -31,24 +34,33 @@ class ChatGPT(LlmInstance):
         self.streaming = self.prompt_params['streaming']
         self.api_key = self.prompt_params['openai_api_key']
         self.response_format = self.prompt_params.get('response_format', None)
-
-        self.client = OpenAI(api_key=self.api_key)
-
-
-    def generate_response(self, prompt_params):
-        """
-        Generate a response from an OpenAI chat model.
-
-        Args:
-            params (str | list[dict] | dict): 
-                - If str: treated as a single prompt.
-                - If list of dicts: treated as a messages array.
-                - If dict: should include a 'messages' key and optionally other settings 
-                like 'model', 'temperature', etc.
-
-        Returns:
-            str: The generated response text (streamed or full depending on settings).
-        """
+        self.base_url = self.prompt_params['base_url']
+
+        from openai import OpenAI     # Deferred, importing openai takes about a second.
+        self.client = OpenAI(api_key=self.api_key, base_url=self.base_url,
+                             max_retries=self.prompt_params['max_retries'], timeout=self.prompt_params['request_timeout'])
+        self._async_client = None
+
+
+    @property
+    def async_client(self):
+        # Created on first use, in the event loop which uses it; its connections are pooled.
+        if self._async_client is None:
+            from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+            max_in_flight = self.prompt_params['max_in_flight']
+            try:
+                import httpx
+                http_client = DefaultAsyncHttpxClient(limits=httpx.Limits(
+                    max_connections=max_in_flight, max_keepalive_connections=max_in_flight))
+            except ImportError:
+                http_client = None      # The default pool of openai.
+            self._async_client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, http_client=http_client,
+                                             max_retries=self.prompt_params['max_retries'], timeout=self.prompt_params['request_timeout'])
+        return self._async_client
+
+
+    def _request_kwargs(self, prompt_params) -> dict:
+        """The arguments of chat.completions.create() for prompt_params, see generate_response()."""
         if isinstance(prompt_params, str):
             # prompt text only
             messages = [{"role": "user", "content": prompt_params}]
@@ -74,20 +86,86 @@ class ChatGPT(LlmInstance):
         response_format = params.get('response_format', self.response_format)
         if response_format:
             kwargs['response_format'] = response_format
+        return kwargs
+
+
+    def request_key(self, prompt_params) -> dict:
+        kwargs = self._request_kwargs(prompt_params)
+        return {
+            'model': kwargs['model'],
+            'messages': kwargs['messages'],
+            'temperature': kwargs['temperature'],
+            'response_format': kwargs.get('response_format'),
+        }
+
+
+    def generate_response(self, prompt_params):
+        """
+        Generate a response from an OpenAI chat model.
 
+        Args:
+            params (str | list[dict] | dict): 
+                - If str: treated as a single prompt.
+                - If list of dicts: treated as a messages array.
+                - If dict: should include a 'messages' key and optionally other settings 
+                like 'model', 'temperature', etc.
+
+        Returns:
+            str: The generated response text (streamed or full depending on settings).
+        """
+        kwargs = self._request_kwargs(prompt_params)
         response = self.client.chat.completions.create(**kwargs)
 
-        if self.streaming:
-            result = ""
-            for chunk in response:
-                if chunk.choices and chunk.choices[0].delta.content:
-                    result += chunk.choices[0].delta.content
-            return result
+        if kwargs['stream']:
+            return ''.join(ChatGPT._deltas(response))
         else:
             choice = response.choices[0]
             return choice.message.content
 
 
+    async def agenerate_response(self, prompt_params):
+        """generate_response() with the async client, in the running event loop."""
+        kwargs = self._request_kwargs(prompt_params)
+        response = await self.async_client.chat.completions.create(**kwargs)
+
+        if kwargs['stream']:
+            return ''.join([delta async for delta in ChatGPT._adeltas(response)])
+        else:
+            return response.choices[0].message.content
+
+
+    @staticmethod
+    def _deltas(response):
+        for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+    @staticmethod
+    async def _adeltas(response):
+        async for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+    def stream_response(self, prompt_params):
+        kwargs = self._request_kwargs(prompt_params)
+        kwargs['stream'] = True
+        yield from ChatGPT._deltas(self.client.chat.completions.create(**kwargs))
+
+
+    async def astream_response(self, prompt_params):
+        kwargs = self._request_kwargs(prompt_params)
+        kwargs['stream'] = True
+        async for delta in ChatGPT._adeltas(await self.async_client.chat.completions.create(**kwargs)):
+            yield delta
+
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.close()
+
+
 if __name__ == '__main__':
     prompt_text = "Please create a question about the water cycle."
     
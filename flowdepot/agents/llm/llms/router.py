@@ -0,0 +1,335 @@
+import asyncio
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import threading
+import time
+
+import logging
+from flowdepot.app_logger import init_logging
+logger:logging.Logger = init_logging()
+
+from agents.llm.llms.base_llm import LlmInstance
+
+
+
+def _retry_after(ex) -> float:
+    """The Retry-After seconds of a 429 error of openai, if any."""
+    try:
+        return float(ex.response.headers.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+
+class _Backend:
+    """An LlmInstance with its observed latency and errors."""
+    def __init__(self, name, llm: LlmInstance, alpha, window):
+        self.name = name
+        self.llm = llm
+        self.alpha = alpha
+        self.latencies = deque(maxlen=window)
+        self.ewma = None            # Seconds, of the whole responses.
+        self.first_delta_ewma = None    # Seconds to the first delta of the streamed responses.
+        self.error_rate = 0.0       # The EWMA of 1 for an error, 0 for a success.
+        self.cooling_until = 0.0    # Not chosen first until then, after a 429.
+        self.last_used = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+
+
+    def record(self, seconds, error=None, cooldown=0.0, first_delta=False):
+        """
+        Record a request. The time to the first delta of a stream is kept apart, a
+        fraction of a whole response's, so it doesn't lower the hedge delay.
+        """
+        with self._lock:
+            if first_delta:
+                self.first_delta_ewma = seconds if self.first_delta_ewma is None else \
+                    self.alpha * seconds + (1 - self.alpha) * self.first_delta_ewma
+            else:
+                self.latencies.append(seconds)
+                self.ewma = seconds if self.ewma is None else self.alpha * seconds + (1 - self.alpha) * self.ewma
+            self.error_rate = self.alpha * (error is not None) + (1 - self.alpha) * self.error_rate
+            if error is not None:
+                self.errors += 1
+            if cooldown:
+                self.rate_limited += 1
+                self.cooling_until = max(self.cooling_until, time.monotonic() + cooldown)
+
+
+    def percentile(self, percent) -> float:
+        with self._lock:
+            latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, len(latencies) * percent // 100)] if latencies else None
+
+
+    def stats(self) -> dict:
+        p95 = self.percentile(95)
+        return {
+            'name': self.name,
+            'ewma_ms': round(self.ewma * 1000, 1) if self.ewma is not None else None,
+            'first_delta_ewma_ms': round(self.first_delta_ewma * 1000, 1) if self.first_delta_ewma is not None else None,
+            'p95_ms': round(p95 * 1000, 1) if p95 is not None else None,
+            'error_rate': round(self.error_rate, 3),
+            'requests': self.requests,
+            'errors': self.errors,
+            'rate_limited': self.rate_limited,
+            'cooling': self.cooling_until > time.monotonic(),
+        }
+
+
+
+class LlmRouter(LlmInstance):
+    """
+    Route each request to one of several backends, e.g. OpenAI-compatible endpoints
+    or API keys, configured as params['backends']: a list of LLM params, each with an
+    optional 'name' and 'llm' (ChatGPT by default) and overriding the shared params.
+
+    The backends are ranked by the EWMA of their latency, weighted by their error rate;
+    a backend unused for probe_seconds, or never used, is ranked first once, so a
+    recovered one is noticed. A request still running after the p95 latency of its
+    backend is hedged: sent to the next backend too, and the first response wins.
+    On an error, the next backend is tried; after a 429, the backend is ranked last
+    for its Retry-After, or cooldown_seconds.
+    """
+    name = "Router"
+
+    default_params = {
+        'ewma_alpha': 0.2,
+        'error_penalty': 10,        # An error rate of 0.1 doubles the latency score.
+        'window': 200,              # Latencies kept for the percentile.
+        'hedge': True,
+        'hedge_percentile': 95,
+        'hedge_min_samples': 20,    # No hedging before.
+        'hedge_min_ms': 50,
+        'cooldown_seconds': 5,
+        'probe_seconds': 30,
+    }
+
+
+    def __init__(self, params: dict):
+        super().__init__(name=LlmRouter.name)
+        from agents.llm.llms import create_instance     # Deferred, llms imports this module.
+
+        self.params = LlmRouter.default_params.copy()
+        self.params.update(params)
+        shared = {key: value for key, value in params.items() if key not in ('backends', 'llm', 'name')}
+        shared.setdefault('max_retries', 0)     # Fail over instead.
+
+        self.backends: list[_Backend] = []
+        for i, backend_params in enumerate(params.get('backends') or []):
+            backend_params = {**shared, **backend_params}
+            llm = create_instance(backend_params.get('llm', 'ChatGPT'), backend_params)
+            self.backends.append(_Backend(backend_params.get('name', f"backend-{i}"), llm,
+                                          self.params['ewma_alpha'], self.params['window']))
+        if not self.backends:
+            raise ValueError("The router needs at least one backend in 'backends'.")
+
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        self._executor = None       # For hedging the blocking calls.
+        self._executor_lock = threading.Lock()
+
+
+    def _ranked(self) -> list[_Backend]:
+        now = time.monotonic()
+
+        def score(backend: _Backend):
+            cooling = backend.cooling_until > now
+            # By the whole responses; by the first deltas if the backend has only streamed.
+            latency = backend.ewma if backend.ewma is not None else backend.first_delta_ewma
+            if not cooling and (latency is None or now - backend.last_used > self.params['probe_seconds']):
+                return (0, 0.0)
+            return (int(cooling), latency * (1 + self.params['error_penalty'] * backend.error_rate))
+
+        return sorted(self.backends, key=score)
+
+
+    def _hedge_delay(self, backend: _Backend) -> float:
+        """Seconds before hedging a request to backend, None for no hedging."""
+        if not self.params['hedge'] or len(self.backends) < 2 or len(backend.latencies) < self.params['hedge_min_samples']:
+            return None
+        return max(self.params['hedge_min_ms'] / 1000, backend.percentile(self.params['hedge_percentile']))
+
+
+    def _started(self, backend: _Backend):
+        backend.requests += 1
+        backend.last_used = time.monotonic()
+        return time.perf_counter()
+
+
+    def _failed(self, backend: _Backend, started, ex, first_delta=False):
+        status = getattr(ex, 'status_code', None)
+        cooldown = (_retry_after(ex) or self.params['cooldown_seconds']) if status == 429 else 0.0
+        backend.record(time.perf_counter() - started, error=ex, cooldown=cooldown, first_delta=first_delta)
+        logger.warning(f"Backend {backend.name} failed: {ex}")
+
+
+    def _call(self, backend: _Backend, params):
+        started = self._started(backend)
+        try:
+            result = backend.llm.generate_response(params)
+        except Exception as ex:
+            self._failed(backend, started, ex)
+            raise
+        backend.record(time.perf_counter() - started)
+        return result
+
+
+    async def _acall(self, backend: _Backend, params):
+        started = self._started(backend)
+        try:
+            result = await backend.llm.agenerate_response(params)
+        except asyncio.CancelledError:
+            # Lost a hedge; it took at least this long.
+            backend.record(time.perf_counter() - started)
+            raise
+        except Exception as ex:
+            self._failed(backend, started, ex)
+            raise
+        backend.record(time.perf_counter() - started)
+        return result
+
+
+    def request_key(self, params) -> dict:
+        """
+        The request key of the backends, with the models of them all: any one may answer.
+        None if the backends would send the request differently otherwise, e.g. another temperature.
+        """
+        keys = [backend.llm.request_key(params) for backend in self.backends]
+        if any(key is None for key in keys):
+            return None
+        models = sorted({str(key.get('model')) for key in keys})
+        if any({**key, 'model': None} != {**keys[0], 'model': None} for key in keys):
+            return None
+        return {**keys[0], 'model': models[0] if len(models) == 1 else models}
+
+
+    def generate_response(self, params):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.params.get('max_in_flight', 16) * len(self.backends),
+                                                    thread_name_prefix='llm-router')
+        candidates = iter(self._ranked())
+        first = next(candidates)
+        pending = {self._executor.submit(self._call, first, params): first}
+        hedged = set()      # The hedge requests; the failovers are not.
+        hedge_delay = self._hedge_delay(first)
+        error = None
+
+        while pending:
+            done, _ = wait(pending, timeout=hedge_delay, return_when=FIRST_COMPLETED)
+            if not done:
+                hedge_delay = None      # Hedged once.
+                if (backend := next(candidates, None)) is not None:
+                    self.hedges += 1
+                    future = self._executor.submit(self._call, backend, params)
+                    pending[future] = backend
+                    hedged.add(future)
+                continue
+            for future in done:
+                pending.pop(future)
+                if future.exception() is None:
+                    self.hedge_wins += future in hedged
+                    return future.result()      # A slower one left running still updates its backend.
+                error = future.exception()
+            if not pending and (backend := next(candidates, None)) is not None:
+                self.failovers += 1
+                pending[self._executor.submit(self._call, backend, params)] = backend
+        raise error
+
+
+    async def agenerate_response(self, params):
+        candidates = iter(self._ranked())
+        first = next(candidates)
+        pending = {asyncio.ensure_future(self._acall(first, params)): first}
+        hedged = set()
+        hedge_delay = self._hedge_delay(first)
+        error = None
+
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedge_delay = None
+                    if (backend := next(candidates, None)) is not None:
+                        self.hedges += 1
+                        task = asyncio.ensure_future(self._acall(backend, params))
+                        pending[task] = backend
+                        hedged.add(task)
+                    continue
+                for task in done:
+                    pending.pop(task)
+                    if task.exception() is None:
+                        self.hedge_wins += task in hedged
+                        return task.result()
+                    error = task.exception()
+                if not pending and (backend := next(candidates, None)) is not None:
+                    self.failovers += 1
+                    pending[asyncio.ensure_future(self._acall(backend, params))] = backend
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+    def stream_response(self, params):
+        """Fail over until the first delta, then stay with that backend; not hedged."""
+        error = None
+        for i, backend in enumerate(self._ranked()):
+            self.failovers += i > 0
+            started, streaming = self._started(backend), False
+            try:
+                for delta in backend.llm.stream_response(params):
+                    if not streaming:
+                        streaming = True
+                        backend.record(time.perf_counter() - started, first_delta=True)
+                    yield delta
+            except Exception as ex:
+                if streaming:
+                    raise
+                self._failed(backend, started, ex, first_delta=True)
+                error = ex
+                continue
+            return
+        raise error
+
+
+    async def astream_response(self, params):
+        error = None
+        for i, backend in enumerate(self._ranked()):
+            self.failovers += i > 0
+            started, streaming = self._started(backend), False
+            try:
+                async for delta in backend.llm.astream_response(params):
+                    if not streaming:
+                        streaming = True
+                        backend.record(time.perf_counter() - started, first_delta=True)
+                    yield delta
+            except Exception as ex:
+                if streaming:
+                    raise
+                self._failed(backend, started, ex, first_delta=True)
+                error = ex
+                continue
+            return
+        raise error
+
+
+    async def aclose(self):
+        for backend in self.backends:
+            await backend.llm.aclose()
+        if self._executor:
+            self._executor.shutdown(wait=False)
+
+
+    def stats(self) -> dict:
+        return {
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            'failovers': self.failovers,
+            'backends': [backend.stats() for backend in self.backends],
+        }
@@ -0,0 +1,50 @@
+from concurrent.futures import Future
+import threading
+
+
+
+class SingleFlight:
+    """
+    Deduplicate concurrent calls by key: the first caller of a key runs the call, the
+    callers arriving while it's in flight wait for it and get the same result, or
+    the same exception. The key is forgotten when the call completes.
+    """
+    def __init__(self):
+        self._calls: dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+
+    def run(self, key, func):
+        with self._lock:
+            future = self._calls.get(key)
+            if future is None:
+                future = self._calls[key] = Future()
+                self.leaders += 1
+                leader = True
+            else:
+                self.followers += 1
+                leader = False
+        if not leader:
+            return future.result()
+
+        try:
+            result = func()
+        except BaseException as ex:
+            future.set_exception(ex)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+    def stats(self) -> dict:
+        return {
+            'in_flight': len(self._calls),
+            'leaders': self.leaders,
+            'followers': self.followers,
+        }
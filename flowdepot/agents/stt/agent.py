@@ -1,15 +1,22 @@
+import hashlib
+import json
 import re
 from urllib import response
 import magic
 import os
 from pathlib import Path
 import tempfile
-import torch
-import whisper
 
 from agentflow.core.agent import Agent
 from agentflow.core.parcel import BinaryParcel
+from flowdepot import startup_profile
+from flowdepot.agents.stt.audio_decoder import FfmpegDecoderPool, SAMPLE_RATE
+from flowdepot.agents.stt.batching import MicroBatcher
+from flowdepot.agents.stt.engines import SEGMENT_SECONDS, BatchingEngine, SttEngine, create_engine
+from flowdepot.agents.stt.vad import EnergyVad
+from flowdepot.agents.stt.worker_pool import ForkedWorkerPool
 from flowdepot.agents.topics import AgentTopics
+from flowdepot.cache import DiskCache, LruCache, TieredCache
 
 import logging
 from flowdepot.app_logger import init_logging
@@ -22,21 +29,91 @@ class SttService(Agent):
         logger.info(f"name: {name}, agent_config: {agent_config}")
         super().__init__(name, agent_config)
         self.whisper_model_name = agent_config["whisper_model"]
+        # whisper (fp32), whisper-int8 (dynamic quantization, CPU) or faster-whisper; see engines.py.
+        self.engine: SttEngine = create_engine(agent_config.get("engine", "whisper"), self.whisper_model_name,
+                                               agent_config.get("cpu_threads", 0), agent_config.get("engine_params"))
+        # Concurrent requests are decoded together in batches of 30-second segments, with a plain
+        # decode instead of transcribe(), see WhisperEngine.decode_batch; 1 disables batching.
+        self.batch_max_size = agent_config.get("batch_max_size", 1)
+        self.batch_max_wait_ms = agent_config.get("batch_max_wait_ms", 50)
+        self.batcher: MicroBatcher = None
+        # Audio is piped through pre-spawned ffmpeg processes; 0 decodes via a temporary file.
+        self.decoder_pool_size = agent_config.get("decoder_pool_size", 2)
+        self.decoder_pool: FfmpegDecoderPool = None
+        # {'stream': True} requests are transcribed and published window by window.
+        self.stream_window_seconds = agent_config.get("stream_window_seconds", 30)
+        # Silence is cut by an energy VAD before the audio is transcribed.
+        self.vad = EnergyVad(**agent_config.get("vad_params", {})) if agent_config.get("vad", False) else None
+        # The model is loaded once in a zygote process, forked into N workers, each on its own CPUs.
+        self.workers = agent_config.get("workers", 1)
+        self.worker_threads = agent_config.get("worker_threads", 0)
+        self.pin_cores = agent_config.get("pin_cores", True)
+        self.worker_pool: ForkedWorkerPool = None
         
         # Create "temp" folder in current execution path if it doesn't exist for audio files.
         self.temp_root = Path.cwd() / "temp"
         self.temp_root.mkdir(exist_ok=True)
 
+        # Transcriptions by the content hash, model and options; in memory, then on disk.
+        cache_max_entries = agent_config.get("cache_max_entries", 1024)
+        cache_max_bytes = agent_config.get("cache_max_bytes", 512 * 1024 * 1024)
+        cache_directory = agent_config.get("cache_directory", str(self.temp_root / "stt_cache"))
+        self.transcription_cache = TieredCache(
+            LruCache(max_entries=cache_max_entries) if cache_max_entries else None,
+            DiskCache(cache_directory, cache_max_bytes) if cache_max_bytes else None)
+
 
     def on_activate(self):
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        logger.warning(f'Device of Whisper: {device}')
+        if not self._start_workers():
+            self._load_model()
+        self._start_decoders()
+        self.subscribe(AgentTopics.STT_CONTENT, "str", self.transcribe_content)
+        self.subscribe(AgentTopics.STT_STATS, "str", self.handle_stats)
 
-        # Continue here..
-        logger.warning(f'Loading model: {self.whisper_model_name}')
-        self.whisper_model = whisper.load_model(self.whisper_model_name, device=device)
 
-        self.subscribe(AgentTopics.STT_CONTENT, "str", self.transcribe_content)
+    def _start_workers(self) -> bool:
+        """Start the worker pool, which loads the model; False to load it in process instead."""
+        if self.workers <= 1:
+            return False
+        if not hasattr(os, 'fork'):
+            logger.warning(f'Forked workers are not supported on {os.name}, transcribing in process.')
+            return False
+        if self.batch_max_size > 1:
+            logger.warning('Batching is not used with forked workers, each worker transcribes its own request.')
+
+        cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+        threads = self.worker_threads or max(1, cpus // self.workers)
+        if self.engine.threads_after_load:
+            # Loaded single-threaded in the zygote, so no thread pool is forked; each worker sets its own.
+            self.engine.cpu_threads = 1
+        else:
+            self.engine.cpu_threads, threads = threads, 0
+        with startup_profile.phase(self.name, 'model load'):
+            self.worker_pool = ForkedWorkerPool(self.engine, self.workers, self.pin_cores, threads)
+        return True
+
+
+    def _engine_transcribe(self, audio, initial_prompt=None) -> dict:
+        if self.worker_pool:
+            return self.worker_pool.call('transcribe', audio, initial_prompt).result()
+        return self.engine.transcribe(audio, initial_prompt=initial_prompt)
+
+
+    def _start_decoders(self):
+        if self.decoder_pool_size > 0:
+            self.decoder_pool = FfmpegDecoderPool(self.decoder_pool_size)
+
+
+    def _load_model(self):
+        with startup_profile.phase(self.name, 'model load'):
+            # torch and whisper take seconds to import, so they are imported on activation.
+            self.engine.load()
+
+        if self.batch_max_size > 1:
+            if isinstance(self.engine, BatchingEngine):
+                self.batcher = MicroBatcher(self.engine.decode_batch, self.batch_max_size, self.batch_max_wait_ms, name=f'{self.name}-batcher')
+            else:
+                logger.warning(f'The {self.engine.name} engine does not support batching, batch_max_size is ignored.')
 
 
     def transcribe_content(self, topic:str, pcl:BinaryParcel):
@@ -49,7 +126,20 @@ class SttService(Agent):
             file_mime_type = mime.from_buffer(content)
             logger.info(f'file_mime_type: {file_mime_type}')
             if file_mime_type.startswith('audio/') or file_mime_type.startswith('video/'):
-                response['text'] = self._transcribe_content(topic, content, file_mime_type.split('/')[-1])
+                audio_type = file_mime_type.split('/')[-1]
+                window_seconds = audio_info.get('window_seconds', self.stream_window_seconds) if audio_info.get('stream') else None
+                cache_key = self._cache_key(content, window_seconds)
+                if (transcription := self.transcription_cache.get(cache_key)) is not None:
+                    logger.info(f'Transcription cache hit: {cache_key[0]}')
+                    if window_seconds:
+                        self._replay_stream(pcl.topic_return, transcription['segments'])
+                else:
+                    if window_seconds:
+                        transcription = self._transcribe_stream(pcl.topic_return, content, audio_type, window_seconds)
+                    else:
+                        transcription = {'text': self._transcribe_content(topic, content, audio_type)}
+                    self.transcription_cache.put(cache_key, transcription)
+                response.update(transcription)
                 response['mime_type'] = file_mime_type
                 response['topic'] = topic
             else:
@@ -61,21 +151,170 @@ class SttService(Agent):
         return response
 
 
+    def _cache_key(self, content, window_seconds=None):
+        """The content hash with everything that changes the transcription of the content."""
+        options = {
+            'model': self.whisper_model_name,
+            **self.engine.cache_options(),
+            'batched': self.batcher is not None,
+            'window_seconds': window_seconds,
+            'vad': self.vad.options() if self.vad else None,
+        }
+        return hashlib.sha256(content).hexdigest(), json.dumps(options, sort_keys=True)
+
+
+    def _replay_stream(self, topic_return, segments):
+        """Publish the cached segments of a streamed transcription as _transcribe_stream did."""
+        if topic_return:
+            for segment in segments:
+                self.publish(f"{topic_return}/partial", segment)
+            self.publish(f"{topic_return}/partial", {'seq': len(segments), 'end_of_stream': True})
+
+
+    def handle_stats(self, topic:str, pcl:BinaryParcel):
+        """Return the transcription cache hits and misses, the batching statistics, the speech ratio found by the VAD and the worker memory."""
+        return {
+            'cache': self.transcription_cache.stats(),
+            'batcher': self.batcher.stats() if self.batcher else None,
+            'vad': self.vad.stats() if self.vad else None,
+            'workers': self.worker_pool.stats() if self.worker_pool else None,
+        }
+
+
     def _transcribe_content(self, _, content, audio_type):
+        return self._transcribe_audio(self._load_audio(content, audio_type))
+
+
+    def _load_audio(self, content, audio_type):
+        """Decode the content to a 16 kHz mono float32 array."""
+        if self.decoder_pool:
+            try:
+                return self.decoder_pool.decode(content)
+            except RuntimeError as ex:
+                logger.warning(f"Failed to decode from a pipe, retry with a file: {ex}")
+        return self._load_audio_file(content, audio_type)
+
+
+    def _load_audio_file(self, content, audio_type):
+        import whisper
+
         with tempfile.NamedTemporaryFile(mode="wb", suffix=f".{audio_type}", delete=False) as tmp:
             tmp.write(content)
             tmp.flush()
             file_path = Path(tmp.name)
 
         try:
-            result = self.whisper_model.transcribe(str(file_path))
-            transcribed_text = result["text"]
+            return whisper.load_audio(str(file_path))
         finally:
             # 確保即使轉換錯誤也會清理檔案
             if file_path.exists():
                 os.remove(file_path)
 
-        return transcribed_text
+
+    def _transcribe_audio(self, audio):
+        if self.vad:
+            audio, _ = self.vad.compact(audio)
+            if not len(audio):
+                return ""
+
+        if not self.batcher:
+            return self._engine_transcribe(audio)["text"]
+
+        # The 30-second segments of this request join the segments of the other requests in the batches.
+        texts = self.batcher.map(self.engine.log_mel_segments(audio))
+        return " ".join(text.strip() for text in texts if text.strip())
+
+
+    def _transcribe_stream(self, topic_return, content, audio_type, window_seconds):
+        """
+        Transcribe the audio window by window. The segments of a window are published
+        to <topic_return>/partial as {'seq', 'start', 'end', 'text'} as soon as the window
+        is done, followed by {'seq', 'end_of_stream': True} after the last window, or
+        {'seq', 'end_of_stream': True, 'error'} if decoding or transcription fails.
+        Returns the whole text and the segments for the final reply.
+        """
+        partial_topic = f"{topic_return}/partial" if topic_return else None
+        window_samples = int(window_seconds * SAMPLE_RATE)
+        segments = []
+        prompt = None
+        end_of_stream = {'end_of_stream': True}
+        try:
+            for index, window in enumerate(self._audio_windows(content, audio_type, window_samples)):
+                window_segments = self._transcribe_window(window, index * window_samples / SAMPLE_RATE, prompt)
+                for segment in window_segments:
+                    segment['seq'] = len(segments)
+                    segments.append(segment)
+                    if partial_topic:
+                        self.publish(partial_topic, segment)
+                # The text of the previous window conditions the next one, as whisper does across its 30-second windows.
+                prompt = " ".join(segment['text'] for segment in window_segments) or prompt
+                logger.debug(f"Window {index} is transcribed, segments: {len(window_segments)}")
+        except Exception as ex:
+            end_of_stream['error'] = str(ex)
+            raise
+        finally:
+            # The streaming clients wait for it, whether the transcription succeeded or not.
+            if partial_topic:
+                self.publish(partial_topic, {'seq': len(segments), **end_of_stream})
+        return {
+            'text': " ".join(segment['text'] for segment in segments),
+            'segments': segments,
+        }
+
+
+    def _audio_windows(self, content, audio_type, window_samples):
+        """Yield the decoded audio by windows, streamed from ffmpeg when the decoder pool is on."""
+        if self.decoder_pool:
+            windows = self.decoder_pool.decode_stream(content, window_samples)
+            try:
+                first = next(windows, None)
+            except RuntimeError as ex:
+                logger.warning(f"Failed to decode from a pipe, retry with a file: {ex}")
+            else:
+                if first is not None:
+                    yield first
+                    yield from windows
+                return
+
+        audio = self._load_audio_file(content, audio_type)
+        for start in range(0, len(audio), window_samples):
+            yield audio[start:start + window_samples]
+
+
+    def _transcribe_window(self, window, offset, prompt=None):
+        """Transcribe a window of audio; the segment times are shifted by offset seconds."""
+        to_original = lambda seconds: seconds
+        if self.vad:
+            # The times in the compacted audio are mapped back to the times in the window.
+            window, time_map = self.vad.compact(window)
+            if not len(window):
+                return []
+            to_original = time_map.to_original
+
+        if self.batcher:
+            segments = []
+            for i, text in enumerate(self.batcher.map(self.engine.log_mel_segments(window))):
+                if text := text.strip():
+                    start = i * SEGMENT_SECONDS
+                    end = min(start + SEGMENT_SECONDS, len(window) / SAMPLE_RATE)
+                    segments.append({'start': round(offset + to_original(start), 2), 'end': round(offset + to_original(end), 2), 'text': text})
+            return segments
+
+        result = self._engine_transcribe(window, prompt)
+        return [{
+            'start': round(offset + to_original(segment['start']), 2),
+            'end': round(offset + to_original(segment['end']), 2),
+            'text': segment['text'].strip(),
+        } for segment in result['segments'] if segment['text'].strip()]
+
+
+    def on_terminated(self):
+        if self.worker_pool:
+            self.worker_pool.shutdown()
+        if self.batcher:
+            self.batcher.stop()
+        if self.decoder_pool:
+            self.decoder_pool.close()
     
     
 def main():
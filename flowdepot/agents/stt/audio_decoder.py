@@ -0,0 +1,128 @@
+import queue
+import subprocess
+import threading
+
+import numpy as np
+
+import logging
+from flowdepot.app_logger import init_logging
+logger:logging.Logger = init_logging()
+
+
+SAMPLE_RATE = 16000
+
+
+
+class FfmpegDecoderPool:
+    """
+    Decode audio from bytes to a 16 kHz mono float32 array, as whisper.load_audio does,
+    but by piping the bytes through ffmpeg instead of writing a temporary file.
+
+    An ffmpeg process decodes one stream, so the pool keeps `size` processes spawned
+    in advance, waiting on stdin; a process is taken by a request and a new one is
+    spawned by a background thread, which keeps the spawn off the request path.
+
+    Formats which need seeking (e.g. an MP4 with the index at the end) can't be
+    decoded from a pipe; decode() raises RuntimeError for them.
+    """
+    def __init__(self, size: int = 2, ffmpeg: str = 'ffmpeg', sample_rate: int = SAMPLE_RATE):
+        self.size = size
+        self.command = [
+            ffmpeg, '-nostdin', '-loglevel', 'error', '-threads', '0',
+            '-i', 'pipe:0',
+            '-f', 's16le', '-ac', '1', '-acodec', 'pcm_s16le', '-ar', str(sample_rate),
+            'pipe:1',
+        ]
+        self._idle = queue.Queue()
+        self._condition = threading.Condition()
+        self._missing = 0       # Idle processes taken and not spawned again yet.
+        self._closed = False
+        for _ in range(size):
+            self._idle.put(self._spawn())
+        self._replenisher = threading.Thread(target=self._replenish, name='ffmpeg-replenisher', daemon=True)
+        self._replenisher.start()
+
+
+    def _spawn(self) -> subprocess.Popen:
+        return subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+    def _replenish(self):
+        while True:
+            with self._condition:
+                while not self._closed and not self._missing:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                self._missing -= 1
+            self._idle.put(self._spawn())      # close() waits for it, then kills it with the other idle ones.
+
+
+    def _take(self) -> subprocess.Popen:
+        while True:
+            try:
+                process = self._idle.get_nowait()
+            except queue.Empty:
+                process = self._spawn()     # All taken, don't wait for the background spawn.
+            else:
+                with self._condition:
+                    self._missing += 1
+                    self._condition.notify()
+            if process.poll() is None:
+                return process
+            logger.warning(f"An idle ffmpeg exited with {process.returncode}.")
+
+
+    def decode(self, content: bytes) -> np.ndarray:
+        process = self._take()
+        out, err = process.communicate(content)
+        if process.returncode != 0:
+            raise RuntimeError(f"Failed to decode audio: {err.decode(errors='replace').strip()}")
+        return np.frombuffer(out, np.int16).flatten().astype(np.float32) / 32768.0
+
+
+    def decode_stream(self, content: bytes, window_samples: int):
+        """
+        Decode the content window by window; yield arrays of window_samples (the last
+        may be shorter), so only one window of decoded audio is in memory at a time.
+        """
+        process = self._take()
+
+        def feed():
+            try:
+                process.stdin.write(content)
+            except (BrokenPipeError, ValueError):
+                pass        # ffmpeg stopped reading, the error is reported by its exit code.
+            finally:
+                try:
+                    process.stdin.close()
+                except OSError:
+                    pass
+
+        writer = threading.Thread(target=feed, daemon=True)
+        writer.start()
+        with process:
+            try:
+                while block := process.stdout.read(window_samples * 2):
+                    yield np.frombuffer(block, np.int16).astype(np.float32) / 32768.0
+                err = process.stderr.read()
+                if process.wait() != 0:
+                    raise RuntimeError(f"Failed to decode audio: {err.decode(errors='replace').strip()}")
+            finally:
+                if process.poll() is None:
+                    process.kill()      # The consumer stopped early.
+                writer.join()
+
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._replenisher.join()
+        while True:
+            try:
+                process = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            process.kill()
+            process.wait()
@@ -0,0 +1,101 @@
+from concurrent.futures import Future
+import queue
+import threading
+import time
+
+import logging
+from flowdepot.app_logger import init_logging
+logger:logging.Logger = init_logging()
+
+
+
+class MicroBatcher:
+    """
+    Collect the items submitted concurrently and process them as one batch.
+
+    A batch is closed when max_size items are collected, or max_wait_ms after its
+    first item arrived, whichever comes first. process_batch(items) runs on the
+    batcher thread and returns one result per item, in order.
+
+    Parameters:
+        process_batch (callable): list of items -> list of results.
+        max_size (int): The maximum number of items in a batch.
+        max_wait_ms (float): How long the first item of a batch waits for more.
+    """
+    def __init__(self, process_batch, max_size: int = 8, max_wait_ms: float = 50, name: str = 'micro-batcher'):
+        self.process_batch = process_batch
+        self.max_size = max_size
+        self.max_wait_ms = max_wait_ms
+
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.busy_seconds = 0.0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+
+    def submit(self, item) -> Future:
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+
+    def map(self, items) -> list:
+        """Submit the items and wait for their results."""
+        futures = [self.submit(item) for item in items]
+        return [future.result() for future in futures]
+
+
+    def _collect(self) -> list | None:
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while len(batch) < self.max_size:
+            try:
+                job = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if job is None:
+                self._queue.put(None)   # Stop after this batch.
+                break
+            batch.append(job)
+        return batch
+
+
+    def _run(self):
+        while (batch := self._collect()) is not None:
+            started = time.perf_counter()
+            try:
+                results = self.process_batch([item for item, _ in batch])
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as ex:
+                logger.exception(ex)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(ex)
+
+            with self._stats_lock:
+                self.batches += 1
+                self.items += len(batch)
+                self.busy_seconds += time.perf_counter() - started
+            logger.debug(f"Batch of {len(batch)} items processed in {time.perf_counter() - started:.3f}s.")
+
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                'batches': self.batches,
+                'items': self.items,
+                'mean_batch_size': self.items / self.batches if self.batches else 0.0,
+                'queue_depth': self._queue.qsize(),
+                'busy_seconds': self.busy_seconds,
+            }
+
+
+    def stop(self):
+        self._queue.put(None)
@@ -0,0 +1,164 @@
+"""
+Benchmark the STT inference on CPU (or GPU if present), without a broker.
+
+    python -m flowdepot.agents.stt.benchmark batching --model base --requests 16 --batch-sizes 1 4 8
+
+batching: Concurrent requests of the sample audio through the batched decode path,
+with batches of 1 segment and of up to N, in requests and audio seconds per second.
+transcribe(), the unbatched path, is printed for reference with the word error rate
+of each batched output against its text: the batched path decodes each 30-second
+segment once, without transcribe()'s seeking and temperature fallback.
+
+decoding: The latency of decoding the sample audio via a temporary file, as
+whisper.load_audio does, against piping it through the pooled ffmpeg processes.
+
+engines: The load time, latency, real-time factor and word error rate of each
+engine; the reference is --reference, or the output of the first engine. With
+--vad, the silence is cut first, and the speech ratio found is printed.
+
+    python -m flowdepot.agents.stt.benchmark engines --engines whisper whisper-int8 faster-whisper --cpu-threads 4
+"""
+import argparse
+import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import statistics
+import time
+
+from flowdepot.agents.stt.agent import SttService
+from flowdepot.agents.stt.batching import MicroBatcher
+
+
+SAMPLE_AUDIO = Path(__file__).parent / "sample_apeech.mp3"
+
+
+
+def create_service(model, **config) -> SttService:
+    service = SttService("stt-benchmark", {"whisper_model": model, **config})
+    service._load_model()
+    return service
+
+
+def run_concurrently(func, args_list, concurrency):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(func, args_list))
+    return time.perf_counter() - started, results
+
+
+def benchmark_batching(args):
+    content = args.audio.read_bytes()
+    service = create_service(args.model)
+    audio = service._load_audio(content, args.audio.suffix[1:])
+    audio_seconds = len(audio) / 16000
+
+    def report(label, elapsed, extra=""):
+        print(f"{label:>14}: {elapsed:7.2f}s, "
+              f"{args.requests / elapsed:6.2f} requests/s, {args.requests * audio_seconds / elapsed:7.1f} audio s/s" + extra)
+
+    reference = service._transcribe_audio(audio)    # Warm up.
+    elapsed, _ = run_concurrently(service._transcribe_audio, [audio] * args.requests, args.requests)
+    report("transcribe()", elapsed)
+
+    # The same decode path at each size; a batch of 1 decodes the segments one by one.
+    for batch_size in args.batch_sizes:
+        service.batcher = MicroBatcher(service.engine.decode_batch, batch_size, args.wait_ms)
+        text = service._transcribe_audio(audio)
+        elapsed, _ = run_concurrently(service._transcribe_audio, [audio] * args.requests, args.requests)
+        report(f"batch size {batch_size:>3}", elapsed,
+               f", mean batch: {service.batcher.stats()['mean_batch_size']:.1f}, WER vs transcribe(): {word_error_rate(reference, text):6.2%}")
+        service.batcher.stop()
+    service.batcher = None
+    service.on_terminated()
+
+
+def print_latencies(label, latencies):
+    latencies = sorted(latencies)
+    print(f"{label:>6}: mean {statistics.mean(latencies) * 1000:7.1f} ms, "
+          f"p50 {latencies[len(latencies) // 2] * 1000:7.1f} ms, p95 {latencies[int(len(latencies) * 0.95)] * 1000:7.1f} ms")
+
+
+def benchmark_decoding(args):
+    content = args.audio.read_bytes()
+    audio_type = args.audio.suffix[1:]
+    service = SttService("stt-benchmark", {"whisper_model": args.model, "decoder_pool_size": args.pool_size})
+    service._start_decoders()
+
+    for label, load in (("file", service._load_audio_file), ("pipe", service._load_audio)):
+        load(content, audio_type)    # Warm up.
+        latencies = []
+        for _ in range(args.requests):
+            started = time.perf_counter()
+            load(content, audio_type)
+            latencies.append(time.perf_counter() - started)
+        print_latencies(label, latencies)
+    service.on_terminated()
+
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    """The word-level edit distance over the number of reference words, case and punctuation ignored."""
+    ref, hyp = (re.findall(r"\w+", text.lower()) for text in (reference, hypothesis))
+    distances = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        previous, distances[0] = distances[0], i
+        for j, hyp_word in enumerate(hyp, 1):
+            previous, distances[j] = distances[j], min(distances[j] + 1, distances[j - 1] + 1, previous + (ref_word != hyp_word))
+    return distances[-1] / max(len(ref), 1)
+
+
+def benchmark_engines(args):
+    content = args.audio.read_bytes()
+    reference = args.reference
+    for engine in args.engines:
+        started = time.perf_counter()
+        service = create_service(args.model, engine=engine, cpu_threads=args.cpu_threads, vad=args.vad)
+        load_seconds = time.perf_counter() - started
+        audio = service._load_audio(content, args.audio.suffix[1:])
+        audio_seconds = len(audio) / 16000
+
+        text = service._transcribe_audio(audio)     # Warm up.
+        latencies = []
+        for _ in range(args.requests):
+            started = time.perf_counter()
+            service._transcribe_audio(audio)
+            latencies.append(time.perf_counter() - started)
+        reference = reference if reference is not None else text
+        print(f"{engine:>15}: load {load_seconds:6.2f}s, latency {statistics.mean(latencies):6.2f}s, "
+              f"RTF {statistics.mean(latencies) / audio_seconds:5.3f}, WER {word_error_rate(reference, text):6.2%}"
+              + (f", speech {service.vad.stats()['speech_ratio']:.0%}" if service.vad else ""))
+        service.on_terminated()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="STT inference benchmarks.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    batching = subparsers.add_parser("batching", help="Throughput of micro-batched inference.")
+    batching.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8])
+    batching.add_argument("--wait-ms", type=float, default=50)
+    batching.add_argument("--requests", type=int, default=16, help="Concurrent requests.")
+    batching.set_defaults(func=benchmark_batching)
+
+    decoding = subparsers.add_parser("decoding", help="Latency of decoding audio via a file or a pipe.")
+    decoding.add_argument("--pool-size", type=int, default=2)
+    decoding.add_argument("--requests", type=int, default=50, help="Sequential requests.")
+    decoding.set_defaults(func=benchmark_decoding)
+
+    engines = subparsers.add_parser("engines", help="Accuracy and latency of the STT engines.")
+    engines.add_argument("--engines", nargs="+", default=["whisper", "whisper-int8"])
+    engines.add_argument("--cpu-threads", type=int, default=0)
+    engines.add_argument("--requests", type=int, default=3, help="Sequential requests per engine.")
+    engines.add_argument("--reference", help="The reference transcript, for the word error rate.")
+    engines.add_argument("--vad", action="store_true", help="Cut the silence before transcribing.")
+    engines.set_defaults(func=benchmark_engines)
+
+    for subparser in subparsers.choices.values():
+        subparser.add_argument("--model", default="base")
+        subparser.add_argument("--audio", type=Path, default=SAMPLE_AUDIO)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
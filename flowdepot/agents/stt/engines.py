@@ -0,0 +1,192 @@
+from abc import ABC, abstractmethod
+
+import logging
+from flowdepot.app_logger import init_logging
+logger:logging.Logger = init_logging()
+
+
+SEGMENT_SECONDS = 30    # The input length of Whisper's encoder, the unit of a batch.
+
+
+
+class SttEngine(ABC):
+    """
+    A speech-to-text backend. transcribe() takes 16 kHz mono float32 audio and returns
+    {'text', 'segments': [{'start', 'end', 'text'}]} as whisper's transcribe() does.
+    A BatchingEngine also decodes 30-second log-mel segments in batches.
+    """
+    name = None
+    threads_after_load = False      # set_threads() works on a loaded model.
+
+
+    def __init__(self, model_name: str, cpu_threads: int = 0, params: dict = None):
+        self.model_name = model_name
+        self.cpu_threads = cpu_threads     # 0: the library default.
+        self.params = params or {}
+        self.device = "cpu"
+
+
+    @abstractmethod
+    def load(self):
+        pass
+
+
+    @abstractmethod
+    def transcribe(self, audio, initial_prompt=None) -> dict:
+        pass
+
+
+    def set_threads(self, threads: int):
+        """Set the inference threads of this process, e.g. in a forked worker, if threads_after_load."""
+        logger.warning(f"The {self.name} engine can't change its threads after loading.")
+
+
+    def cache_options(self) -> dict:
+        """What, besides the model name, changes the output of the engine."""
+        return {'engine': self.name}
+
+
+
+class BatchingEngine(SttEngine):
+    """An engine which decodes the 30-second segments of concurrent requests together, see MicroBatcher."""
+
+    @abstractmethod
+    def log_mel_segments(self, audio) -> list:
+        """Cut the audio into the inputs of decode_batch(), one per 30-second segment."""
+        pass
+
+
+    @abstractmethod
+    def decode_batch(self, mels) -> list[str]:
+        """The text of each segment, decoded in one forward pass."""
+        pass
+
+
+
+class WhisperEngine(BatchingEngine):
+    """openai-whisper with PyTorch, fp32 on CPU or fp16 on CUDA."""
+    name = "whisper"
+    threads_after_load = True
+
+
+    def load(self):
+        import torch
+        import whisper
+
+        if self.cpu_threads:
+            self.set_threads(self.cpu_threads)
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        logger.warning(f'Device of Whisper: {self.device}')
+        logger.warning(f'Loading model: {self.model_name}')
+        self.model = whisper.load_model(self.model_name, device=self.device)
+
+
+    def set_threads(self, threads: int):
+        import torch
+
+        torch.set_num_threads(threads)
+
+
+    def transcribe(self, audio, initial_prompt=None) -> dict:
+        return self.model.transcribe(audio, initial_prompt=initial_prompt, fp16=self.device == "cuda")
+
+
+    def log_mel_segments(self, audio) -> list:
+        """Cut the audio into 30-second segments, padded, as Whisper's encoder takes them."""
+        import whisper
+
+        mels = []
+        for start in range(0, max(len(audio), 1), whisper.audio.N_SAMPLES):
+            segment = whisper.pad_or_trim(audio[start:start + whisper.audio.N_SAMPLES])
+            mels.append(whisper.log_mel_spectrogram(segment, n_mels=self.model.dims.n_mels))
+        return mels
+
+
+    def decode_batch(self, mels) -> list[str]:
+        """
+        Decode the segments in one forward pass of the model. This is whisper.decode()
+        with the default options, greedy at temperature 0: unlike transcribe(), it doesn't
+        seek to the last timestamp of a segment, retry at higher temperatures, or check the
+        compression ratio and log-probability, so a word cut at 30 seconds or a repetition
+        loop is kept.
+        """
+        import torch
+        import whisper
+
+        mel = torch.stack(mels).to(self.device)
+        options = whisper.DecodingOptions(fp16=self.device == "cuda")
+        with torch.no_grad():
+            results = whisper.decode(self.model, mel, options)
+        return [result.text for result in results]
+
+
+
+class WhisperInt8Engine(WhisperEngine):
+    """openai-whisper with the Linear layers quantized to int8 by PyTorch dynamic quantization, CPU only."""
+    name = "whisper-int8"
+
+
+    def load(self):
+        import torch
+        import whisper
+
+        if self.cpu_threads:
+            self.set_threads(self.cpu_threads)
+        logger.warning(f'Loading model: {self.model_name}, quantized to int8')
+        model = whisper.load_model(self.model_name, device="cpu")
+
+        # whisper's Linear subclasses nn.Linear only to cast the weights to the input dtype,
+        # which is a no-op in fp32; quantize_dynamic swaps exact nn.Linear modules only.
+        for module in model.modules():
+            if isinstance(module, torch.nn.Linear):
+                module.__class__ = torch.nn.Linear
+        self.model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+
+class FasterWhisperEngine(SttEngine):
+    """
+    faster-whisper (CTranslate2), int8 by default. An optional dependency:
+        pip install faster-whisper
+    """
+    name = "faster-whisper"
+
+
+    def __init__(self, model_name: str, cpu_threads: int = 0, params: dict = None):
+        super().__init__(model_name, cpu_threads, params)
+        self.compute_type = self.params.get('compute_type', 'int8')
+        self.beam_size = self.params.get('beam_size', 5)
+
+
+    def load(self):
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError as ex:
+            raise RuntimeError("The faster-whisper engine requires: pip install faster-whisper") from ex
+
+        logger.warning(f'Loading model: {self.model_name}, compute_type: {self.compute_type}')
+        self.model = WhisperModel(self.model_name, device="cpu", compute_type=self.compute_type, cpu_threads=self.cpu_threads)
+
+
+    def transcribe(self, audio, initial_prompt=None) -> dict:
+        segments, _ = self.model.transcribe(audio, initial_prompt=initial_prompt,
+                                            beam_size=self.beam_size)
+        segments = [{'start': s.start, 'end': s.end, 'text': s.text} for s in segments]
+        return {
+            'text': "".join(segment['text'] for segment in segments),
+            'segments': segments,
+        }
+
+
+    def cache_options(self) -> dict:
+        return {'engine': self.name, 'compute_type': self.compute_type, 'beam_size': self.beam_size}
+
+
+
+ENGINES = {engine.name: engine for engine in (WhisperEngine, WhisperInt8Engine, FasterWhisperEngine)}
+
+
+def create_engine(name, model_name, cpu_threads=0, params=None) -> SttEngine:
+    if name not in ENGINES:
+        raise ValueError(f"Unknown STT engine: {name}, available: {', '.join(ENGINES)}")
+    return ENGINES[name](model_name, cpu_threads, params)
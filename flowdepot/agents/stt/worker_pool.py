@@ -0,0 +1,278 @@
+from concurrent.futures import Future
+import gc
+import multiprocessing as mp
+from multiprocessing.connection import Client, Connection
+import os
+import queue
+import signal
+import socket
+import tempfile
+import threading
+import time
+
+import logging
+from flowdepot.app_logger import init_logging
+logger:logging.Logger = init_logging()
+
+
+
+def _worker_main(target, threads, conn):
+    if threads:
+        target.set_threads(threads)
+
+    while True:
+        try:
+            method, args = conn.recv()
+        except (EOFError, OSError):
+            break
+        try:
+            conn.send((True, getattr(target, method)(*args)))
+        except Exception as ex:
+            # The exception may not be picklable, its message is.
+            conn.send((False, f"{type(ex).__name__}: {ex}"))
+
+
+def _zygote_main(target, threads, address, conn):
+    """
+    Load target once, then fork a worker for each (cpus) request and answer its pid.
+    The zygote is spawned, so it has a single thread and no inherited locks, pipes or
+    thread pools at the forks; the workers connect back to the pool at address and
+    introduce themselves with their pid.
+    """
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)     # The exited workers are reaped by the kernel.
+    target.load()
+    gc.freeze()     # The collector won't write to, and so copy, the pages of the loaded objects.
+
+    while True:
+        try:
+            cpus = conn.recv()
+        except (EOFError, OSError):
+            break
+        pid = os.fork()
+        if pid == 0:
+            conn.close()
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            code = 0
+            try:
+                if cpus:
+                    os.sched_setaffinity(0, cpus)
+                worker_conn = Client(address, 'AF_UNIX')
+                worker_conn.send(os.getpid())
+                _worker_main(target, threads, worker_conn)
+            except BaseException:
+                code = 1
+            finally:
+                os._exit(code)
+        conn.send(pid)
+
+
+
+class _Worker:
+    def __init__(self, pid, conn, cpus):
+        self.pid = pid
+        self.conn = conn
+        self.cpus = cpus
+        self.busy = False
+        self.done = 0
+
+
+    def is_alive(self) -> bool:
+        try:
+            os.kill(self.pid, 0)
+            return True
+        except ProcessLookupError:
+            return False
+
+
+
+class ForkedWorkerPool:
+    """
+    Call the methods of target, e.g. an STT engine not loaded yet, in worker processes
+    sharing one loaded copy of it.
+
+    A zygote process is spawned, loads target, and forks the workers, so they share
+    its weights copy-on-write instead of loading a copy each. Forking the agent
+    process itself is not safe: it runs the broker loop, the config watcher and the
+    handler threads, and a lock held by one of them, or an OpenMP pool started by
+    torch, is inherited in the child. The zygote forks with none of those. Load target
+    single-threaded there; threads, if given, sets the threads of each worker. Each
+    worker can be pinned to its own subset of the CPUs.
+
+    A parent thread per worker takes the calls from a shared queue, so a call goes
+    to the first idle worker. A worker which dies fails its call and is forked again
+    by the zygote. POSIX only; target must be picklable.
+    """
+    CONNECT_TIMEOUT = 30     # Seconds for a forked worker to connect back.
+
+    def __init__(self, target, workers: int, pin_cores: bool = True, threads: int = 0):
+        self._context = mp.get_context('spawn')
+        self._calls = queue.Queue()
+        self._closed = False
+
+        cpus = sorted(os.sched_getaffinity(0)) if pin_cores and hasattr(os, 'sched_getaffinity') else []
+        # Contiguous CPU ranges, which keeps a worker's threads on neighbouring cores.
+        self.cpu_sets = [cpus[len(cpus) * i // workers:len(cpus) * (i + 1) // workers] for i in range(workers)] \
+            if len(cpus) >= workers else [[] for _ in range(workers)]
+
+        # Only the owner can enter the directory, mkdtemp creates it with mode 0700.
+        self._directory = tempfile.mkdtemp(prefix='stt-workers-')
+        self._address = os.path.join(self._directory, 'socket')
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(self._address)
+        self._listener.listen()
+        self._listener.settimeout(0.5)
+        self._zygote_conn, child_conn = self._context.Pipe()
+        self._zygote = self._context.Process(target=_zygote_main, args=(target, threads, self._address, child_conn),
+                                             name='stt-zygote', daemon=True)
+        self._zygote.start()
+        child_conn.close()
+        self._fork_lock = threading.Lock()
+
+        self._workers = []
+        try:
+            for cpu_set in self.cpu_sets:
+                self._workers.append(self._fork(cpu_set))
+        except RuntimeError:
+            self.shutdown()
+            raise
+        for index in range(workers):
+            threading.Thread(target=self._serve, args=(index,), name=f'stt-worker-{index}', daemon=True).start()
+        logger.info(f"{workers} workers are forked from the zygote (pid {self._zygote.pid}), CPUs: {self.cpu_sets}")
+
+
+    def _fork(self, cpus) -> _Worker:
+        with self._fork_lock:
+            try:
+                self._zygote_conn.send(cpus)
+                pid = self._zygote_conn.recv()      # After the zygote has loaded target, the first time.
+            except (EOFError, OSError) as ex:
+                raise RuntimeError(f"The STT zygote exited, exit code: {self._zygote.exitcode}") from ex
+            worker = _Worker(pid, None, cpus)
+            worker.conn = self._accept(worker)
+        return worker
+
+
+    def _accept(self, worker: _Worker) -> Connection:
+        """The connection of the worker; fail if it exits, or doesn't connect in time, instead."""
+        deadline = time.monotonic() + ForkedWorkerPool.CONNECT_TIMEOUT
+        while True:
+            try:
+                sock, _ = self._listener.accept()
+            except socket.timeout:
+                if not worker.is_alive():
+                    raise RuntimeError(f"The STT worker (pid {worker.pid}) exited before it connected.")
+                if time.monotonic() > deadline:
+                    os.kill(worker.pid, signal.SIGKILL)
+                    raise RuntimeError(f"The STT worker (pid {worker.pid}) didn't connect in {ForkedWorkerPool.CONNECT_TIMEOUT} seconds.")
+                continue
+
+            sock.setblocking(True)
+            conn = Connection(sock.detach())
+            # A late worker, killed after its timeout, may have connected; it isn't this one.
+            try:
+                if conn.poll(5) and conn.recv() == worker.pid:
+                    return conn
+            except (EOFError, OSError):
+                pass
+            conn.close()
+
+
+    def call(self, method: str, *args) -> Future:
+        future = Future()
+        self._calls.put((future, method, args))
+        return future
+
+
+    def _serve(self, index):
+        while (job := self._calls.get()) is not None:
+            future, method, args = job
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            worker = self._workers[index]
+            try:
+                if not worker.is_alive():
+                    worker = self._respawn(index)
+            except RuntimeError as ex:
+                future.set_exception(ex)
+                continue
+            worker.busy = True
+            try:
+                worker.conn.send((method, args))
+                ok, result = worker.conn.recv()
+            except (EOFError, OSError):
+                logger.error(f"Worker {index} (pid {worker.pid}) died.")
+                future.set_exception(RuntimeError("The STT worker died."))
+                if not self._closed:
+                    try:
+                        self._respawn(index)
+                    except RuntimeError as ex:
+                        logger.error(ex)
+                continue
+            finally:
+                worker.busy = False
+
+            worker.done += 1
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(RuntimeError(result))
+
+
+    def _respawn(self, index) -> _Worker:
+        old = self._workers[index]
+        old.conn.close()
+        self._workers[index] = self._fork(old.cpus)
+        logger.warning(f"Worker {index} is forked again, pid: {self._workers[index].pid}")
+        return self._workers[index]
+
+
+    @staticmethod
+    def _memory(pid) -> dict:
+        """The resident and proportional set sizes; the shared pages count fully in RSS, partly in PSS."""
+        memory = {}
+        try:
+            with open(f'/proc/{pid}/smaps_rollup') as fp:
+                for line in fp:
+                    key, _, value = line.partition(':')
+                    if key in ('Rss', 'Pss'):
+                        memory[f'{key.lower()}_mb'] = round(int(value.split()[0]) / 1024, 1)
+        except OSError:
+            pass
+        return memory
+
+
+    def stats(self) -> dict:
+        return {
+            'parent': {'pid': os.getpid(), **ForkedWorkerPool._memory(os.getpid())},
+            'zygote': {'pid': self._zygote.pid, **ForkedWorkerPool._memory(self._zygote.pid)},
+            'queue_depth': self._calls.qsize(),
+            'workers': [{
+                'pid': worker.pid,
+                'cpus': worker.cpus,
+                'busy': worker.busy,
+                'done': worker.done,
+                **ForkedWorkerPool._memory(worker.pid),
+            } for worker in self._workers],
+        }
+
+
+    def shutdown(self):
+        self._closed = True
+        for _ in self._workers:
+            self._calls.put(None)
+        for worker in self._workers:
+            worker.conn.close()     # The worker exits at EOF.
+        deadline = time.monotonic() + 5
+        for worker in self._workers:
+            while worker.is_alive() and time.monotonic() < deadline:
+                time.sleep(0.05)
+            if worker.is_alive():
+                os.kill(worker.pid, signal.SIGTERM)
+        self._zygote_conn.close()   # So does the zygote.
+        self._zygote.join(5)
+        if self._zygote.is_alive():
+            self._zygote.terminate()
+        self._listener.close()
+        os.unlink(self._address)
+        os.rmdir(self._directory)
@@ -2,6 +2,16 @@ from enum import Enum
 
 class AgentTopics(str, Enum):
     FILE_UPLOAD = "File/Upload"
+    FILE_UPLOAD_BEGIN = "File/Upload/Begin"
+    FILE_UPLOAD_CHUNK = "File/Upload/Chunk"
+    FILE_UPLOAD_COMMIT = "File/Upload/Commit"
+    FILE_DOWNLOAD = "File/Download"
+    FILE_READ_RANGE = "File/ReadRange"
+    FILE_QUERY = "File/Query"
+    FILE_STATS = "File/Stats"
     LLM_PROMPT = "Prompt/LlmService"
+    LLM_STATS = "LLM/Stats"
     STT_CONTENT = "STT/Content"
+    STT_STATS = "STT/Stats"
     CAPTCHA_RECOGNIZE = "Captcha/Recognize"
+    CAPTCHA_STATS = "Captcha/Stats"
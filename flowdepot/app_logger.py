@@ -2,7 +2,8 @@
 from colorama import init, Fore, Style
 import logging
 import os
-import yaml
+
+from flowdepot.config_registry import registry
 
 LOGGING_LEVEL_VERBOSE = int(logging.DEBUG / 2)
 logging.addLevelName(LOGGING_LEVEL_VERBOSE, "VERBOSE")
@@ -23,11 +24,12 @@ def init_logging(config_path=None, force_level=None):
     
     if not log_name:
         config_path = config_path or os.path.join(os.getcwd(), 'config', 'system.yaml')
-        with open(config_path, 'r', encoding='utf-8') as f:
-            log_config = (yaml.safe_load(f) or {}).get('logging', {})
+        log_config = registry.load(config_path).get('logging', {})
             
         log_name = log_config.get('name', 'flowdepot')
         log_level = log_config.get('level', logging.DEBUG)
+        if not force_level:
+            _watch_log_level(log_name, config_path)
 
     os.environ['LOGGER_NAME'] = log_name
     os.environ['LOGGER_LEVEL'] = str(log_level)
@@ -51,6 +53,17 @@ def init_logging(config_path=None, force_level=None):
     _LOGGER_CACHE[log_name] = logger
     return logger
 
+
+def _watch_log_level(log_name, config_path):
+    """Apply the changes of logging.level in system.yaml without a restart."""
+    def config_changed():
+        level = registry.load(config_path).get('logging', {}).get('level', logging.DEBUG)
+        logging.getLogger(log_name).setLevel(level)
+        os.environ['LOGGER_LEVEL'] = str(level)
+
+    registry.add_listener([config_path], config_changed)
+
+
 init(autoreset=True)  # Initialize colorama for Windows
 
 class ColorFormatter(logging.Formatter):
@@ -0,0 +1,292 @@
+from collections import OrderedDict
+import hashlib
+import os
+import pickle
+import threading
+import time
+import uuid
+
+
+_MISSING = object()
+
+
+
+class LruCache:
+    """
+    A thread-safe LRU cache bounded by the number of entries and/or the total size
+    of the values, with an optional time-to-live.
+
+    Parameters:
+        max_entries (int): The maximum number of entries, None for no limit.
+        max_bytes (int): The maximum total of sizeof(value), None for no limit.
+        ttl (float): Seconds an entry stays valid, None for no expiry.
+        sizeof (callable): The size of a value, len by default.
+    """
+    def __init__(self, max_entries: int = None, max_bytes: int = None, ttl: float = None, sizeof=len):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+
+        self._entries: OrderedDict = OrderedDict()     # key: (value, size, expire_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING, count=False) is not _MISSING
+
+
+    def get(self, key, default=None, count: bool = True):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[2] is not None and entry[2] < time.monotonic():
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                if count:
+                    self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            if count:
+                self.hits += 1
+            return entry[0]
+
+
+    def put(self, key, value, ttl: float = None):
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return      # Never fits.
+
+        ttl = ttl if ttl is not None else self.ttl
+        expire_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, expire_at)
+            self._bytes += size
+
+            while (self.max_entries is not None and len(self._entries) > self.max_entries) \
+                    or (self.max_bytes is not None and self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value = self._entries[key][0]
+            self._remove(key)
+            return value
+
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0.0,
+            'evictions': self.evictions,
+        }
+
+
+
+class DiskCache:
+    """
+    A thread-safe cache of picklable values in files under a directory, bounded by
+    the total size of the files; the least recently used entries are evicted first.
+    The entries survive restarts, the recency is restored from the file times.
+
+    Parameters:
+        directory (str): Where the entries are stored, <directory>/<xx>/<sha256 of key>.
+        max_bytes (int): The maximum total size of the files.
+    """
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        self._entries: OrderedDict = OrderedDict()     # name: size
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._scan()
+
+
+    def _scan(self):
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for dir_path, _, file_names in os.walk(self.directory):
+            for name in file_names:
+                path = os.path.join(dir_path, name)
+                if name.endswith('.tmp'):
+                    os.remove(path)     # Left by an interrupted put.
+                    continue
+                stat = os.stat(path)
+                files.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._bytes += size
+
+
+    def _path(self, name) -> str:
+        return os.path.join(self.directory, name[:2], name)
+
+
+    @staticmethod
+    def _name(key) -> str:
+        return hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def get(self, key, default=None, count: bool = True):
+        name = DiskCache._name(key)
+        with self._lock:
+            if name not in self._entries:
+                if count:
+                    self.misses += 1
+                return default
+            self._entries.move_to_end(name)
+
+        try:
+            with open(self._path(name), 'rb') as fp:
+                value = pickle.load(fp)
+            os.utime(self._path(name))      # The recency across restarts.
+        except (OSError, pickle.UnpicklingError, EOFError):
+            with self._lock:
+                if name in self._entries:
+                    self._bytes -= self._entries.pop(name)
+                if count:
+                    self.misses += 1
+            return default
+
+        if count:
+            with self._lock:
+                self.hits += 1
+        return value
+
+
+    def put(self, key, value):
+        name = DiskCache._name(key)
+        path = self._path(name)
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes:
+            return      # Never fits.
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as fp:
+            fp.write(data)
+        os.replace(tmp_path, path)
+
+        evicted = []
+        with self._lock:
+            if name in self._entries:
+                self._bytes -= self._entries.pop(name)
+            self._entries[name] = len(data)
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                evicted_name, size = self._entries.popitem(last=False)
+                self._bytes -= size
+                self.evictions += 1
+                evicted.append(evicted_name)
+        for evicted_name in evicted:
+            try:
+                os.remove(self._path(evicted_name))
+            except FileNotFoundError:
+                pass
+
+
+    def pop(self, key, default=None):
+        value = self.get(key, default, count=False)
+        name = DiskCache._name(key)
+        with self._lock:
+            if name in self._entries:
+                self._bytes -= self._entries.pop(name)
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            pass
+        return value
+
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0.0,
+            'evictions': self.evictions,
+        }
+
+
+
+class TieredCache:
+    """
+    Caches looked up in order, e.g. an LruCache in front of a DiskCache. A value found
+    in a lower tier is copied to the tiers above it, and put() writes all the tiers.
+    """
+    def __init__(self, *tiers):
+        self.tiers = [tier for tier in tiers if tier is not None]
+        self.hits = 0
+        self.misses = 0
+
+
+    def get(self, key, default=None):
+        for i, tier in enumerate(self.tiers):
+            if (value := tier.get(key, _MISSING)) is not _MISSING:
+                for upper in self.tiers[:i]:
+                    upper.put(key, value)
+                self.hits += 1
+                return value
+        self.misses += 1
+        return default
+
+
+    def put(self, key, value):
+        for tier in self.tiers:
+            tier.put(key, value)
+
+
+    def pop(self, key, default=None):
+        values = [tier.pop(key, _MISSING) for tier in self.tiers]
+        return next((value for value in values if value is not _MISSING), default)
+
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0.0,
+            'tiers': [tier.stats() for tier in self.tiers],
+        }
@@ -0,0 +1,218 @@
+"""
+Process-wide registry of the YAML configuration files.
+
+Each file is parsed once and kept as a read-only FrozenDict, so the same
+object can be handed out to every caller without copying. The registry
+re-parses a file when its mtime changes, and notifies the listeners of that
+file, so running agents can apply the new settings without a restart.
+"""
+from copy import deepcopy
+import os
+import threading
+import time
+import yaml
+
+import logging
+
+
+def _logger() -> logging.Logger:
+    # Resolved on use, the registry is imported before init_logging() sets LOGGER_NAME.
+    return logging.getLogger(os.getenv('LOGGER_NAME'))
+
+
+
+class FrozenDict(dict):
+    """A read-only dict. Copy it (dict(d) or d.copy()) to get a mutable dict."""
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("The configuration is read-only, copy it before modifying.")
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+    __ior__ = _readonly
+
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+
+_EMPTY = FrozenDict()
+
+
+def freeze(value):
+    if isinstance(value, FrozenDict):
+        return value
+    elif isinstance(value, dict):
+        return FrozenDict({key: freeze(item) for key, item in value.items()})
+    elif isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def thaw(value):
+    """A mutable deep copy of a frozen configuration: dicts and lists again."""
+    if isinstance(value, dict):
+        return {key: thaw(item) for key, item in value.items()}
+    elif isinstance(value, (list, tuple)):
+        return [thaw(item) for item in value]
+    return value
+
+
+def deep_merge(dict1, dict2):
+    """Recursively merge dict2 into dict1; the result is a deep copy, sharing nothing with them."""
+    result = deepcopy(dict1)
+    for key, value in dict2.items():
+        if (
+            key in result
+            and isinstance(result[key], dict)
+            and isinstance(value, dict)
+        ):
+            result[key] = deep_merge(result[key], value)
+        else:
+            result[key] = deepcopy(value)
+    return result
+
+
+def _merge_frozen(dict1, dict2):
+    """
+    deep_merge for frozen configurations: only the path along the merged keys is
+    copied, the other subtrees are shared, which is safe because they are read-only.
+    """
+    result = dict(dict1)
+    for key, value in dict2.items():
+        if (
+            key in result
+            and isinstance(result[key], dict)
+            and isinstance(value, dict)
+        ):
+            result[key] = _merge_frozen(result[key], value)
+        else:
+            result[key] = value
+    return result
+
+
+
+class _Entry:
+    def __init__(self, data: FrozenDict, mtime: float):
+        self.data = data
+        self.mtime = mtime
+        self.checked = time.monotonic()
+
+
+
+class ConfigRegistry:
+    def __init__(self, check_interval: float = 1.0, watch_interval: float = 2.0):
+        self.check_interval = check_interval
+        self.watch_interval = watch_interval
+
+        self._lock = threading.RLock()
+        self._entries: dict[str, _Entry] = {}
+        self._merged: dict[tuple, tuple] = {}
+        self._listeners: list[tuple[frozenset, callable]] = []
+        self._reloaded: set[str] = set()     # Re-parsed since the last notification, by any caller.
+        self._failures: dict[str, str] = {}  # The files the watcher failed to reload, with the error.
+        self._watch_thread: threading.Thread = None
+
+
+    @staticmethod
+    def _key(path) -> str:
+        return os.path.abspath(path)
+
+
+    def load(self, path, missing_ok: bool = False) -> FrozenDict:
+        """Return the parsed file; it is parsed again only if its mtime has changed."""
+        key = ConfigRegistry._key(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.monotonic() - entry.checked < self.check_interval:
+                return entry.data
+
+            try:
+                mtime = os.stat(key).st_mtime
+            except FileNotFoundError:
+                if missing_ok:
+                    return _EMPTY
+                raise
+
+            if entry and entry.mtime == mtime:
+                entry.checked = time.monotonic()
+                return entry.data
+
+            with open(key, 'r', encoding='utf-8') as f:
+                data = freeze(yaml.safe_load(f) or {})
+            if entry:
+                _logger().info(f"Config reloaded: {path}")
+                self._reloaded.add(key)
+            self._entries[key] = _Entry(data, mtime)
+            return data
+
+
+    def merged(self, *paths, missing_ok: bool = True) -> FrozenDict:
+        """Return the deep merge of the files, memoized until one of them changes."""
+        sources = tuple(self.load(path, missing_ok=missing_ok) for path in paths)
+        key = tuple(ConfigRegistry._key(path) for path in paths)
+        with self._lock:
+            if (memo := self._merged.get(key)) and all(a is b for a, b in zip(memo[0], sources)):
+                return memo[1]
+
+            result = {}
+            for source in sources:
+                result = _merge_frozen(result, source)
+            result = freeze(result)
+            self._merged[key] = (sources, result)
+            return result
+
+
+    def add_listener(self, paths, callback):
+        """Call callback() when one of the files has changed. It starts the watcher if needed."""
+        with self._lock:
+            self._listeners.append((frozenset(ConfigRegistry._key(path) for path in paths), callback))
+            if not self._watch_thread:
+                self._watch_thread = threading.Thread(target=self._watch, name='config-watcher', daemon=True)
+                self._watch_thread.start()
+
+
+    def remove_listener(self, callback):
+        with self._lock:
+            self._listeners = [(paths, cb) for paths, cb in self._listeners if cb != callback]
+
+
+    def _changed_paths(self) -> set[str]:
+        """
+        The files re-parsed since the last call, here or by load() from any caller.
+        A file which is removed, or fails to parse, keeps its last configuration and is
+        still watched; the failure is logged once, not at every poll.
+        """
+        with self._lock:
+            keys = list(self._entries)
+        for key in keys:
+            entry = self._entries[key]
+            try:
+                if os.stat(key).st_mtime != entry.mtime:
+                    entry.checked = float('-inf')     # Force load() to check the file.
+                    self.load(key)
+            except Exception as ex:
+                if self._failures.get(key) != str(ex):
+                    _logger().warning(f"Failed to reload config: {key}, {ex}")
+                    self._failures[key] = str(ex)
+            else:
+                if self._failures.pop(key, None) is not None:
+                    _logger().info(f"Config is readable again: {key}")
+        with self._lock:
+            changed, self._reloaded = self._reloaded, set()
+        return changed
+
+
+    def _watch(self):
+        while True:
+            time.sleep(self.watch_interval)
+            if changed := self._changed_paths():
+                with self._lock:
+                    listeners = [cb for paths, cb in self._listeners if paths & changed]
+                for callback in listeners:
+                    try:
+                        callback()
+                    except Exception as ex:
+                        _logger().exception(ex)
+
+
+registry = ConfigRegistry()
@@ -0,0 +1,123 @@
+"""
+Startup profiling for `startup.py --startup-profile`.
+
+Records the time of the startup phases of each agent (manifest parse, config
+merge, module exec, model load, subscribe, activate) and the import time of
+the packages imported after enable() is called.
+"""
+from contextlib import contextmanager
+import importlib.abc
+import sys
+import threading
+import time
+
+
+PHASES = ['manifest parse', 'config merge', 'module exec', 'model load', 'subscribe', 'activate']
+
+_enabled = False
+_lock = threading.Condition()
+_phases: dict[str, dict[str, float]] = {}
+_import_times: dict[str, float] = {}
+_import_stack = threading.local()
+
+
+
+class _TimedLoader:
+    def __init__(self, loader, fullname):
+        self._loader = loader
+        self._fullname = fullname
+
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+
+    def exec_module(self, module):
+        stack = _import_stack.__dict__.setdefault('frames', [])
+        stack.append(0.0)     # Time spent in nested imports.
+        started = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            elapsed = time.perf_counter() - started
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            package = self._fullname.split('.')[0]
+            with _lock:
+                _import_times[package] = _import_times.get(package, 0.0) + elapsed - nested
+
+
+
+class _ImportTimer(importlib.abc.MetaPathFinder):
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                    spec.loader = _TimedLoader(spec.loader, fullname)
+                return spec
+        return None
+
+
+def enable():
+    global _enabled
+    if not _enabled:
+        sys.meta_path.insert(0, _ImportTimer())
+        _enabled = True
+
+
+def is_enabled():
+    return _enabled
+
+
+def record(agent: str, phase_name: str, seconds: float):
+    if not _enabled:
+        return
+    with _lock:
+        phases = _phases.setdefault(agent, {})
+        phases[phase_name] = phases.get(phase_name, 0.0) + seconds
+        _lock.notify_all()
+
+
+@contextmanager
+def phase(agent: str, phase_name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(agent, phase_name, time.perf_counter() - started)
+
+
+def wait_for(agents: list[str], phase_name: str = 'activate', timeout: float = 120) -> bool:
+    """Wait until every agent has recorded the phase."""
+    deadline = time.monotonic() + timeout
+    with _lock:
+        while not all(phase_name in _phases.get(agent, {}) for agent in agents):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            _lock.wait(remaining)
+    return True
+
+
+def report(top: int = 15) -> str:
+    with _lock:
+        phases = {agent: dict(p) for agent, p in _phases.items()}
+        imports = sorted(_import_times.items(), key=lambda item: item[1], reverse=True)
+
+    lines = ["Startup phases (ms):", f"{'agent':<20}" + ''.join(f"{p:>16}" for p in PHASES)]
+    for agent, agent_phases in phases.items():
+        cells = ''.join(f"{agent_phases[p] * 1000:>16.1f}" if p in agent_phases else f"{'-':>16}" for p in PHASES)
+        lines.append(f"{agent:<20}{cells}")
+
+    lines += ["", f"Import time by top-level package (ms, top {top}):"]
+    for package, seconds in imports[:top]:
+        lines.append(f"  {package:<30}{seconds * 1000:>10.1f}")
+    return '\n'.join(lines)
@@ -0,0 +1,136 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import unittest
+
+from agentflow.core.agent import Agent
+from agentflow.core.parcel import Parcel
+
+from flowdepot.agent_host import AgentHost
+
+
+
+class RecordingBroker:
+    """The host's connection, offline."""
+    def __init__(self):
+        self.published = {}
+        self.subscribed = []
+        self.replied = threading.Event()
+
+    def publish(self, topic, payload):
+        self.published[topic] = Parcel.from_payload(payload.encode() if isinstance(payload, str) else payload)
+        if topic == 'echo/response':
+            self.replied.set()
+
+    def subscribe(self, topic, data_type):
+        self.subscribed.append(topic)
+
+    def stop(self):
+        pass
+
+
+
+class EchoAgent(Agent):
+    def __init__(self):
+        super().__init__('echo.parent', {})
+        self.connected = threading.Event()
+
+        self.intervals = 0
+        self.running = 0
+        self.handled = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def on_activate(self):
+        self.subscribe('echo/request', topic_handler=self.handle_echo)
+        self.subscribe('echo/slow', topic_handler=self.handle_slow)
+        self.start_interval_loop(0.02)
+
+    def on_interval(self):
+        self.intervals += 1
+
+    def on_connected(self):
+        self.connected.set()
+
+    def handle_echo(self, topic, pcl):
+        return {'echo': pcl.content, 'popped': self.pop_data('missing')}
+
+    def handle_slow(self, topic, pcl):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.05)
+        with self.lock:
+            self.running -= 1
+            self.handled += 1
+
+
+
+class TestAgentHost(unittest.TestCase):
+    def setUp(self):
+        self.host = AgentHost({})
+        self.host._broker = RecordingBroker()
+        self.host._executor = ThreadPoolExecutor(max_workers=2)
+        self.agent = EchoAgent()
+        self.host.agents.append(self.agent)
+        self.host._reports[id(self.agent)] = {}
+        self.host._activate_agent(self.agent)
+
+
+    def test_connect_initialization(self):
+        self.assertIn(f'to_parent.{self.agent.name}', self.host._broker.subscribed)
+        self.assertIn('to_child.parent', self.host._broker.subscribed)
+        self.assertTrue(self.agent.connected.wait(5))
+
+
+    def test_dispatch_to_the_agent_handler(self):
+        pcl = Parcel.from_content('hello')
+        pcl.topic_return = 'echo/response'
+        self.host._on_message('echo/request', pcl.payload().encode())
+
+        self.assertTrue(self.host._broker.replied.wait(5))
+        response = self.host._broker.published['echo/response']
+        self.assertEqual({'echo': 'hello', 'popped': None}, response.content)
+        self.assertIsNone(response.error)
+
+
+    def test_handlers_limited_to_the_pool(self):
+        for i in range(6):
+            self.host._on_message('echo/slow', Parcel.from_content(i).payload().encode())
+        deadline = time.monotonic() + 5
+        while self.agent.handled < 6 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(6, self.agent.handled)
+        self.assertEqual(2, self.agent.max_running)     # max_workers of the host's pool.
+
+
+    def test_interval_loop_until_terminated(self):
+        self.assertTrue(self.agent.is_active())
+        time.sleep(0.2)
+        self.assertGreater(self.agent.intervals, 0)
+
+        self.host.terminate()
+        self.assertFalse(self.agent.is_active())
+        time.sleep(0.1)     # The loop sees is_active() False after its sleep.
+        intervals = self.agent.intervals
+        time.sleep(0.1)
+        self.assertEqual(intervals, self.agent.intervals)
+
+
+    def test_agent_terminate_deactivates_it_alone(self):
+        self.agent.terminate()
+        self.assertFalse(self.agent.is_active())
+        self.assertNotIn(self.agent, [agent for _, agent in self.host._subscriptions])
+
+
+    def tearDown(self):
+        self.host.terminate()
+        self.host._executor.shutdown(wait=True)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import multiprocessing
+import unittest
+
+from agentflow.core.agent import Agent
+
+from flowdepot.agent_replicas import SharedSubscriptionBroker, create_replica_class
+
+
+
+class RecordingBroker:
+    """The replica's connection, offline."""
+    def __init__(self):
+        self.subscribed = []
+
+    def subscribe(self, topic, data_type):
+        self.subscribed.append(topic)
+
+
+
+class WorkAgent(Agent):
+    def __init__(self):
+        super().__init__('work', {})
+        self.received = []
+
+    def on_activate(self):
+        self.subscribe('work/request', topic_handler=self.handle_work)
+
+    def handle_work(self, topic, pcl):
+        pass
+
+    def _on_message(self, topic, data):
+        self.received.append(topic)
+
+
+
+class TestAgentReplicas(unittest.TestCase):
+    def setUp(self):
+        self.counter = multiprocessing.Value('Q', 0)
+        self.agent = create_replica_class(WorkAgent, 'work', None, self.counter)()
+        self.recording = RecordingBroker()
+
+
+    def _activate(self, share):
+        self.agent._broker = SharedSubscriptionBroker(self.recording, self.agent, 'work', share=share)
+        self.agent.subscribe('to_parent.work', topic_handler=self.agent.handle_work)
+        self.agent.on_activate()
+
+
+    def test_service_topics_shared(self):
+        self._activate(share=True)
+        self.assertEqual(self.recording.subscribed, ['to_parent.work', '$share/work/work/request'])
+
+
+    def test_unshared_broker_keeps_topics(self):
+        self._activate(share=False)
+        self.assertEqual(self.recording.subscribed, ['to_parent.work', 'work/request'])
+        self.assertEqual(self.agent._broker.work_topics, {'work/request'})
+
+
+    def test_control_traffic_not_counted(self):
+        self._activate(share=True)
+        for topic in ['work/request', 'to_parent.work', 'work/request', 'to_parent.work']:
+            self.agent._on_message(topic, b'')
+
+        self.assertEqual(self.counter.value, 2)
+        self.assertEqual(len(self.agent.received), 4)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,7 +4,6 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 import mimetypes
 import time
 import unittest
-import yaml
 
 import logging
 from flowdepot.app_logger import init_logging
@@ -13,14 +12,13 @@ logger:logging.Logger = init_logging()
 from agentflow.core.agent import Agent
 from agentflow.core.parcel import BinaryParcel, Parcel
 from agents.topics import AgentTopics
+from flowdepot.config_registry import registry, thaw
 
 
 config_path1 = os.path.join(os.getcwd(), 'config', 'system.yaml')
-with open(config_path1, 'r', encoding='utf-8') as f:
-    agent_config = yaml.safe_load(f) or {}
+agent_config = thaw(registry.load(config_path1))
 config_path2 = os.path.join(os.getcwd(), 'flowdepot', 'agents', 'captcha', 'agent.yaml')
-with open(config_path2, 'r', encoding='utf-8') as f:
-    agent_config.update(yaml.safe_load(f))
+agent_config.update(thaw(registry.load(config_path2)))
 
 
 
@@ -0,0 +1,81 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import mimetypes
+import time
+import unittest
+
+import logging
+from flowdepot.app_logger import init_logging
+logger:logging.Logger = init_logging()
+
+from agentflow.core.agent import Agent
+from agentflow.core.parcel import BinaryParcel, Parcel
+from agents.topics import AgentTopics
+from flowdepot.config_registry import registry, thaw
+
+
+config_path1 = os.path.join(os.getcwd(), 'config', 'system.yaml')
+agent_config = thaw(registry.load(config_path1))
+config_path2 = os.path.join(os.getcwd(), 'flowdepot', 'agents', 'captcha', 'agent.yaml')
+agent_config.update(thaw(registry.load(config_path2)))
+
+
+
+class TestAgent(unittest.TestCase):
+    answer_texts = []
+    
+    class ValidationAgent(Agent):
+        def __init__(self):
+            super().__init__(name='main', agent_config=agent_config)
+
+
+        def on_activate(self):
+            self.subscribe('return_topic')
+            
+            images = []
+            for path in [os.path.join(os.getcwd(), 'flowdepot', 'unit_test', 'data', 'captcha-56839.png'),
+                         os.path.join(os.getcwd(), 'flowdepot', 'agents', 'captcha', 'captcha-73634.png')]:
+                mime, _ = mimetypes.guess_type(path)
+                with open(path, 'rb') as file:
+                    images.append({
+                        'content': file.read(),
+                        'mime_type': mime})
+            pcl = BinaryParcel({'images': images}, 'return_topic')
+            self.publish(AgentTopics.CAPTCHA_RECOGNIZE , pcl)
+
+
+        def on_message(self, topic:str, pcl:Parcel):
+            result:dict = pcl.content or {}
+            logger.debug(self.M(f"topic: {topic}, result: {result}"))
+
+            TestAgent.answer_texts = [r.get('text') for r in result.get('results', [])]
+
+
+    def setUp(self):
+        self.validation_agent = TestAgent.ValidationAgent()
+        self.validation_agent.start_thread()
+
+
+    def _do_test_1(self):
+        logger.debug(f'answer_texts: {TestAgent.answer_texts}')
+        self.assertEqual(['56839', '73634'], TestAgent.answer_texts)
+
+
+    def test_1(self):
+        time.sleep(5)
+
+        try:
+            self._do_test_1()
+        except Exception as ex:
+            logger.exception(ex)
+            self.assertTrue(False)
+
+
+    def tearDown(self):
+        self.validation_agent.terminate()
+
+
+
+if __name__ == '__main__':
+    unittest.main()
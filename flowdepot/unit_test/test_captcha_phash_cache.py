@@ -0,0 +1,102 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import io
+import tempfile
+import time
+import unittest
+import warnings
+
+from flowdepot.agents.captcha.phash_cache import PerceptualHashCache, dhash
+
+
+def read(*path):
+    with open(os.path.join(os.path.dirname(__file__), '..', *path), 'rb') as file:
+        return file.read()
+
+
+
+class TestPerceptualHashCache(unittest.TestCase):
+    def setUp(self):
+        self.captcha1 = read('unit_test', 'data', 'captcha-56839.png')
+        self.captcha2 = read('agents', 'captcha', 'captcha-73634.png')
+
+
+    def _reencoded(self, content):
+        from PIL import Image
+        output = io.BytesIO()
+        Image.open(io.BytesIO(content)).convert('RGB').save(output, 'JPEG', quality=90)
+        return output.getvalue()
+
+
+    def test_different_captchas_do_not_collide(self):
+        cache = PerceptualHashCache()
+        cache.put(self.captcha1, '56839')
+        self.assertEqual('56839', cache.get(self.captcha1))
+        self.assertIsNone(cache.get(self.captcha2))
+
+
+    def test_perceptual_hit(self):
+        copy = self._reencoded(self.captcha1)
+        distance = (dhash(self.captcha1) ^ dhash(copy)).bit_count()
+        cache = PerceptualHashCache(max_distance=max(distance, 1))
+        cache.put(self.captcha1, '56839')
+        self.assertEqual('56839', cache.get(copy))
+        self.assertEqual(1, cache.stats()['perceptual_hits'] + cache.stats()['exact_hits'])
+
+
+    def test_expired_nearest_does_not_hide_valid_entry(self):
+        copy = self._reencoded(self.captcha1)
+        distance = (dhash(self.captcha1) ^ dhash(copy)).bit_count()
+        cache = PerceptualHashCache(max_distance=max(distance, 1) + 4, ttl=60)
+        cache.put(copy, 'copy')
+        cache.put(self.captcha1, 'original')
+        phash = dhash(self.captcha1)
+        value, _ = cache._entries[phash]
+        cache._entries[phash] = (value, time.time() - 1)      # The exact match has expired.
+
+        self.assertEqual('copy', cache.get(self.captcha1))
+
+
+    def test_dhash_without_deprecation_warning(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', DeprecationWarning)
+            dhash(self.captcha1)
+
+
+    def test_exact_keys_kept_out_of_the_band_index(self):
+        cache = PerceptualHashCache(max_distance=8)
+        cache._perceptual = False       # As without Pillow.
+        cache.put(self.captcha1, '56839')
+        cache.put(b'not an image', 'text')
+        self.assertEqual([{}] * len(cache._bands), cache._index)
+        self.assertEqual('56839', cache.get(self.captcha1))
+        self.assertIsNone(cache.get(self.captcha2))
+        self.assertEqual(1, cache.stats()['exact_hits'])
+
+
+    def test_undecodable_content_matches_exactly(self):
+        cache = PerceptualHashCache(max_distance=8)
+        cache.put(self.captcha1, '56839')
+        cache.put(b'not an image', 'text')
+        self.assertEqual('text', cache.get(b'not an image'))
+        self.assertIsNone(cache.get(b'not an image either'))
+        self.assertEqual('56839', cache.get(self.captcha1))
+
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'captcha-cache.json')
+            cache = PerceptualHashCache(path=path)
+            cache.put(self.captcha1, '56839')
+            cache.put(b'not an image', 'text')
+            cache.save()
+
+            loaded = PerceptualHashCache(path=path)
+            self.assertEqual('56839', loaded.get(self.captcha1))
+            self.assertEqual('text', loaded.get(b'not an image'))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import unittest
+
+from flowdepot.agents.captcha.agent import CaptchaService
+from flowdepot.agents.captcha.recognizers import TemplateRecognizer
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+UNSEEN_PATH = os.path.join(os.path.dirname(__file__), '..', 'agents', 'captcha', 'captcha-73634.png')
+
+
+def read(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+
+class StubRemoteRecognizer:
+    """Answers the texts in turn, offline."""
+    name = "stub"
+
+    def __init__(self, *texts):
+        self.texts = list(texts)
+
+    def data_url(self, content, mime_type):
+        return f"data:{mime_type};base64,"
+
+    def recognize_url(self, data_url):
+        return self.texts.pop(0), 1.0
+
+    def recognize_urls(self, data_urls):
+        return {index: self.texts.pop(0) for index in data_urls}
+
+
+
+class TestTemplateRecognizer(unittest.TestCase):
+    def setUp(self):
+        self.sample = read(os.path.join(DATA_DIR, 'captcha-56839.png'))
+        self.unseen = read(UNSEEN_PATH)
+
+
+    def test_recognize_sample(self):
+        recognizer = TemplateRecognizer({'samples': [DATA_DIR]})
+        text, confidence = recognizer.recognize(self.sample, 'image/png')
+        self.assertEqual('56839', text)
+        self.assertGreaterEqual(confidence, 0.99)
+
+
+    def test_unseen_below_min_confidence(self):
+        recognizer = TemplateRecognizer({'samples': [DATA_DIR]})
+        _, confidence = recognizer.recognize(self.unseen, 'image/png')
+        self.assertLess(confidence, 0.9)
+
+
+    def test_no_samples_or_learning_by_default(self):
+        recognizer = TemplateRecognizer()
+        self.assertEqual(("", 0.0), recognizer.recognize(self.sample, 'image/png'))
+        recognizer.learn(self.sample, '56839')
+        self.assertEqual(0, recognizer.stats()['templates'])
+
+
+    def _create_service(self, *remote_texts) -> CaptchaService:
+        service = CaptchaService('captcha-test', {
+            'local_recognizer': 'templates',
+            'local_recognizer_params': {'samples': [DATA_DIR], 'learn': True},
+        })
+        service.remote_recognizer = StubRemoteRecognizer(*remote_texts)
+        return service
+
+
+    def test_learn_corroborated_answer(self):
+        service = self._create_service('73634', '73634')
+        self.assertEqual(('73634', 'stub'), service._recognize(self.unseen, 'image/png'))
+        service.batch_executor.shutdown(wait=True)
+        self.assertEqual(1, service.local_recognizer.stats()['learned'])
+        self.assertEqual('73634', service._recognize_locally(self.unseen, 'image/png'))
+
+
+    def test_not_learn_disputed_answer(self):
+        service = self._create_service('73634', '78634')
+        service._recognize(self.unseen, 'image/png')
+        service.batch_executor.shutdown(wait=True)
+        self.assertEqual(0, service.local_recognizer.stats()['learned'])
+        self.assertEqual(1, service.counts['disagreements'])
+        self.assertIsNone(service._recognize_locally(self.unseen, 'image/png'))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
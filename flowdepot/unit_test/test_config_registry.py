@@ -0,0 +1,89 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import logging
+import tempfile
+import threading
+import time
+import unittest
+
+from flowdepot.agent_loader import deep_merge, merge_agent_config
+from flowdepot.config_registry import ConfigRegistry, FrozenDict
+
+
+
+class TestConfigRegistry(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'config.yaml')
+        self._write('a: 1\n')
+
+
+    def _write(self, text):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        # The next mtime, even on a file system with a coarse clock.
+        mtime = os.stat(self.path).st_mtime + 1
+        os.utime(self.path, (mtime, mtime))
+
+
+    def test_listener_notified_after_load(self):
+        registry = ConfigRegistry(check_interval=0, watch_interval=0.1)
+        self.assertEqual({'a': 1}, registry.load(self.path))
+        changed = threading.Event()
+        registry.add_listener([self.path], changed.set)
+
+        self._write('a: 2\n')
+        self.assertEqual({'a': 2}, registry.load(self.path))     # Re-parsed before the watcher polls.
+        self.assertTrue(changed.wait(2))
+
+
+    def test_listener_notified_by_watcher(self):
+        registry = ConfigRegistry(check_interval=0, watch_interval=0.1)
+        registry.load(self.path)
+        changed = threading.Event()
+        registry.add_listener([self.path], changed.set)
+
+        self._write('a: 3\n')
+        self.assertTrue(changed.wait(2))
+        self.assertEqual({'a': 3}, registry.load(self.path))
+
+
+    def test_merge_agent_config_is_mutable(self):
+        self._write('name: test\nitems: [1, 2]\nnested: {key: value}\n')
+        config = merge_agent_config(self.directory.name, {}, system_config_path=self.path)
+        self.assertIsInstance(config['items'], list)
+        self.assertNotIsInstance(config['nested'], FrozenDict)
+        config['nested']['key'] = 'changed'
+        config['items'].append(3)
+
+
+    def test_removed_file_warned_once(self):
+        registry = ConfigRegistry(check_interval=0, watch_interval=60)
+        registry.load(self.path)
+        os.remove(self.path)
+        with self.assertLogs(logging.getLogger(os.getenv('LOGGER_NAME')), 'INFO') as logs:
+            for _ in range(3):
+                self.assertEqual(set(), registry._changed_paths())
+            self._write('a: 4\n')
+            self.assertEqual({self.path}, registry._changed_paths())
+        self.assertEqual(1, sum('Failed to reload config' in line for line in logs.output))
+        self.assertEqual(1, sum('readable again' in line for line in logs.output))
+        self.assertEqual({'a': 4}, registry.load(self.path))
+
+
+    def test_deep_merge_copies(self):
+        base = {'broker': {'mqtt': {'port': 1883}}, 'items': [1]}
+        merged = deep_merge(base, {'broker': {'name': 'mqtt'}})
+        merged['broker']['mqtt']['port'] = 1884
+        merged['items'].append(2)
+        self.assertEqual({'broker': {'mqtt': {'port': 1883}}, 'items': [1]}, base)
+
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import hashlib
+import time
+import unittest
+
+import logging
+from flowdepot.app_logger import init_logging
+logger:logging.Logger = init_logging()
+
+from agentflow.core.agent import Agent
+from agentflow.core.parcel import BinaryParcel
+from agents.topics import AgentTopics
+from flowdepot.config_registry import registry, thaw
+
+
+config_path = os.path.join(os.getcwd(), 'config', 'system.yaml')
+agent_config = thaw(registry.load(config_path))
+
+CHUNK_SIZE = 64 * 1024
+content = os.urandom(CHUNK_SIZE * 3 + 123)
+
+
+
+class TestAgent(unittest.TestCase):
+    result = None
+    resumed = None
+    stats_before = None
+    stats = None
+
+    class ValidationAgent(Agent):
+        def __init__(self):
+            super().__init__(name='main', agent_config=agent_config)
+
+
+        def on_activate(self):
+            try:
+                # The service may have served other tests, its counts are compared with these.
+                TestAgent.stats_before = self.publish_sync(AgentTopics.FILE_STATS, BinaryParcel({})).content
+
+                pcl = self.publish_sync(AgentTopics.FILE_UPLOAD_BEGIN, BinaryParcel({'filename': 'chunked.bin'}))
+                upload_id = pcl.content['upload_id']
+
+                chunks = [content[i:i + CHUNK_SIZE] for i in range(0, len(content), CHUNK_SIZE)]
+                for index, chunk in enumerate(chunks[:2]):
+                    self.publish_sync(AgentTopics.FILE_UPLOAD_CHUNK, BinaryParcel({'upload_id': upload_id, 'index': index, 'content': chunk}))
+
+                # Resume the interrupted upload by its id.
+                pcl = self.publish_sync(AgentTopics.FILE_UPLOAD_BEGIN, BinaryParcel({'filename': 'chunked.bin', 'upload_id': upload_id}))
+                TestAgent.resumed = pcl.content
+                for index in range(pcl.content['next_index'], len(chunks)):
+                    self.publish_sync(AgentTopics.FILE_UPLOAD_CHUNK, BinaryParcel({'upload_id': upload_id, 'index': index, 'content': chunks[index]}))
+
+                pcl = self.publish_sync(AgentTopics.FILE_UPLOAD_COMMIT, BinaryParcel({
+                    'upload_id': upload_id,
+                    'sha256': hashlib.sha256(content).hexdigest()}))
+                logger.debug(self.M(f"result: {pcl.content}"))
+                TestAgent.result = pcl.content
+
+                pcl = self.publish_sync(AgentTopics.FILE_STATS, BinaryParcel({}))
+                TestAgent.stats = pcl.content
+            except Exception as ex:
+                logger.exception(ex)
+
+
+    def setUp(self):
+        self.validation_agent = TestAgent.ValidationAgent()
+        self.validation_agent.start_thread()
+
+
+    def _do_test_1(self):
+        self.assertEqual(2, TestAgent.resumed['next_index'])
+        self.assertEqual(2 * CHUNK_SIZE, TestAgent.resumed['received_bytes'])
+
+        result = TestAgent.result
+        self.assertTrue(result['file_id'])
+        self.assertEqual('chunked.bin', result['filename'])
+        self.assertEqual(len(content), result['size'])
+        with open(result['file_path'], 'rb') as fp:
+            self.assertEqual(content, fp.read())
+
+        io_stats, io_stats_before = TestAgent.stats['io'], TestAgent.stats_before['io']
+        self.assertEqual(7, io_stats['completed'] - io_stats_before['completed'])   # begin x2, chunks x4, commit
+        self.assertEqual(io_stats_before['failed'], io_stats['failed'])
+        self.assertIsNotNone(io_stats['latency_ms']['p95'])
+
+
+    def test_1(self):
+        time.sleep(5)
+
+        try:
+            self._do_test_1()
+        except Exception as ex:
+            logger.exception(ex)
+            self.assertTrue(False)
+
+
+    def tearDown(self):
+        self.validation_agent.terminate()
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import hashlib
+import tempfile
+import unittest
+
+from agentflow.core.parcel import BinaryParcel
+from agents.file.agent import FileService
+from agents.file.io_pool import IoWorkerPool
+
+
+
+class TestCommitRetry(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.service = FileService('file-test', {'home_directory': self.directory.name})
+        self.service.io_pool = IoWorkerPool(workers=1)
+        self.content = os.urandom(1000)
+        self.moves = 0
+
+        progress = self.service.handle_upload_begin('upload/begin', BinaryParcel({'filename': 'data.bin'}))
+        self.upload_id = progress['upload_id']
+        for index in range(2):
+            self.service.handle_upload_chunk('upload/chunk', BinaryParcel({
+                'upload_id': self.upload_id, 'index': index, 'content': self.content[index * 500:(index + 1) * 500]}))
+
+
+    def _failing_move(self, source_path, file_path):
+        self.moves += 1
+        if self.moves == 1:
+            raise OSError(28, "No space left on device")
+        FileService._move_file(self.service, source_path, file_path)
+
+
+    def _commit(self):
+        return self.service.handle_upload_commit('upload/commit', BinaryParcel({
+            'upload_id': self.upload_id, 'sha256': hashlib.sha256(self.content).hexdigest()}))
+
+
+    def test_failed_move_can_be_retried(self):
+        self.service._move_file = self._failing_move
+        with self.assertRaises(OSError):
+            self._commit()
+        self.assertTrue(os.path.exists(self.service.chunked_uploads.part_path(self.upload_id)))
+
+        result = self._commit()
+        self.assertEqual(2, self.moves)
+        self.assertEqual(len(self.content), result['size'])
+        with open(self.service._find_file(result['file_id']), 'rb') as fp:
+            self.assertEqual(self.content, fp.read())
+        self.assertEqual([], os.listdir(self.service.chunked_uploads.partial_directory))
+
+        with self.assertRaises(KeyError):       # Committed once.
+            self._commit()
+
+
+    def test_failed_move_resumable_after_restart(self):
+        self.service._move_file = self._failing_move
+        with self.assertRaises(OSError):
+            self._commit()
+
+        restarted = FileService('file-test', {'home_directory': self.directory.name})
+        restarted.io_pool = self.service.io_pool
+        progress = restarted.handle_upload_begin('upload/begin', BinaryParcel({'filename': 'data.bin', 'upload_id': self.upload_id}))
+        self.assertEqual((2, len(self.content)), (progress['next_index'], progress['received_bytes']))
+        self.service = restarted
+        self.assertEqual(len(self.content), self._commit()['size'])
+
+
+    def tearDown(self):
+        self.service.io_pool.shutdown()
+        self.directory.cleanup()
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import time
+import unittest
+
+import logging
+from flowdepot.app_logger import init_logging
+logger:logging.Logger = init_logging()
+
+from agentflow.core.agent import Agent
+from agentflow.core.parcel import BinaryParcel
+from agents.topics import AgentTopics
+from flowdepot.config_registry import registry, thaw
+
+
+config_path = os.path.join(os.getcwd(), 'config', 'system.yaml')
+agent_config = thaw(registry.load(config_path))
+
+content = os.urandom(100 * 1024)
+
+
+
+class TestAgent(unittest.TestCase):
+    uploaded = None
+    downloaded = None
+    range_read = None
+    queried = None
+
+    class ValidationAgent(Agent):
+        def __init__(self):
+            super().__init__(name='main', agent_config=agent_config)
+
+
+        def on_activate(self):
+            try:
+                pcl = self.publish_sync(AgentTopics.FILE_UPLOAD, BinaryParcel({'content': content, 'filename': 'download.bin'}))
+                TestAgent.uploaded = pcl.content
+                file_id = pcl.content['file_id']
+
+                pcl = self.publish_sync(AgentTopics.FILE_DOWNLOAD, BinaryParcel({'file_id': file_id}))
+                TestAgent.downloaded = pcl.content
+                pcl = self.publish_sync(AgentTopics.FILE_READ_RANGE, BinaryParcel({'file_id': file_id, 'offset': 1000, 'length': 5000}))
+                TestAgent.range_read = pcl.content
+                pcl = self.publish_sync(AgentTopics.FILE_QUERY, {'sha256': TestAgent.uploaded['sha256'], 'filename_prefix': 'down'})
+                TestAgent.queried = pcl.content
+            except Exception as ex:
+                logger.exception(ex)
+
+
+    def setUp(self):
+        self.validation_agent = TestAgent.ValidationAgent()
+        self.validation_agent.start_thread()
+
+
+    def _do_test_1(self):
+        self.assertEqual(TestAgent.uploaded['file_id'], TestAgent.downloaded['file_id'])
+        self.assertEqual('download.bin', TestAgent.downloaded['filename'])
+        self.assertEqual(content, TestAgent.downloaded['content'])
+
+        self.assertEqual(len(content), TestAgent.range_read['size'])
+        self.assertEqual(1000, TestAgent.range_read['offset'])
+        self.assertEqual(content[1000:6000], TestAgent.range_read['content'])
+
+        files = TestAgent.queried['files']
+        self.assertEqual(1, len(files))
+        self.assertEqual(TestAgent.uploaded['file_id'], files[0]['file_id'])
+        self.assertEqual(len(content), files[0]['size'])
+
+
+    def test_1(self):
+        time.sleep(5)
+
+        try:
+            self._do_test_1()
+        except Exception as ex:
+            logger.exception(ex)
+            self.assertTrue(False)
+
+
+    def tearDown(self):
+        self.validation_agent.terminate()
+
+
+
+if __name__ == '__main__':
+    unittest.main()
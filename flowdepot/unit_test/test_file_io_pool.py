@@ -0,0 +1,80 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import tempfile
+import threading
+import time
+import unittest
+
+from agents.file.io_pool import IoBusyError, IoWorkerPool
+
+
+
+class TestIoWorkerPool(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+
+    def _write(self, name, data=b'data'):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'wb') as fp:
+            fp.write(data)
+        return path
+
+
+    def test_batch_commit(self):
+        pool = IoWorkerPool(workers=2, fsync='batch', group_commit_ms=20)
+        futures = [pool.submit(self._write, f'{i}.bin', paths=lambda path: [path]) for i in range(5)]
+        self.assertEqual([os.path.join(self.directory.name, f'{i}.bin') for i in range(5)], [future.result(5) for future in futures])
+        self.assertLess(pool.stats()['group_commits'], 5)
+        pool.shutdown()
+
+
+    def test_queued_jobs_finished_by_shutdown(self):
+        pool = IoWorkerPool(workers=1, fsync='batch')
+        futures = [pool.submit(time.sleep, 0.02) for _ in range(5)]
+        pool.shutdown()
+        for future in futures:
+            self.assertIsNone(future.result(0))
+
+
+    def test_submit_after_shutdown(self):
+        pool = IoWorkerPool(workers=1)
+        pool.shutdown()
+        with self.assertRaises(RuntimeError):
+            pool.submit(self._write, 'late.bin')
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, 'late.bin')))
+
+
+    def test_submit_racing_shutdown_never_hangs(self):
+        pool = IoWorkerPool(workers=2, max_queue=4, queue_timeout=1)
+        futures, errors = [], []
+
+        def submit_until_closed():
+            while True:
+                try:
+                    futures.append(pool.submit(time.sleep, 0.001))
+                except (RuntimeError, IoBusyError) as ex:
+                    errors.append(ex)
+                    if not isinstance(ex, IoBusyError):
+                        return
+
+        threads = [threading.Thread(target=submit_until_closed) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        pool.shutdown()
+        for thread in threads:
+            thread.join(5)
+        for future in futures:
+            future.result(1)        # Each accepted job resolves.
+        self.assertEqual(4, sum(not isinstance(ex, IoBusyError) for ex in errors))
+
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,7 +6,6 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import time
 import unittest
-import yaml
 
 import logging
 from flowdepot.app_logger import init_logging
@@ -15,11 +14,11 @@ logger:logging.Logger = init_logging()
 from agentflow.core.agent import Agent
 from agentflow.core.parcel import BinaryParcel, Parcel
 from agents.topics import AgentTopics
+from flowdepot.config_registry import registry, thaw
 
 
 config_path = os.path.join(os.getcwd(), 'config', 'system.yaml')
-with open(config_path, 'r', encoding='utf-8') as f:
-    agent_config = yaml.safe_load(f) or {}
+agent_config = thaw(registry.load(config_path))
 
 
 
@@ -0,0 +1,68 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import time
+import unittest
+
+import logging
+from flowdepot.app_logger import init_logging
+logger:logging.Logger = init_logging()
+
+from agents.llm.async_runner import AsyncRunner
+from agents.llm.benchmark import create_service
+from agents.llm.fake_openai import FakeOpenAIServer
+
+
+
+class TestAsyncRunner(unittest.TestCase):
+    def test_timeout_covers_waiting_for_a_slot(self):
+        runner = AsyncRunner(max_in_flight=1, timeout=10)
+        try:
+            busy = runner.submit(lambda: asyncio.sleep(1))
+            started = time.perf_counter()
+            with self.assertRaises(TimeoutError):
+                runner.run(lambda: asyncio.sleep(0), timeout=0.2)
+            self.assertLess(time.perf_counter() - started, 0.5)
+            busy.result()
+            self.assertEqual(0, runner.stats()['waiting'])
+            self.assertEqual('done', runner.run(lambda: asyncio.sleep(0, 'done')))    # The slot is released.
+        finally:
+            runner.close()
+
+
+
+class TestLlmServiceConfigChange(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeOpenAIServer(latency=0.5, reply='old', token_interval=0).start()
+        self.service = create_service(self.server.base_url, cache=False, coalesce=False)
+
+
+    def test_replaced_llm_closed_after_its_requests(self):
+        old_llm, closed = self.service.llm, []
+
+        async def aclose():
+            closed.append(time.perf_counter())
+        old_llm.aclose = aclose
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(self.service._generate, {'messages': [{'role': 'user', 'content': 'hi'}], 'timeout': 5})
+            time.sleep(0.1)
+            self.service.on_config_changed({**self.service.llm_params, 'model': 'another'})
+            time.sleep(0.1)
+            self.assertEqual([], closed)        # In flight on the old client.
+            self.assertEqual('old', future.result())
+        time.sleep(0.1)
+        self.assertEqual(1, len(closed))
+        self.assertIsNot(old_llm, self.service.llm)
+
+
+    def tearDown(self):
+        self.service.on_terminated()
+        self.server.stop()
+
+
+
+if __name__ == '__main__':
+    unittest.main()
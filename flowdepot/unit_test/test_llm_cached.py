@@ -0,0 +1,88 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import asyncio
+import tempfile
+import time
+import unittest
+
+from agents.llm.llms.base_llm import LlmInstance
+from agents.llm.llms.cached_llm import CachedLlm
+from flowdepot.cache import DiskCache, LruCache, TieredCache
+
+
+
+class StubLlm(LlmInstance):
+    """Answers with a new response each call, so a cached one is told apart."""
+    def __init__(self, temperature=0):
+        super().__init__(name='Stub')
+        self.temperature = temperature
+        self.calls = 0
+
+
+    def generate_response(self, params):
+        self.calls += 1
+        return f"response {self.calls}"
+
+
+    def request_key(self, params) -> dict:
+        prompt = params['messages'] if isinstance(params, dict) else params
+        return {'model': 'stub', 'messages': prompt, 'temperature': self.temperature}
+
+
+
+class TestCachedLlm(unittest.TestCase):
+    def _create(self, temperature=0, ttl=None, cache=None):
+        llm = StubLlm(temperature)
+        return llm, CachedLlm(llm, cache or LruCache(max_entries=16), ttl=ttl)
+
+
+    def test_hit_at_temperature_0(self):
+        llm, cached = self._create()
+        self.assertEqual('response 1', cached.generate_response('hello'))
+        self.assertEqual('response 1', cached.generate_response('hello'))
+        self.assertEqual('response 2', cached.generate_response('another'))
+        self.assertEqual(2, llm.calls)
+
+
+    def test_not_cached_at_temperature_above_0(self):
+        llm, cached = self._create(temperature=0.7)
+        self.assertEqual('response 1', cached.generate_response('hello'))
+        self.assertEqual('response 2', cached.generate_response('hello'))
+        self.assertEqual(2, cached.stats()['uncacheable'])
+
+
+    def test_bypass(self):
+        llm, cached = self._create()
+        cached.generate_response('hello')
+        request = {'messages': 'hello', 'cache': False}
+        self.assertEqual('response 2', cached.generate_response(request))
+        self.assertEqual('response 2', cached.generate_response('hello'))     # Refreshed by the bypass.
+        self.assertEqual(1, cached.stats()['bypassed'])
+
+
+    def test_ttl_expiry(self):
+        llm, cached = self._create(ttl=0.1)
+        cached.generate_response('hello')
+        self.assertEqual('response 1', cached.generate_response('hello'))
+        time.sleep(0.15)
+        self.assertEqual('response 2', cached.generate_response('hello'))
+        self.assertEqual(1, cached.stats()['expired'])
+
+
+    def test_async_with_disk_tier(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = TieredCache(LruCache(max_entries=16), DiskCache(directory, 1024 * 1024))
+            llm, cached = self._create(cache=cache)
+
+            async def ask_twice():
+                return [await cached.agenerate_response('hello'), await cached.agenerate_response('hello')]
+
+            self.assertEqual(['response 1', 'response 1'], asyncio.run(ask_twice()))
+            self.assertEqual(1, llm.calls)
+            self.assertEqual(1, len(cache.tiers[1]))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
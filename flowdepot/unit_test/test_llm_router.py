@@ -0,0 +1,146 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import time
+import unittest
+
+import logging
+from flowdepot.app_logger import init_logging
+logger:logging.Logger = init_logging()
+
+from agents.llm.async_runner import AsyncRunner
+from agents.llm.fake_openai import FakeOpenAIServer
+from agents.llm.llms import create_instance
+from agents.llm.llms.chatgpt import ChatGPT
+from agents.llm.llms.router import LlmRouter
+
+
+
+class TestLlmRouter(unittest.TestCase):
+    def setUp(self):
+        self.server_a = FakeOpenAIServer(latency=0.02, reply='A', token_interval=0).start()
+        self.server_b = FakeOpenAIServer(latency=0.06, reply='B', token_interval=0).start()
+        self.runner = AsyncRunner(max_in_flight=8, timeout=10)
+        self.router = None
+
+
+    def _create_router(self, **params) -> LlmRouter:
+        self.router = create_instance('Router', {
+            'openai_api_key': 'fake',
+            'backends': [
+                {'name': 'a', 'base_url': self.server_a.base_url},
+                {'name': 'b', 'base_url': self.server_b.base_url},
+            ],
+            **params,
+        })
+        return self.router
+
+
+    def _ask(self, router, prompt='hello'):
+        return self.runner.run(lambda: router.agenerate_response(prompt))
+
+
+    def test_create_instance(self):
+        self.assertIsInstance(create_instance('ChatGPT', {'openai_api_key': 'fake'}), ChatGPT)
+        self.assertIsInstance(self._create_router(), LlmRouter)
+        with self.assertRaises(ValueError):
+            create_instance('Unknown', {})
+
+
+    def test_prefers_faster_backend(self):
+        router = self._create_router()
+        answers = [self._ask(router) for _ in range(10)]
+        logger.debug(f'answers: {answers}, stats: {router.stats()}')
+        self.assertGreaterEqual(answers.count('A'), 8)
+
+
+    def test_failover_on_429(self):
+        self.server_a.status = 429
+        router = self._create_router()
+        self.assertEqual('B', self._ask(router))
+        self.assertTrue(router.stats()['backends'][0]['cooling'])
+
+        requests_a = self.server_a.requests
+        self.assertEqual('B', self._ask(router))
+        self.assertEqual(requests_a, self.server_a.requests)    # Cooling down, not tried first.
+
+
+    def test_failover_on_error(self):
+        self.server_a.status = 500
+        router = self._create_router()
+        self.assertEqual(['B', 'B', 'B'], [router.generate_response('hello') for _ in range(3)])
+        self.assertGreater(router.stats()['backends'][0]['error_rate'], 0)
+        self.assertEqual(0, router.stats()['hedge_wins'])      # Failovers, not hedges.
+
+
+    def test_all_backends_fail(self):
+        self.server_a.status = 500
+        self.server_b.status = 503
+        router = self._create_router()
+        with self.assertRaises(Exception):
+            self._ask(router)
+
+
+    def test_request_key(self):
+        router = self._create_router(temperature=0)
+        self.assertEqual('gpt-4o-mini', router.request_key('hello')['model'])
+
+        router = self._create_router(temperature=0, backends=[
+            {'base_url': self.server_a.base_url, 'model': 'model-a'},
+            {'base_url': self.server_b.base_url, 'model': 'model-b'},
+        ])
+        self.assertEqual(['model-a', 'model-b'], router.request_key('hello')['model'])
+
+        router = self._create_router(backends=[
+            {'base_url': self.server_a.base_url, 'temperature': 0},
+            {'base_url': self.server_b.base_url, 'temperature': 0.7},
+        ])
+        self.assertIsNone(router.request_key('hello'))
+
+
+    def test_hedge_slow_backend(self):
+        self.server_b.latency = 0.2     # Never ranked first after its probe.
+        router = self._create_router(hedge_min_samples=5)
+        for _ in range(10):
+            self._ask(router)
+
+        hedges, hedge_wins = router.stats()['hedges'], router.stats()['hedge_wins']     # The warm-up may have hedged on jitter.
+        self.server_a.latency = 2       # Degraded.
+        started = time.perf_counter()
+        answer = self._ask(router)
+        elapsed = time.perf_counter() - started
+        logger.debug(f'answer: {answer}, elapsed: {elapsed:.3f}, stats: {router.stats()}')
+        self.assertEqual('B', answer)
+        self.assertLess(elapsed, 1)
+        self.assertEqual(hedges + 1, router.stats()['hedges'])
+        self.assertEqual(hedge_wins + 1, router.stats()['hedge_wins'])
+
+        started = time.perf_counter()
+        self.assertEqual('B', router.generate_response('hello'))   # The blocking path hedges too.
+        self.assertLess(time.perf_counter() - started, 1)
+
+
+    def test_streams_kept_out_of_hedge_delay(self):
+        router = self._create_router(hedge_min_samples=5)
+        for _ in range(5):
+            self._ask(router)
+        backend = router._ranked()[0]
+        latencies, ewma = list(backend.latencies), backend.ewma
+
+        self.server_a.latency = self.server_b.latency = 0
+        for _ in range(10):
+            self.assertTrue("".join(router.stream_response('hello')))
+        self.assertEqual(latencies, list(backend.latencies))
+        self.assertEqual(ewma, backend.ewma)
+        self.assertIsNotNone(router.stats()['backends'][0]['first_delta_ewma_ms'])
+
+
+    def tearDown(self):
+        self.runner.close(self.router.aclose() if self.router else None)
+        self.server_a.stop()
+        self.server_b.stop()
+
+
+
+if __name__ == '__main__':
+    unittest.main()
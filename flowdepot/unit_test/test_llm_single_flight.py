@@ -0,0 +1,76 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import unittest
+
+from agents.llm.single_flight import SingleFlight
+
+
+CALLERS = 8
+
+
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self):
+        self.single_flight = SingleFlight()
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+
+    def _upstream(self, result=None, error=None):
+        def call():
+            self.calls += 1
+            self.started.set()
+            self.release.wait(5)    # In flight until all the callers have arrived.
+            if error:
+                raise error
+            return result
+        return call
+
+
+    def _run_all(self, func):
+        """Run the callers of one key, the leader first, and release it once the others wait."""
+        def run():
+            try:
+                return self.single_flight.run('key', func)
+            except Exception as ex:
+                return ex
+
+        with ThreadPoolExecutor(max_workers=CALLERS) as executor:
+            leader = executor.submit(run)
+            self.started.wait(5)
+            followers = [executor.submit(run) for _ in range(CALLERS - 1)]
+            while self.single_flight.followers < CALLERS - 1:
+                threading.Event().wait(0.01)
+            self.release.set()
+            return [future.result() for future in [leader, *followers]]
+
+
+    def test_one_upstream_call(self):
+        result = {'response': 'shared'}
+        results = self._run_all(self._upstream(result=result))
+        self.assertEqual(1, self.calls)
+        self.assertTrue(all(r is result for r in results))
+        self.assertEqual({'in_flight': 0, 'leaders': 1, 'followers': CALLERS - 1}, self.single_flight.stats())
+
+
+    def test_same_exception(self):
+        error = TimeoutError("upstream timed out")
+        results = self._run_all(self._upstream(error=error))
+        self.assertEqual(1, self.calls)
+        self.assertTrue(all(r is error for r in results))
+
+
+    def test_key_forgotten_after_call(self):
+        self.release.set()
+        self.assertEqual(1, self.single_flight.run('key', self._upstream(result=1)))
+        self.assertEqual(2, self.single_flight.run('key', self._upstream(result=2)))
+        self.assertEqual(2, self.calls)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import stat
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+from flowdepot.agents.stt.audio_decoder import FfmpegDecoderPool
+
+
+# Stands in for ffmpeg: the input is already s16le; 'bad' input fails.
+FAKE_FFMPEG = f'''#!{sys.executable}
+import shutil, sys
+head = sys.stdin.buffer.read(3)
+if head == b'bad':
+    sys.stderr.write('Invalid data found when processing input')
+    sys.exit(1)
+sys.stdout.buffer.write(head)
+shutil.copyfileobj(sys.stdin.buffer, sys.stdout.buffer)
+'''
+
+
+
+class TestFfmpegDecoderPool(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.ffmpeg = os.path.join(self.directory.name, 'ffmpeg')
+        with open(self.ffmpeg, 'w') as file:
+            file.write(FAKE_FFMPEG)
+        os.chmod(self.ffmpeg, stat.S_IRWXU)
+        self.pool = FfmpegDecoderPool(size=2, ffmpeg=self.ffmpeg)
+        self.samples = np.array([0, 16384, -32768, 32767], dtype=np.int16)
+
+
+    def _wait_idle(self, size):
+        deadline = time.monotonic() + 5
+        while self.pool._idle.qsize() < size and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.pool._idle.qsize()
+
+
+    def test_decode(self):
+        audio = self.pool.decode(self.samples.tobytes())
+        self.assertEqual(np.float32, audio.dtype)
+        np.testing.assert_allclose(self.samples / 32768.0, audio)
+
+
+    def test_decode_error(self):
+        with self.assertRaises(RuntimeError) as context:
+            self.pool.decode(b'bad input')
+        self.assertIn('Invalid data', str(context.exception))
+
+
+    def test_taken_processes_replenished(self):
+        for _ in range(3):
+            self.pool.decode(self.samples.tobytes())
+        self.assertEqual(2, self._wait_idle(2))
+        self.assertEqual(0, self.pool._missing)
+
+
+    def test_exited_idle_process_skipped(self):
+        for process in list(self.pool._idle.queue):
+            process.kill()
+            process.wait()
+        np.testing.assert_allclose(self.samples / 32768.0, self.pool.decode(self.samples.tobytes()))
+
+
+    def test_close_kills_idle_and_stops_replenisher(self):
+        self.pool.decode(self.samples.tobytes())
+        processes = list(self.pool._idle.queue)
+        self.pool.close()
+        self.assertFalse(self.pool._replenisher.is_alive())
+        self.assertEqual(0, self.pool._idle.qsize())
+        self.assertTrue(all(process.poll() is not None for process in processes))
+
+
+    def tearDown(self):
+        self.pool.close()
+        self.directory.cleanup()
+
+
+
+if __name__ == '__main__':
+    unittest.main()
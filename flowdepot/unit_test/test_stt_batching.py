@@ -0,0 +1,96 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import unittest
+
+from flowdepot.agents.stt.batching import MicroBatcher
+
+
+
+class RecordingProcess:
+    """Doubles the items and records the batches; the first batch waits for the release."""
+    def __init__(self):
+        self.batches = []
+        self.release = threading.Event()
+
+    def __call__(self, items):
+        if not self.batches:
+            self.release.wait(5)
+        self.batches.append(items)
+        return [item * 2 for item in items]
+
+
+
+class TestMicroBatcher(unittest.TestCase):
+    def setUp(self):
+        self.process = RecordingProcess()
+
+
+    def test_concurrent_items_grouped(self):
+        batcher = MicroBatcher(self.process, max_size=4, max_wait_ms=200)
+        first = batcher.submit(0)
+        time.sleep(0.4)     # The first batch is closed after max_wait_ms, and held.
+
+        futures = [batcher.submit(i) for i in range(1, 7)]      # Queued while the first batch is busy.
+        self.process.release.set()
+        self.assertEqual(0, first.result(5))
+        self.assertEqual([2 * i for i in range(1, 7)], [future.result(5) for future in futures])
+        self.assertEqual([[0], [1, 2, 3, 4], [5, 6]], self.process.batches)
+        self.assertEqual(3, batcher.stats()['batches'])
+        batcher.stop()
+
+
+    def test_flushed_after_max_wait(self):
+        self.process.release.set()
+        batcher = MicroBatcher(self.process, max_size=8, max_wait_ms=50)
+        started = time.monotonic()
+        self.assertEqual([2, 4], batcher.map([1, 2]))
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual([[1, 2]], self.process.batches)
+        batcher.stop()
+
+
+    def test_map_from_threads_keeps_results_in_order(self):
+        self.process.release.set()
+        batcher = MicroBatcher(self.process, max_size=3, max_wait_ms=20)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda base: batcher.map([base, base + 1]), range(0, 40, 10)))
+        self.assertEqual([[2 * base, 2 * base + 2] for base in range(0, 40, 10)], results)
+        self.assertTrue(all(len(batch) <= 3 for batch in self.process.batches))
+        batcher.stop()
+
+
+    def test_failed_batch_fails_its_items(self):
+        calls = []
+
+        def fail_once(items):
+            calls.append(items)
+            if len(calls) == 1:
+                raise ValueError("decoding failed")
+            return items
+
+        batcher = MicroBatcher(fail_once, max_size=2, max_wait_ms=10)
+        futures = [batcher.submit(i) for i in range(2)]
+        for future in futures:
+            with self.assertRaises(ValueError):
+                future.result(5)
+        self.assertEqual([2, 3], batcher.map([2, 3]))      # The batcher goes on.
+        batcher.stop()
+
+
+    def test_stop_processes_the_queued_items(self):
+        self.process.release.set()
+        batcher = MicroBatcher(self.process, max_size=2, max_wait_ms=1000)
+        futures = [batcher.submit(i) for i in range(3)]
+        batcher.stop()
+        self.assertEqual([0, 2, 4], [future.result(5) for future in futures])
+        batcher._thread.join(5)
+        self.assertFalse(batcher._thread.is_alive())
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import importlib.util
+import tempfile
+import unittest
+
+import numpy as np
+
+from flowdepot.agents.stt.agent import SttService
+from flowdepot.agents.stt.engines import ENGINES, BatchingEngine, FasterWhisperEngine, SttEngine, create_engine
+
+
+
+class StubBatchingEngine(BatchingEngine):
+    """A 'segment' is a slice of 10 samples; its text is its length."""
+    name = "stub-batching"
+
+    def load(self):
+        self.batches = []
+
+    def transcribe(self, audio, initial_prompt=None) -> dict:
+        raise AssertionError("A batching service decodes by segments.")
+
+    def log_mel_segments(self, audio) -> list:
+        return [audio[start:start + 10] for start in range(0, len(audio), 10)]
+
+    def decode_batch(self, mels) -> list[str]:
+        self.batches.append(len(mels))
+        return [f" {len(mel)} " for mel in mels]
+
+
+
+class StubEngine(SttEngine):
+    name = "stub"
+
+    def load(self):
+        pass
+
+    def transcribe(self, audio, initial_prompt=None) -> dict:
+        return {'text': str(len(audio)), 'segments': []}
+
+
+
+class TestSttEngines(unittest.TestCase):
+    def test_create_engine(self):
+        engine = create_engine('whisper-int8', 'base', cpu_threads=2)
+        self.assertIsInstance(engine, BatchingEngine)
+        self.assertEqual(('base', 2), (engine.model_name, engine.cpu_threads))
+        self.assertNotIsInstance(create_engine('faster-whisper', 'base'), BatchingEngine)
+        self.assertEqual({'whisper', 'whisper-int8', 'faster-whisper'}, set(ENGINES))
+
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            create_engine('unknown', 'base')
+
+
+    def test_batching_methods_required(self):
+        class PartialEngine(BatchingEngine):
+            def load(self):
+                pass
+
+            def transcribe(self, audio, initial_prompt=None) -> dict:
+                return {}
+
+        with self.assertRaises(TypeError):
+            PartialEngine('base')
+
+
+    def test_cache_options(self):
+        engine = create_engine('faster-whisper', 'base', params={'beam_size': 1})
+        self.assertEqual({'engine': 'faster-whisper', 'compute_type': 'int8', 'beam_size': 1}, engine.cache_options())
+
+
+    @unittest.skipIf(importlib.util.find_spec('faster_whisper'), "faster-whisper is installed.")
+    def test_optional_dependency_missing(self):
+        with self.assertRaises(RuntimeError):
+            FasterWhisperEngine('base').load()
+
+
+
+class TestSttServiceBatching(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+
+    def _create_service(self, engine: SttEngine) -> SttService:
+        service = SttService('stt-test', {
+            'whisper_model': 'stub',
+            'batch_max_size': 4,
+            'cache_directory': self.directory.name,
+        })
+        service.engine = engine
+        service._load_model()
+        return service
+
+
+    def test_batching_engine_decodes_by_segments(self):
+        service = self._create_service(StubBatchingEngine('stub'))
+        self.assertEqual("10 10 5", service._transcribe_audio(np.zeros(25, dtype=np.float32)))
+        self.assertEqual([3], service.engine.batches)
+        service.on_terminated()
+
+
+    def test_other_engine_not_batched(self):
+        service = self._create_service(StubEngine('stub'))
+        self.assertIsNone(service.batcher)
+        self.assertEqual("25", service._transcribe_audio(np.zeros(25, dtype=np.float32)))
+
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+
+if __name__ == '__main__':
+    unittest.main()
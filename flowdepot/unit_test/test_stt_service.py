@@ -0,0 +1,146 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import stat
+import tempfile
+import unittest
+
+import numpy as np
+
+from agentflow.core.parcel import BinaryParcel
+
+from flowdepot.agents.stt.agent import SttService
+from flowdepot.agents.stt.audio_decoder import SAMPLE_RATE, FfmpegDecoderPool
+from flowdepot.agents.stt.engines import SttEngine
+from flowdepot.agents.stt.vad import EnergyVad
+
+
+# An MP3 header, so the content is taken for audio; an even size, so it passes for s16le.
+AUDIO_PATH = os.path.join(os.path.dirname(__file__), '..', 'agents', 'stt', 'sample_apeech.mp3')
+
+
+# Stands in for ffmpeg: the input is taken as decoded s16le audio.
+FAKE_FFMPEG = f'''#!{sys.executable}
+import shutil, sys
+shutil.copyfileobj(sys.stdin.buffer, sys.stdout.buffer)
+'''
+
+
+
+class StubEngine(SttEngine):
+    """One segment per call, the number of samples; fails at fail_at calls."""
+    name = "stub"
+
+    def __init__(self, fail_at=None):
+        super().__init__('stub')
+        self.fail_at = fail_at
+        self.prompts = []
+
+    def load(self):
+        pass
+
+    def transcribe(self, audio, initial_prompt=None) -> dict:
+        self.prompts.append(initial_prompt)
+        if len(self.prompts) == self.fail_at:
+            raise RuntimeError("The model failed.")
+        text = f" {len(audio)} samples"
+        return {'text': text, 'segments': [{'start': 0.0, 'end': len(audio) / SAMPLE_RATE, 'text': text}]}
+
+
+
+class TestSttService(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        ffmpeg = os.path.join(self.directory.name, 'ffmpeg')
+        with open(ffmpeg, 'w') as file:
+            file.write(FAKE_FFMPEG)
+        os.chmod(ffmpeg, stat.S_IRWXU)
+
+        self.service = self._create_service()
+        self.service.decoder_pool = FfmpegDecoderPool(size=1, ffmpeg=ffmpeg)
+        self.published = []
+        self.service.publish = lambda topic, data=None: self.published.append((topic, data))
+
+
+    def _create_service(self, **config) -> SttService:
+        service = SttService('stt-test', {
+            'whisper_model': 'stub',
+            'cache_directory': os.path.join(self.directory.name, 'cache'),
+            **config,
+        })
+        service.engine = StubEngine()
+        return service
+
+
+    def test_stream_publishes_windows(self):
+        content = np.zeros(4000, dtype=np.int16).tobytes()
+        result = self.service._transcribe_stream('client/1', content, 'wav', 0.1)
+
+        self.assertEqual(['1600 samples', '1600 samples', '800 samples'], [segment['text'] for segment in result['segments']])
+        self.assertEqual([0.0, 0.1, 0.2], [segment['start'] for segment in result['segments']])
+        self.assertEqual([0.1, 0.2, 0.25], [segment['end'] for segment in result['segments']])
+        self.assertEqual([None, '1600 samples', '1600 samples'], self.service.engine.prompts)    # The previous window's text.
+        self.assertEqual(['client/1/partial'] * 4, [topic for topic, _ in self.published])
+        self.assertEqual([0, 1, 2, 3], [data['seq'] for _, data in self.published])
+        self.assertEqual({'seq': 3, 'end_of_stream': True}, self.published[-1][1])
+
+
+    def test_stream_ends_on_failure(self):
+        self.service.engine.fail_at = 2
+        content = np.zeros(4000, dtype=np.int16).tobytes()
+        with self.assertRaises(RuntimeError):
+            self.service._transcribe_stream('client/1', content, 'wav', 0.1)
+        self.assertEqual({'seq': 1, 'end_of_stream': True, 'error': "The model failed."}, self.published[-1][1])
+
+
+    def _audio(self, size=32000) -> bytes:
+        with open(AUDIO_PATH, 'rb') as file:
+            return file.read(size)
+
+
+    def _transcribe(self, content, **request):
+        return self.service.transcribe_content('stt/content', BinaryParcel({'content': content, **request}))
+
+
+    def test_cache_hit_and_miss(self):
+        content = self._audio()
+        first = self._transcribe(content)
+        self.assertEqual(first, self._transcribe(content))
+        self.assertEqual(1, len(self.service.engine.prompts))
+        self._transcribe(self._audio(32002))       # Other content.
+        self.assertEqual(2, len(self.service.engine.prompts))
+
+        stats = self.service.handle_stats('stt/stats', None)['cache']
+        self.assertEqual((1, 2), (stats['hits'], stats['misses']))
+        self.assertEqual(2, stats['tiers'][1]['entries'])       # Kept on disk too.
+
+
+    def test_cache_key_covers_the_options(self):
+        content = self._audio()
+        key = self.service._cache_key(content)
+        self.assertEqual(key, self._create_service()._cache_key(content))
+        self.assertNotEqual(key, self._create_service(whisper_model='other')._cache_key(content))
+        self.assertNotEqual(key, self.service._cache_key(content, window_seconds=30))
+        self.service.vad = EnergyVad()
+        self.assertNotEqual(key, self.service._cache_key(content))
+
+
+    def test_cached_stream_replayed(self):
+        content = self._audio()
+        first = self._transcribe(content, stream=True, window_seconds=0.5)
+        streamed = list(self.published)
+        self.published.clear()
+
+        self.assertEqual(first, self._transcribe(content, stream=True, window_seconds=0.5))
+        self.assertEqual(2, len(self.service.engine.prompts))      # One transcription, of two windows.
+        self.assertEqual(streamed, self.published)
+
+
+    def tearDown(self):
+        self.service.on_terminated()
+        self.directory.cleanup()
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import unittest
+
+import numpy as np
+
+from flowdepot.agents.stt.audio_decoder import SAMPLE_RATE
+from flowdepot.agents.stt.vad import EnergyVad, TimeMap
+
+
+FRAME = SAMPLE_RATE * 30 // 1000       # The default frame of EnergyVad.
+
+
+
+def audio_of(*parts) -> np.ndarray:
+    """Concatenate (frames, speech) parts: a 440 Hz tone for speech, faint noise for silence."""
+    rng = np.random.default_rng(0)
+    chunks = []
+    for frames, speech in parts:
+        t = np.arange(frames * FRAME) / SAMPLE_RATE
+        chunks.append(0.3 * np.sin(2 * np.pi * 440 * t) if speech else rng.normal(0, 1e-4, frames * FRAME))
+    return np.concatenate(chunks).astype(np.float32)
+
+
+
+class TestEnergyVad(unittest.TestCase):
+    def test_speech_regions(self):
+        vad = EnergyVad(padding_ms=0)
+        audio = audio_of((50, False), (40, True), (50, False), (30, True), (50, False))
+        self.assertEqual([(50 * FRAME, 90 * FRAME), (140 * FRAME, 170 * FRAME)], vad.speech_regions(audio))
+
+
+    def test_silence_only(self):
+        vad = EnergyVad()
+        audio = audio_of((100, False))
+        self.assertEqual([], vad.speech_regions(audio))
+        compacted, _ = vad.compact(audio)
+        self.assertEqual(0, len(compacted))
+        self.assertEqual(0.0, vad.stats()['speech_ratio'])
+
+
+    def test_short_pause_kept_and_short_burst_dropped(self):
+        vad = EnergyVad(padding_ms=0)
+        audio = audio_of((50, False), (30, True), (10, False), (30, True), (50, False), (3, True), (50, False))
+        self.assertEqual([(50 * FRAME, 120 * FRAME)], vad.speech_regions(audio))
+
+
+    def test_padding(self):
+        vad = EnergyVad(padding_ms=90)
+        audio = audio_of((50, False), (40, True), (50, False))
+        self.assertEqual([(47 * FRAME, 93 * FRAME)], vad.speech_regions(audio))
+
+
+    def test_compact_and_map_back(self):
+        vad = EnergyVad(padding_ms=0, gap_ms=100)
+        audio = audio_of((50, False), (40, True), (50, False), (30, True), (50, False))
+        compacted, time_map = vad.compact(audio)
+        self.assertEqual(70 * FRAME + vad.gap_samples, len(compacted))
+        self.assertAlmostEqual(50 * FRAME / SAMPLE_RATE, time_map.to_original(0.0))
+        second_start = (40 * FRAME + vad.gap_samples) / SAMPLE_RATE
+        self.assertAlmostEqual(140 * FRAME / SAMPLE_RATE + 0.1, time_map.to_original(second_start + 0.1))
+        self.assertAlmostEqual(70 / 220, vad.stats()['speech_ratio'])
+
+
+
+class TestTimeMap(unittest.TestCase):
+    def test_no_regions(self):
+        self.assertEqual(1.5, TimeMap([], 0).to_original(1.5))
+
+
+    def test_regions(self):
+        time_map = TimeMap([(SAMPLE_RATE, 2 * SAMPLE_RATE), (5 * SAMPLE_RATE, 6 * SAMPLE_RATE)], gap_samples=SAMPLE_RATE // 2)
+        self.assertEqual(1.25, time_map.to_original(0.25))
+        self.assertEqual(5.0, time_map.to_original(1.5))
+        self.assertEqual(5.75, time_map.to_original(2.25))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
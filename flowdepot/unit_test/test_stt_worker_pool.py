@@ -0,0 +1,77 @@
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import signal
+import time
+import unittest
+
+from flowdepot.agents.stt.engines import SttEngine
+from flowdepot.agents.stt.worker_pool import ForkedWorkerPool
+
+
+
+class StubEngine(SttEngine):
+    """Transcribes to the length of the audio; loads in the zygote only."""
+    name = "stub"
+
+    def load(self):
+        self.loaded_by = os.getpid()
+
+    def transcribe(self, audio, initial_prompt=None) -> dict:
+        return {'text': str(len(audio)), 'segments': [], 'pid': os.getpid(), 'loaded_by': self.loaded_by}
+
+
+
+class TestForkedWorkerPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = ForkedWorkerPool(StubEngine('stub'), workers=2, pin_cores=False)
+
+
+    def _processes(self):
+        return [self.pool._zygote.pid] + [worker.pid for worker in self.pool._workers]
+
+
+    def test_call_in_a_forked_worker(self):
+        result = self.pool.call('transcribe', [0.0] * 3).result(10)
+        self.assertEqual('3', result['text'])
+        self.assertIn(result['pid'], [worker.pid for worker in self.pool._workers])
+        self.assertEqual(self.pool._zygote.pid, result['loaded_by'])
+        self.pool.shutdown()
+
+
+    def test_dead_worker_forked_again(self):
+        old_pid = self.pool._workers[0].pid
+        os.kill(old_pid, signal.SIGKILL)
+        while self.pool._workers[0].is_alive():
+            time.sleep(0.01)
+        for _ in range(4):      # Either worker may take a call.
+            self.assertEqual('1', self.pool.call('transcribe', [0.0]).result(10)['text'])
+        self.assertNotEqual(old_pid, self.pool._workers[0].pid)
+        self.pool.shutdown()
+
+
+    def test_worker_exiting_before_it_connects(self):
+        self.pool._workers[0].cpus = [10 ** 6]      # sched_setaffinity() fails in the forked worker.
+        started = time.monotonic()
+        with self.assertRaises(RuntimeError):
+            self.pool._respawn(0)
+        self.assertLess(time.monotonic() - started, 5)
+
+        self.pool._workers[0] = self.pool._fork([])     # The next fork isn't blocked.
+        for _ in range(4):
+            self.assertEqual('1', self.pool.call('transcribe', [0.0]).result(10)['text'])
+        self.pool.shutdown()
+
+
+    def test_shutdown_ends_all_processes(self):
+        pids = self._processes()
+        self.pool.shutdown()
+        for pid in pids:
+            with self.assertRaises(ProcessLookupError):
+                os.kill(pid, 0)
+        self.assertFalse(os.path.exists(self.pool._directory))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,17 +2,16 @@ import os, sys
 from pathlib import Path
 import argparse
 
-from flowdepot.agents import wait_agent
-
 sys.path.append(str(Path(__file__).resolve().parent))
-from flowdepot.agent_loader import load_agent
+from flowdepot import startup_profile
 
-import logging
-from flowdepot.app_logger import init_logging
-logger:logging.Logger = init_logging()
+# The agent framework and the agents are imported after the arguments are parsed,
+# so --help does not pay their import time and --startup-profile can measure it.
 
 
 def run_agent(agent_dir: str, args=None):
+    from flowdepot.agent_loader import load_agent
+
     agent = load_agent(agent_dir)
     if agent:
         print(f"[AgentLoader] Loaded agent: {agent.__class__.__name__}")
@@ -27,15 +26,59 @@ def run_agent(agent_dir: str, args=None):
     return agent
 
 
+def run_host(agent_dirs: list[str]):
+    from flowdepot.agent_host import AgentHost
+    from flowdepot.config_registry import registry
+
+    system_config = registry.load(os.path.join('config', 'system.yaml'))
+    host_config = system_config.get('host', {})
+    host = AgentHost(system_config, max_workers=host_config.get('max_workers', 16))
+    host.load(agent_dirs)
+    host.start()
+    return host
+
+
+def print_startup_profile(agents: list):
+    names = [agent.name for agent in agents if hasattr(agent, 'name') and hasattr(agent, 'agent_id')]
+    if not startup_profile.wait_for(names):
+        print("[StartupProfile] Some agents are not activated yet.")
+    print(startup_profile.report())
+
+
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Start an AgentFlow agent.")
-    parser.add_argument("--agent_dir", "-a", help="Path to the agent directory (e.g. agents/speech/stt_agent)")
+    parser = argparse.ArgumentParser(description="Start AgentFlow agents.")
+    parser.add_argument("--agent_dir", "-a", nargs='+', help="Path(s) to the agent directory (e.g. agents/stt). More than one starts the host mode.")
+    parser.add_argument("--glob", "-g", help="Host all the agents whose manifest matches the pattern (e.g. 'agents/*/manifest.yaml').")
+    parser.add_argument("--startup-profile", action="store_true", help="Print the import time and the startup phase time of the agents.")
     # parser.add_argument("--input", "-i", help="Input file for agent (e.g. audio file for STT)")
     args = parser.parse_args()
 
-    agent_dir = os.path.join('flowdepot', args.agent_dir)
-    logger.debug(f"Agent directory: {agent_dir}")
-    # logger.debug(f"Input file: {args.input}")
-    if agent := run_agent(agent_dir):
-    # if agent := run_agent(args.agent_dir, args.input):
-        wait_agent(agent)
+    if args.startup_profile:
+        startup_profile.enable()
+
+    from flowdepot.agents import wait_agent
+    from flowdepot.agent_host import discover_agents
+
+    import logging
+    from flowdepot.app_logger import init_logging
+    logger:logging.Logger = init_logging()
+
+    agent_dirs = [os.path.join('flowdepot', agent_dir) for agent_dir in args.agent_dir or []]
+    if args.glob:
+        agent_dirs += discover_agents(os.path.join('flowdepot', args.glob))
+    if not agent_dirs:
+        parser.error("Either --agent_dir or --glob is required.")
+    logger.debug(f"Agent directories: {agent_dirs}")
+
+    if len(agent_dirs) == 1 and not args.glob:
+        # logger.debug(f"Input file: {args.input}")
+        if agent := run_agent(agent_dirs[0]):
+        # if agent := run_agent(args.agent_dir, args.input):
+            if args.startup_profile:
+                print_startup_profile([agent])
+            wait_agent(agent)
+    else:
+        host = run_host(agent_dirs)
+        if args.startup_profile:
+            print_startup_profile(host.agents)
+        wait_agent(host)